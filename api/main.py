@@ -1,5 +1,7 @@
 ﻿import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from api.v1.songs import router as songs_router
 from api.v1.recognition import router as recog_router
 from api.v1.song_recommendations import router as rec_router, playlist_router
@@ -7,10 +9,22 @@ from api.v1 import auth as auth_router
 from api.v1 import user_playlists as user_playlists_router
 from api.v1 import user_history as user_history_router
 from fastapi.middleware.cors import CORSMiddleware
+from core.repository.metadata_cache import metadata_cache_stats
+from core.io.recording import MULTIPART_OVERHEAD_BYTES, UPLOAD_MAX_BYTES, UploadSizeLimitMiddleware
+from api.v1.recognition import BATCH_MAX_FILES, RECOGNITION_SYNC_PRELOAD, preload_sync_index
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Synchronous recognition matches in this process; load its index before serving
+    if RECOGNITION_SYNC_PRELOAD:
+        await run_in_threadpool(preload_sync_index)
+    yield
+
 
 app = FastAPI(
     title="Music Recognition and Recommendation API",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS (if mobile/web clients need it)
@@ -21,6 +35,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Turn away oversized audio uploads before their bodies are read
+if UPLOAD_MAX_BYTES:
+    app.add_middleware(
+        UploadSizeLimitMiddleware,
+        limits={
+            "/recognize/batch": (UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES) * BATCH_MAX_FILES,
+            "/recognize": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES,
+        },
+    )
+
 # Include v1 routers
 app.include_router(songs_router)
 app.include_router(recog_router)
@@ -37,3 +61,11 @@ def health_check():
     Simple health check endpoint.
     """
     return {"status": "ok"}
+
+
+@app.get("/health/cache", tags=["health"])
+def cache_stats():
+    """
+    Hit/miss statistics of this process's song, artist and album metadata caches.
+    """
+    return metadata_cache_stats()
@@ -1,25 +1,432 @@
-﻿from fastapi import APIRouter, UploadFile, Depends, HTTPException, status
-from typing import Dict, List, Any, Optional
+﻿import asyncio
+import json
+import os
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Any, Optional, Tuple
 
-from core.io.recording import save_temp
-from worker.tasks import celery_app, recognize_audio_task
+from core.io.recording import UPLOAD_MAX_BYTES, UploadTooLarge, save_temp_async
+from core.cache.lru import LRUTTLCache
+from core.cache.recognition import get_recognition_cache, content_key, content_key_from_file
+from core.compute.pool import BoundedExecutor
+from core.fingerprint.extractor import (
+    FingerPrinter,
+    PCM_FORMAT_S16LE,
+    PCM_SAMPLE_RATES,
+    extract_fingerprint_from_bytes,
+    extract_fingerprint_from_pcm,
+    get_algorithm,
+)
+from core.fingerprint.versions import get_active_version
+from core.fingerprint.wire import (
+    FORMAT_VERSION as WIRE_FORMAT_VERSION,
+    MEDIA_TYPE as WIRE_MEDIA_TYPE,
+    IncompatibleFingerprints,
+    WireFormatError,
+    decode_fingerprints,
+)
+from worker.lifecycle import ensure_connections, preload_indexes
+from worker.result_channel import get_result_subscriber
+from worker.tasks import (
+    celery_app,
+    recognize_audio_task,
+    recognize_batch_task,
+    recognize_fingerprints,
+    recognize_fingerprints_task,
+)
 from celery.result import AsyncResult
 
 router = APIRouter(prefix="/recognize", tags=["recognition"])
 
+# Task ids of cache hits; polling them reads the cache instead of the result backend
+CACHED_TASK_PREFIX = "cached:"
+
+# Maximum number of clips accepted by one batch request
+BATCH_MAX_FILES = int(os.getenv("RECOGNITION_BATCH_MAX_FILES", "50"))
+
+# Synchronous recognition: uploads above this size go through Celery instead
+SYNC_MAX_BYTES = int(os.getenv("RECOGNITION_SYNC_MAX_BYTES", str(2 * 1024 * 1024)))
+# Extraction pool owned by each API process, and how many clips it accepts at once
+SYNC_POOL_WORKERS = int(os.getenv("RECOGNITION_SYNC_POOL_WORKERS", "2"))
+SYNC_MAX_PENDING = int(os.getenv("RECOGNITION_SYNC_MAX_PENDING", "0")) or SYNC_POOL_WORKERS * 2
+
+_sync_pool: Optional[BoundedExecutor] = None
+
+# Load the fingerprint index the synchronous endpoints match against when the API process starts
+RECOGNITION_SYNC_PRELOAD = os.getenv("RECOGNITION_SYNC_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# Most landmarks accepted by POST /recognize/hashes (~10 per second of audio after reduction)
+HASHES_MAX_COUNT = int(os.getenv("RECOGNITION_HASHES_MAX_COUNT", "20000"))
+
+# Push delivery: default/maximum long-poll wait, SSE stream lifetime and keep-alive interval (seconds)
+RESULT_WAIT_TIMEOUT = float(os.getenv("RESULT_WAIT_TIMEOUT", "25"))
+RESULT_WAIT_MAX_TIMEOUT = float(os.getenv("RESULT_WAIT_MAX_TIMEOUT", "60"))
+RESULT_STREAM_TIMEOUT = float(os.getenv("RESULT_STREAM_TIMEOUT", "120"))
+RESULT_STREAM_KEEPALIVE = float(os.getenv("RESULT_STREAM_KEEPALIVE", "15"))
+
+# Content keys of tasks enqueued by this process, so their results can be cached when fetched
+_pending_content_keys = LRUTTLCache(maxsize=10000, ttl=3600)
+
+
+def _get_cached_result(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        return get_recognition_cache().get_by_content(key)
+    except Exception as e:
+        print(f"API: Recognition cache lookup failed: {e}")
+        return None
+
+
+def _cache_result(key: str, result: Dict[str, Any]) -> None:
+    try:
+        get_recognition_cache().put_by_content(key, result)
+    except Exception as e:
+        print(f"API: Recognition cache store failed: {e}")
+
+
+def _lookup_upload(key: str) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Cached result of an upload and the algorithm version to recognize it
+    with. Both may read Redis or MongoDB, so async handlers run this in the
+    thread pool.
+    """
+    return _get_cached_result(key), get_active_version()
+
+
+def _finish_result(task_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Cache a finished task's successful result under its upload's content key."""
+    key = _pending_content_keys.get(task_id)
+    if key and result.get("status") == "SUCCESS":
+        _cache_result(key, result)
+    return result
+
+
+def _read_task_result(task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a task's result from the cache or the Celery result backend.
+    Returns None while the task is pending.
+    """
+    if task_id.startswith(CACHED_TASK_PREFIX):
+        result = _get_cached_result(task_id[len(CACHED_TASK_PREFIX):])
+        if result is None:
+            return {"status": "FAILURE", "error": "Cached result expired"}
+        return result
+
+    task_result = AsyncResult(task_id, app=celery_app)
+
+    if task_result.state == 'PENDING':
+        return None
+    elif task_result.state == 'FAILURE':
+        return {"status": "FAILURE", "error": str(task_result.info)}
+
+    # Task is ready, return the result
+    return task_result.get()
+
+
+def get_sync_pool() -> BoundedExecutor:
+    """Return this process's extraction pool for synchronous recognition."""
+    global _sync_pool
+    if _sync_pool is None:
+        _sync_pool = BoundedExecutor(max_workers=SYNC_POOL_WORKERS, max_pending=SYNC_MAX_PENDING)
+    return _sync_pool
+
+
+def preload_sync_index() -> None:
+    """
+    Open this process's connections and load the active fingerprint index,
+    using the worker's preloader, so the first synchronous request does not
+    pay for either.
+    """
+    ensure_connections()
+    preload_indexes(["fingerprint index"])
+
+
+def _upload_size(file: UploadFile) -> int:
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Audio file too large (max {max_bytes} bytes)."
+    )
+
+
+def _reject_oversized(file: UploadFile) -> None:
+    """Reject an upload by its declared size before it is hashed or copied."""
+    if UPLOAD_MAX_BYTES and file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise _too_large(UPLOAD_MAX_BYTES)
+
+
+async def _save_upload(file: UploadFile) -> str:
+    """Spool an upload to disk for the worker; oversized uploads are rejected with 413."""
+    try:
+        return await save_temp_async(file, max_bytes=UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        raise _too_large(e.max_bytes)
+
+
+async def _enqueue(file: UploadFile, key: str, sample_rate: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Save the upload and dispatch it to the Celery worker.
+
+    :param sample_rate: set for raw pcm_s16le uploads, which the worker
+        fingerprints from their samples instead of decoding
+    """
+    path = await _save_upload(file)
+
+    if sample_rate is None:
+        task = recognize_audio_task.delay(path, content_key=key)
+    else:
+        task = recognize_audio_task.delay(path, content_key=key, sample_rate=sample_rate)
+    _pending_content_keys.set(task.id, key)
+
+    return {"task_id": task.id}
+
+
+def _enqueue_fingerprints(query_fingerprints, key: str, version: int) -> Dict[str, Any]:
+    """Dispatch fingerprints computed in the API to the Celery worker for matching."""
+    task = recognize_fingerprints_task.delay(query_fingerprints, content_key=key, version=version)
+    _pending_content_keys.set(task.id, key)
+
+    return {"task_id": task.id}
+
+
+def _check_format(format: Optional[str], sample_rate: int) -> None:
+    if format is None:
+        return
+    if format != PCM_FORMAT_S16LE:
+        raise HTTPException(status_code=400, detail=f"Unsupported format; use {PCM_FORMAT_S16LE} or omit it.")
+    if sample_rate not in PCM_SAMPLE_RATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported sample_rate; use one of {', '.join(map(str, PCM_SAMPLE_RATES))}."
+        )
+
+
+def _pcm_content_key(data: bytes, sample_rate: int) -> str:
+    # The same samples at another rate are different audio
+    return content_key(f"{PCM_FORMAT_S16LE}:{sample_rate}:".encode() + data)
+
+
+def _check_pcm(data: bytes) -> None:
+    if len(data) % 2:
+        raise HTTPException(status_code=400, detail="PCM body must contain whole 16-bit samples.")
+
+
+async def _fingerprint_pcm(data: bytes, sample_rate: int, version: int):
+    """
+    Fingerprint raw PCM on the extraction pool. Returns None when the pool
+    is full; the caller then hands the upload to the Celery worker.
+    """
+    future = get_sync_pool().try_submit(extract_fingerprint_from_pcm, data, sample_rate, version)
+    if future is None:
+        return None
+    return await asyncio.wrap_future(future)
+
+
+def _match_sync(query_fingerprints, key: str, version: int) -> Dict[str, Any]:
+    ensure_connections()
+    return recognize_fingerprints(query_fingerprints, content_key=key, version=version)
+
+
+def _sync_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an in-request recognition result to the response of the polling endpoint."""
+    if result.get("status") == "NO_MATCH":
+        raise HTTPException(status_code=404, detail="No match found.")
+    if result.get("status") == "ERROR":
+        raise HTTPException(status_code=500, detail=result.get("error", "Recognition failed."))
+    return result
+
 @router.post("/", status_code=status.HTTP_202_ACCEPTED)
-async def start_recognition(file: UploadFile):
+async def start_recognition(
+    file: UploadFile,
+    format: Optional[str] = Form(None),
+    sample_rate: int = Form(FingerPrinter.SAMPLE_RATE),
+):
     """
     Accepts an audio file and starts the recognition process in the background.
+
+    If the same bytes were recognized recently, the cached result is returned
+    inline (status and results next to a task_id) and no task is enqueued.
+
+    With format=pcm_s16le the file is raw 16-bit little-endian mono PCM at
+    sample_rate (22050 Hz avoids resampling). It is fingerprinted in memory
+    here, with no container decode or temp file, and only the fingerprints
+    are sent to the worker. Bodies larger than RECOGNITION_SYNC_MAX_BYTES, or
+    arriving while this process's extraction pool is full, are spooled and
+    fingerprinted by the worker instead.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided.")
 
-    tmp_dir = "tmp"
-    path = save_temp(file, dir=tmp_dir)
+    _check_format(format, sample_rate)
+    _reject_oversized(file)
+
+    if format == PCM_FORMAT_S16LE:
+        data = await file.read()
+        _check_pcm(data)
+        key = await run_in_threadpool(_pcm_content_key, data, sample_rate)
+    else:
+        key = await run_in_threadpool(content_key_from_file, file.file)
+    cached, version = await run_in_threadpool(_lookup_upload, key)
+    if cached is not None:
+        return {"task_id": f"{CACHED_TASK_PREFIX}{key}", **cached}
+
+    if format == PCM_FORMAT_S16LE:
+        query_fingerprints = None
+        if len(data) <= SYNC_MAX_BYTES:
+            try:
+                query_fingerprints = await _fingerprint_pcm(data, sample_rate, version)
+            except Exception as e:
+                print(f"API: Could not fingerprint {file.filename}: {e}")
+                raise HTTPException(status_code=400, detail="Could not decode audio file.")
+        if query_fingerprints is None:
+            return await _enqueue(file, key, sample_rate)
+        return _enqueue_fingerprints(query_fingerprints, key, version)
 
     # Dispatch the task to the Celery worker
-    task = recognize_audio_task.delay(path)
+    return await _enqueue(file, key)
+
+
+@router.post("/sync")
+async def recognize_sync(
+    file: UploadFile,
+    response: Response,
+    format: Optional[str] = Form(None),
+    sample_rate: int = Form(FingerPrinter.SAMPLE_RATE),
+):
+    """
+    Recognizes a short clip within the request and returns the result directly
+    (same body as GET /recognize/result/{task_id}). Accepts the same format
+    and sample_rate fields as POST /recognize/.
+
+    Clips larger than RECOGNITION_SYNC_MAX_BYTES, or arriving while this
+    process's extraction pool is full, are handed to the Celery worker instead;
+    the response is then 202 with a task_id to poll, like POST /recognize/.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No file provided.")
+
+    _check_format(format, sample_rate)
+    _reject_oversized(file)
+
+    pcm = format == PCM_FORMAT_S16LE
+    if pcm:
+        data = await file.read()
+        _check_pcm(data)
+        key = await run_in_threadpool(_pcm_content_key, data, sample_rate)
+    else:
+        key = await run_in_threadpool(content_key_from_file, file.file)
+    # Extracted and matched with the same algorithm version
+    cached, version = await run_in_threadpool(_lookup_upload, key)
+    if cached is not None:
+        result = cached
+    else:
+        future = None
+        if _upload_size(file) <= SYNC_MAX_BYTES:
+            if pcm:
+                future = get_sync_pool().try_submit(extract_fingerprint_from_pcm, data, sample_rate, version)
+            else:
+                data = await file.read()
+                future = get_sync_pool().try_submit(
+                    extract_fingerprint_from_bytes, data, os.path.splitext(file.filename)[1], version
+                )
+        if future is None:
+            response.status_code = status.HTTP_202_ACCEPTED
+            return await _enqueue(file, key, sample_rate if pcm else None)
+
+        try:
+            query_fingerprints = await asyncio.wrap_future(future)
+        except Exception as e:
+            print(f"API: Could not fingerprint {file.filename}: {e}")
+            raise HTTPException(status_code=400, detail="Could not decode audio file.")
+        if not query_fingerprints:
+            result = {"status": "NO_MATCH"}
+        else:
+            result = await run_in_threadpool(_match_sync, query_fingerprints, key, version)
+
+    return _sync_response(result)
+
+
+@router.get("/hashes/version")
+def fingerprint_wire_version():
+    """
+    Versions a client-side extractor must declare for POST /recognize/hashes.
+    They follow the algorithm version serving queries.
+    """
+    algorithm = get_algorithm(get_active_version())
+    return {
+        "media_type": WIRE_MEDIA_TYPE,
+        "format_version": WIRE_FORMAT_VERSION,
+        "algorithm_version": algorithm.ALGORITHM_VERSION,
+        "params_signature": f"{algorithm.params_signature():08x}",
+    }
+
+
+@router.post("/hashes")
+async def recognize_hashes(request: Request):
+    """
+    Recognizes precomputed fingerprints, skipping upload decode and extraction.
+
+    The body is a binary fingerprint message (see core/fingerprint/wire.py).
+    Responds like POST /recognize/sync: 200 with the result or 404 when
+    nothing matches. Malformed messages get 400. Messages from an extractor
+    with another algorithm version or parameters get 409, since their hashes
+    would never match the index.
+    """
+    body = await request.body()
+    version = await run_in_threadpool(get_active_version)
+    try:
+        query_fingerprints = decode_fingerprints(body, max_count=HASHES_MAX_COUNT, version=version)
+    except IncompatibleFingerprints as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except WireFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = content_key(body)
+    cached = await run_in_threadpool(_get_cached_result, key)
+    if cached is not None:
+        result = cached
+    elif not query_fingerprints:
+        result = {"status": "NO_MATCH"}
+    else:
+        result = await run_in_threadpool(_match_sync, query_fingerprints, key, version)
+
+    return _sync_response(result)
+
+
+@router.post("/batch", status_code=status.HTTP_202_ACCEPTED)
+async def start_batch_recognition(files: List[UploadFile] = File(...)):
+    """
+    Accepts several audio clips and recognizes them in a single background task.
+
+    Poll GET /recognize/result/{task_id}; its results list holds one entry per
+    clip, in upload order, each with filename, status and results.
+    """
+    if not files or any(not f.filename for f in files):
+        raise HTTPException(status_code=400, detail="No file provided.")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BATCH_MAX_FILES} clips per batch."
+        )
+    for f in files:
+        _reject_oversized(f)
+
+    paths = []
+    try:
+        for f in files:
+            paths.append(await _save_upload(f))
+    except HTTPException:
+        for path in paths:
+            os.remove(path)
+        raise
+
+    task = recognize_batch_task.delay(paths, [f.filename for f in files])
 
     return {"task_id": task.id}
 
@@ -40,17 +447,70 @@ def get_recognition_result(task_id: str):
             - album_name: Name of the album (if available)
             - album_image: URL or path to album image (if available)
     """
-    task_result = AsyncResult(task_id, app=celery_app)
-
-    if task_result.state == 'PENDING':
+    result = _read_task_result(task_id)
+    if result is None:
         return {"status": "PENDING"}
-    elif task_result.state == 'FAILURE':
-        return {"status": "FAILURE", "error": str(task_result.info)}
-
-    # Task is ready, return the result
-    result = task_result.get()
 
+    result = _finish_result(task_id, result)
     if result.get("status") == "NO_MATCH":
         raise HTTPException(status_code=404, detail="No match found.")
 
     return result
+
+
+@router.get("/result/{task_id}/wait")
+async def wait_for_recognition_result(task_id: str, timeout: float = Query(RESULT_WAIT_TIMEOUT, gt=0)):
+    """
+    Long-poll variant of GET /recognize/result/{task_id}.
+
+    Holds the request until the worker publishes the result or `timeout`
+    seconds pass (capped at RESULT_WAIT_MAX_TIMEOUT); on timeout the body is
+    {"status": "PENDING"} and the client simply asks again.
+    """
+    result = await get_result_subscriber().wait(
+        task_id, min(timeout, RESULT_WAIT_MAX_TIMEOUT), fetch=_read_task_result
+    )
+    if result is None:
+        return {"status": "PENDING"}
+
+    result = await run_in_threadpool(_finish_result, task_id, result)
+    if result.get("status") == "NO_MATCH":
+        raise HTTPException(status_code=404, detail="No match found.")
+    return result
+
+
+@router.get("/result/{task_id}/stream")
+async def stream_recognition_result(task_id: str):
+    """
+    Server-sent events stream for a recognition task.
+
+    Sends keep-alive comments while the task runs and a single `result` event
+    (same body as GET /recognize/result/{task_id}, NO_MATCH included) when it
+    finishes. Gives up with a `timeout` event after RESULT_STREAM_TIMEOUT seconds.
+    """
+    async def events():
+        # One wait for the whole stream, so the backend is read only when it starts
+        waiter = asyncio.ensure_future(
+            get_result_subscriber().wait(task_id, RESULT_STREAM_TIMEOUT, fetch=_read_task_result)
+        )
+        try:
+            while True:
+                done, _ = await asyncio.wait({waiter}, timeout=RESULT_STREAM_KEEPALIVE)
+                if not done:
+                    yield ": keep-alive\n\n"
+                    continue
+                result = waiter.result()
+                if result is None:
+                    yield "event: timeout\ndata: {\"status\": \"PENDING\"}\n\n"
+                    return
+                result = await run_in_threadpool(_finish_result, task_id, result)
+                yield f"event: result\ndata: {json.dumps(result, default=float)}\n\n"
+                return
+        finally:
+            waiter.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,8 +1,11 @@
-﻿from typing import List, Dict
+﻿from typing import List, Dict, Optional
 import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
+from core.reco.ann import FEATURE_ANN_MIN_SONGS, IVFIndex
 from core.reco.builder import PlaylistBuilder
+from core.reco.cascade import FEATURE_SEARCH_CASCADE, CascadeSearchEngine
+from core.reco.engine import build_cascade, build_index, catalog_digest
 from db.sql.database import get_db
 from core.repository.song_feature_repository import SongFeatureRepository
 from core.repository.history_repository import RecognitionHistoryRepository
@@ -14,8 +17,13 @@ from collections import Counter
 MONGO_URI_PLAYLISTS = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME_PLAYLISTS = os.getenv("DB_NAME", "tuneleap_db")
 
+# Where the recommendation index is saved and reloaded from; unset keeps it in memory only
+FEATURE_ANN_INDEX_PATH = os.getenv("FEATURE_ANN_INDEX_PATH", "")
+
 _feature_map_cache: Dict[int, np.ndarray] = {}
 _feature_map_loaded = False
+_feature_index: Optional[IVFIndex] = None
+_feature_cascade: Optional[CascadeSearchEngine] = None
 
 
 def get_feature_map_from_db() -> Dict[int, np.ndarray]:
@@ -33,6 +41,39 @@ def get_feature_map_from_db() -> Dict[int, np.ndarray]:
     return _feature_map_cache
 
 
+def get_feature_index(feature_map: Dict[int, np.ndarray]) -> Optional[IVFIndex]:
+    """
+    Approximate index for catalogs of at least FEATURE_ANN_MIN_SONGS songs,
+    built once per feature map load. A saved index is reused only if it was
+    built from exactly these songs and vectors (see catalog_digest).
+    """
+    global _feature_index
+    if len(feature_map) < FEATURE_ANN_MIN_SONGS:
+        return None
+    if _feature_index is None:
+        if FEATURE_ANN_INDEX_PATH and os.path.exists(FEATURE_ANN_INDEX_PATH):
+            index = IVFIndex.load(FEATURE_ANN_INDEX_PATH)
+            if index.tag == catalog_digest(feature_map):
+                _feature_index = index
+                return _feature_index
+            print(f"API: Saved recommendation index at {FEATURE_ANN_INDEX_PATH} is out of date")
+        print(f"API: Building recommendation index over {len(feature_map)} songs")
+        _feature_index = build_index(feature_map)
+        if FEATURE_ANN_INDEX_PATH:
+            _feature_index.save(FEATURE_ANN_INDEX_PATH)
+    return _feature_index
+
+
+def get_feature_cascade(feature_map: Dict[int, np.ndarray]) -> Optional[CascadeSearchEngine]:
+    """Coarse-to-fine engine when FEATURE_SEARCH_CASCADE is set, built once per feature map load."""
+    global _feature_cascade
+    if not FEATURE_SEARCH_CASCADE:
+        return None
+    if _feature_cascade is None or _feature_cascade.features is not feature_map:
+        _feature_cascade = build_cascade(feature_map)
+    return _feature_cascade
+
+
 # Routers
 router = APIRouter(prefix="/recommend", tags=["recommendation"])
 playlist_router = APIRouter(prefix="/playlist", tags=["playlists"])
@@ -45,7 +86,9 @@ def get_builder() -> PlaylistBuilder:
     if not feature_map:  # Handle case where map might be empty after attempted load
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                             detail="Recommendation engine not ready, no features.")
-    return PlaylistBuilder(feature_map)
+    index = get_feature_index(feature_map)
+    cascade = get_feature_cascade(feature_map) if index is None else None
+    return PlaylistBuilder(feature_map, index=index, cascade=cascade)
 
 
 # /recommend/{song_id}
@@ -172,8 +215,9 @@ def recommend_similar_songs(
 # Endpoint to trigger a reload of the feature map (e.g., for admin use)
 @router.post("/admin/reload-features", include_in_schema=False)
 def admin_reload_features():
-    global _feature_map_loaded
+    global _feature_map_loaded, _feature_index
     _feature_map_loaded = False  # Force reload on next request
+    _feature_index = None
     try:
         get_feature_map_from_db()  # Attempt to reload immediately
         return {"message": "Feature map reload triggered and attempted."}
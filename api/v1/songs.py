@@ -14,13 +14,13 @@ def get_song(
     Retrieve a song by its ID.
     """
     repo = SongRepository(db)
-    song = repo.get_by_id(song_id)
+    song = repo.get_cached(song_id)
     if not song:
         raise HTTPException(status_code=404, detail="Song not found")
     return {
-        "id": song.id,
-        "title": song.title,
-        "artist_id": song.artist_id,
-        "album_id": song.album_id,
-        "duration": song.duration
+        "id": song["id"],
+        "title": song["title"],
+        "artist_id": song["artist_id"],
+        "album_id": song["album_id"],
+        "duration": song["duration"]
     }
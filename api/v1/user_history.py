@@ -19,7 +19,7 @@ def record_recognition_event(
 ):
     # Ensure song exists before recording history
     song_repo = SongRepository(db)
-    song = song_repo.get_by_id(history_in.song_id)
+    song = song_repo.get_cached(history_in.song_id)
     if not song:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
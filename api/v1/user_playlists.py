@@ -79,7 +79,7 @@ def add_song_to_my_playlist(
     playlist_repo = PlaylistRepository(db)
     # Optional: Verify song exists using SongRepository
     song_repo = SongRepository(db)
-    if not song_repo.get_by_id(item_in.song_id):
+    if not song_repo.get_cached(item_in.song_id):
          raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Song with id {item_in.song_id} not found")
 
     playlist_item = playlist_repo.add_song_to_playlist(playlist_id=playlist_id, song_id=item_in.song_id, user_id=current_user.id)
@@ -0,0 +1,63 @@
+"""
+IVF approximate search: recall@k and latency against exact search.
+
+A synthetic catalog of clustered, unit-length 55-dimensional vectors is put
+in an IVFIndex and queried at several nprobe values. Recall is the share of
+the exact top k (one matrix-vector product over every vector) the index
+returns.
+
+Usage:
+    python -m benchmarks.bench_ann --songs 1000000 --nprobe 4 8 16 32 64
+"""
+import argparse
+import time
+
+import numpy as np
+
+from core.reco.ann import IVFIndex, recall_at_k, unit_rows
+from core.reco.search import FEATURE_DIM
+
+
+def synthetic_catalog(songs: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    styles = rng.normal(size=(256, FEATURE_DIM))
+    vectors = styles[rng.integers(0, len(styles), songs)] + 0.5 * rng.standard_normal((songs, FEATURE_DIM))
+    return np.arange(1, songs + 1, dtype=np.int64), unit_rows(vectors).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    ids, vectors = synthetic_catalog(args.songs)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)] + 0.3 * rng.standard_normal(
+        (args.queries, FEATURE_DIM))
+    queries = unit_rows(queries).astype(np.float32)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids, vectors)
+    print(f"{args.songs} songs, {index.n_lists} lists, built in {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    for query in queries:
+        np.argpartition(-(vectors @ query), args.k - 1)[:args.k]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"{'nprobe':>8}{'recall@' + str(args.k):>12}{'ms':>10}{'speed-up':>10}")
+    print(f"{'exact':>8}{1.0:>12.3f}{exact_ms:>10.2f}{'1x':>10}")
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, args.k, nprobe)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = recall_at_k(index, ids, vectors, queries, args.k, nprobe)
+        print(f"{nprobe:>8}{recall:>12.3f}{ms:>10.2f}{exact_ms / ms:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
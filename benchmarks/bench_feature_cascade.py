@@ -0,0 +1,58 @@
+"""
+Feature search: single-stage FeatureSearchEngine vs coarse-to-fine CascadeSearchEngine.
+
+The same synthetic catalogs as bench_feature_search are searched end to end
+(query in, top 10 out) by both engines. Memory is what each engine holds on
+top of the shared feature vectors; recall is the share of the single-stage
+top 10 the cascade returns.
+
+Usage:
+    python -m benchmarks.bench_feature_cascade --songs 100000 1000000 --shortlist 200 500 1000
+
+Each shortlist is run with float16 and float32 coarse rows.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_feature_search import synthetic_catalog
+from core.reco.cascade import CascadeSearchEngine
+from core.reco.search import FEATURE_DIM, FeatureSearchEngine
+
+
+def _time_ms(engine, queries):
+    start = time.perf_counter()
+    results = [engine.search(q, k=10, threshold=0.3) for q in queries]
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--shortlist", type=int, nargs="+", default=[200, 500, 1000])
+    args = parser.parse_args()
+
+    print(f"{'songs':>10}{'engine':>24}{'MB':>8}{'ms':>10}{'recall@10':>11}")
+    for songs in args.songs:
+        features = synthetic_catalog(songs)
+        rng = np.random.default_rng(1)
+        queries = [features[int(i)] + 0.5 * rng.standard_normal(FEATURE_DIM)
+                   for i in rng.integers(1, songs + 1, args.queries)]
+        # Built without the ANN index, so the baseline is exact
+        single = FeatureSearchEngine(features, ann_min_songs=songs + 1)
+        single_ms, expected = _time_ms(single, queries)
+        print(f"{songs:>10}{'single-stage':>24}{single.nbytes / 2 ** 20:>8.1f}{single_ms:>10.2f}{1.0:>11.3f}")
+        for dtype in ("float16", "float32"):
+            for shortlist in args.shortlist:
+                cascade = CascadeSearchEngine(features, shortlist=shortlist, dtype=dtype)
+                cascade_ms, found = _time_ms(cascade, queries)
+                hits = sum(len({s for s, _ in e} & {s for s, _ in f}) for e, f in zip(expected, found))
+                total = max(1, sum(len(e) for e in expected))
+                print(f"{songs:>10}{f'cascade {dtype} {shortlist}':>24}{cascade.nbytes / 2 ** 20:>8.1f}"
+                      f"{cascade_ms:>10.2f}{hits / total:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
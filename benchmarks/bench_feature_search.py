@@ -0,0 +1,69 @@
+"""
+Feature fallback search: per-song loop vs FeatureSearchEngine.
+
+Synthetic catalogs of 55-dimensional feature vectors are searched with the
+worker's original loop (weighted cosine per song, filter, sort) and with the
+engine's matrix product + argpartition. The loop is only timed up to
+--loop-max songs, since it takes tens of seconds per query beyond that.
+Results are checked to be identical wherever both run.
+
+Usage:
+    python -m benchmarks.bench_feature_search --songs 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from core.reco.search import FEATURE_DIM, FeatureSearchEngine, weighted_cosine_similarity
+
+
+def synthetic_catalog(songs: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    styles = rng.normal(size=(64, FEATURE_DIM))
+    vectors = styles[rng.integers(0, len(styles), songs)] + 0.4 * rng.standard_normal((songs, FEATURE_DIM))
+    return dict(zip(range(1, songs + 1), vectors))
+
+
+def loop_search(query, features, threshold=0.3, k=10):
+    similarities = [(song_id, weighted_cosine_similarity(query, stored)) for song_id, stored in features.items()]
+    filtered = [(sid, sim) for sid, sim in similarities if sim >= threshold]
+    filtered.sort(key=lambda x: x[1], reverse=True)
+    return filtered[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--loop-max", type=int, default=100_000, help="largest catalog to time the loop on")
+    args = parser.parse_args()
+
+    print(f"{'songs':>10}{'build s':>10}{'engine ms':>12}{'loop ms':>12}{'speed-up':>10}{'equal':>8}")
+    for songs in args.songs:
+        features = synthetic_catalog(songs)
+        rng = np.random.default_rng(1)
+        queries = [features[int(i)] + 0.5 * rng.standard_normal(FEATURE_DIM)
+                   for i in rng.integers(1, songs + 1, args.queries)]
+
+        start = time.perf_counter()
+        engine = FeatureSearchEngine(features)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine_results = [engine.search(q, k=10, threshold=0.3) for q in queries]
+        engine_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        loop_ms, speedup, equal = "-", "-", "-"
+        if songs <= args.loop_max:
+            loop_queries = queries[:max(1, min(len(queries), 2_000_000 // songs))]
+            start = time.perf_counter()
+            loop_results = [loop_search(q, features) for q in loop_queries]
+            loop_time = (time.perf_counter() - start) * 1000 / len(loop_queries)
+            loop_ms, speedup = f"{loop_time:.1f}", f"{loop_time / engine_ms:.0f}x"
+            equal = str(loop_results == engine_results[:len(loop_queries)])
+        print(f"{songs:>10}{build_seconds:>10.2f}{engine_ms:>12.2f}{loop_ms:>12}{speedup:>10}{equal:>8}")
+
+
+if __name__ == "__main__":
+    main()
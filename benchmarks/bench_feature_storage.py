@@ -0,0 +1,59 @@
+"""
+SongFeature storage: list of doubles vs packed float32 bytes.
+
+Synthetic catalogs are BSON-encoded in both document formats, as MongoDB
+would return them, then decoded and turned into the song_id -> vector map
+the feature store uses: per-document np.array(list) for the old format, and
+SongFeatureRepository's one-matrix np.frombuffer load for the new one.
+Reports document size, decode + load time and the memory of the loaded map.
+
+Usage:
+    python -m benchmarks.bench_feature_storage --songs 10000 100000
+"""
+import argparse
+import time
+import tracemalloc
+
+import bson
+import numpy as np
+
+from core.repository.song_feature_repository import _decode_vectors
+from db.nosql.collections import encode_feature_vector
+
+
+def _load_lists(docs):
+    return {doc["song_id"]: np.array(doc["feature_vector"]) for doc in docs}
+
+
+def _measure(raw, load):
+    start = time.perf_counter()
+    feature_map = load(bson.decode_all(raw))
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    feature_map = load(bson.decode_all(raw))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, size, feature_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'songs':>10}{'format':>10}{'doc bytes':>11}{'load s':>9}{'map MB':>9}")
+    for songs in args.songs:
+        vectors = np.random.default_rng(0).normal(size=(songs, 55))
+        formats = {
+            "list": ([{"song_id": i, "feature_vector": v.tolist()} for i, v in enumerate(vectors)], _load_lists),
+            "float32": ([dict(zip(("vector", "vector_dtype", "vector_dim"), encode_feature_vector(v)), song_id=i)
+                         for i, v in enumerate(vectors)], _decode_vectors),
+        }
+        for name, (docs, load) in formats.items():
+            raw = b"".join(bson.encode(doc) for doc in docs)
+            seconds, size, _ = _measure(raw, load)
+            print(f"{songs:>10}{name:>10}{len(raw) // songs:>11}{seconds:>9.2f}{size / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compare fingerprint lookup latency of the MongoDB and SQLite indexes on the same catalog.
+
+A synthetic catalog is written to a scratch MongoDB database, imported into a
+SQLite index with the production importer, and both are queried with the same
+hash sets (the size of a typical recognition query).
+
+Usage:
+    python -m benchmarks.bench_fingerprint_index --songs 2000 --fingerprints-per-song 3000
+    python -m benchmarks.bench_fingerprint_index --mongomock   # no MongoDB server needed
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import mongoengine
+
+from db.nosql.collections import Fingerprint
+from core.repository.fingerprint_repository import FingerprintRepository
+from core.repository.sqlite_fingerprint_repository import SQLiteFingerprintRepository
+
+
+def _random_hash(rng: random.Random) -> str:
+    return f"{rng.getrandbits(64):016x}"
+
+
+def build_catalog(songs: int, per_song: int, seed: int):
+    """Yield (song_id, hash, time_offset) rows for a synthetic catalog."""
+    rng = random.Random(seed)
+    for song_id in range(1, songs + 1):
+        for offset in range(per_song):
+            yield song_id, _random_hash(rng), offset
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_queries(repo, queries):
+    latencies = []
+    for hashes in queries:
+        start = time.perf_counter()
+        repo.get_fingerprints_by_hashes(hashes)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, default=500)
+    parser.add_argument("--fingerprints-per-song", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--hashes-per-query", type=int, default=600,
+                        help="roughly the landmark count of a 10 second clip")
+    parser.add_argument("--hit-ratio", type=float, default=0.3,
+                        help="fraction of query hashes that exist in the catalog")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="tuneleap_bench", help="scratch MongoDB database (dropped afterwards)")
+    parser.add_argument("--mongomock", action="store_true", help="use an in-memory mongomock client")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        mongoengine.connect(db=args.db, host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+    else:
+        mongoengine.connect(db=args.db, host=args.mongo_uri)
+    Fingerprint.drop_collection()
+    Fingerprint.ensure_indexes()
+
+    rows = list(build_catalog(args.songs, args.fingerprints_per_song, args.seed))
+    print(f"Catalog: {args.songs} songs, {len(rows)} fingerprints")
+
+    start = time.perf_counter()
+    collection = Fingerprint._get_collection()
+    for i in range(0, len(rows), 50000):
+        collection.insert_many(
+            [{"song_id": s, "hash": h, "time_offset": t} for s, h, t in rows[i:i + 50000]],
+            ordered=False,
+        )
+    print(f"MongoDB load: {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_repo = SQLiteFingerprintRepository(os.path.join(tmp, "fingerprints.sqlite3"))
+        start = time.perf_counter()
+        sqlite_repo.import_from_mongo()
+        print(f"SQLite import: {time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(args.seed + 1)
+        queries = []
+        for _ in range(args.queries):
+            hits = int(args.hashes_per_query * args.hit_ratio)
+            hashes = [rows[rng.randrange(len(rows))][1] for _ in range(hits)]
+            hashes += [_random_hash(rng) for _ in range(args.hashes_per_query - hits)]
+            queries.append(hashes)
+
+        mongo_repo = FingerprintRepository()
+        # Warm both backends once so the first query doesn't pay for cache fill
+        mongo_repo.get_fingerprints_by_hashes(queries[0])
+        sqlite_repo.get_fingerprints_by_hashes(queries[0])
+
+        print(f"\n{'backend':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, repo in (("mongo", mongo_repo), ("sqlite", sqlite_repo)):
+            latencies = time_queries(repo, queries)
+            print(f"{name:<10}{statistics.mean(latencies):>10.2f}{percentile(latencies, 50):>10.2f}"
+                  f"{percentile(latencies, 95):>10.2f}{percentile(latencies, 99):>10.2f}")
+        sqlite_repo.close()
+
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+if __name__ == "__main__":
+    main()
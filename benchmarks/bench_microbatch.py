@@ -0,0 +1,106 @@
+"""
+Throughput and tail latency of recognition lookups with and without micro-batching.
+
+A synthetic catalog is loaded into a SQLite fingerprint index. For each
+concurrency level, that many client threads issue recognition queries back to
+back, either each doing its own lookup ("direct") or through a shared
+MicroBatchRecognizer ("batched").
+
+Usage:
+    python -m benchmarks.bench_microbatch --concurrency 1 4 16 64
+    python -m benchmarks.bench_microbatch --max-wait-ms 2 --max-batch-size 16
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from core.fingerprint.batcher import MicroBatchRecognizer
+from core.fingerprint.extractor import FingerPrinter
+from core.repository.sqlite_fingerprint_repository import SQLiteFingerprintRepository
+from benchmarks.bench_fingerprint_index import build_catalog, percentile, _random_hash
+
+
+def make_queries(rows, count, hashes_per_query, hit_ratio, seed):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        hits = int(hashes_per_query * hit_ratio)
+        query = [(rows[rng.randrange(len(rows))][1], rng.randrange(500)) for _ in range(hits)]
+        query += [(_random_hash(rng), rng.randrange(500)) for _ in range(hashes_per_query - hits)]
+        queries.append(query)
+    return queries
+
+
+def run_load(recognize, queries, concurrency, per_client):
+    """Run `concurrency` clients issuing `per_client` queries each; return (qps, latencies ms)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        local = []
+        for i in range(per_client):
+            query = queries[(index * per_client + i) % len(queries)]
+            start = time.perf_counter()
+            recognize(query)
+            local.append((time.perf_counter() - start) * 1000.0)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, default=500)
+    parser.add_argument("--fingerprints-per-song", type=int, default=2000)
+    parser.add_argument("--queries-per-client", type=int, default=20)
+    parser.add_argument("--hashes-per-query", type=int, default=600)
+    parser.add_argument("--hit-ratio", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rows = list(build_catalog(args.songs, args.fingerprints_per_song, args.seed))
+    queries = make_queries(rows, 256, args.hashes_per_query, args.hit_ratio, args.seed + 1)
+    matcher = FingerPrinter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = SQLiteFingerprintRepository(os.path.join(tmp, "fingerprints.sqlite3"))
+        repo.insert_many(rows)
+        print(f"Catalog: {args.songs} songs, {len(rows)} fingerprints")
+
+        def direct(query):
+            stored = repo.get_fingerprints_by_hashes([h for h, _ in query])
+            return matcher.match_fingerprints(query, stored)
+
+        batcher = MicroBatchRecognizer(repository=repo, max_wait_ms=args.max_wait_ms,
+                                       max_batch_size=args.max_batch_size)
+        direct(queries[0])
+
+        print(f"\n{'mode':<10}{'clients':>8}{'qps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for concurrency in args.concurrency:
+            for name, recognize in (("direct", direct), ("batched", batcher.match)):
+                qps, latencies = run_load(recognize, queries, concurrency, args.queries_per_client)
+                print(f"{name:<10}{concurrency:>8}{qps:>10.1f}{percentile(latencies, 50):>10.2f}"
+                      f"{percentile(latencies, 99):>10.2f}")
+
+        stats = batcher.stats()
+        print(f"\nMean batch size: {stats['mean_batch_size']:.1f} over {stats['batches']} batches")
+        batcher.close()
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
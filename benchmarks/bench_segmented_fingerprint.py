@@ -0,0 +1,63 @@
+"""
+Wall-clock time of fingerprinting one long track serially and in parallel segments.
+
+A synthetic recording (or --clip) is fingerprinted once with
+FingerPrinter.fingerprint_signal and then with fingerprint_signal_segmented on
+process pools of increasing size. Every segmented run is checked to produce
+exactly the serial output.
+
+Usage:
+    python -m benchmarks.bench_segmented_fingerprint --minutes 60 --workers 1 2 4 8
+    python -m benchmarks.bench_segmented_fingerprint --clip path/to/long.wav --segment-seconds 30
+"""
+import argparse
+import time
+
+import numpy as np
+
+from core.compute.pool import create_executor
+from core.fingerprint.extractor import FingerPrinter, fingerprint_signal_segmented
+
+
+def synthetic_recording(minutes: float, sr: int = FingerPrinter.SAMPLE_RATE) -> np.ndarray:
+    """Gliding tones over noise, so peaks are spread over the whole spectrum."""
+    rng = np.random.default_rng(5)
+    t = np.arange(int(minutes * 60 * sr)) / sr
+    tones = sum(np.sin(2 * np.pi * f * t * (1 + 0.05 * np.sin(t / (i + 2)))) for i, f in enumerate((220, 440, 880, 1760)))
+    return (0.15 * tones + 0.2 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=20.0)
+    parser.add_argument("--clip", help="audio file to use instead of a synthetic recording")
+    parser.add_argument("--segment-seconds", type=float, default=60.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if args.clip:
+        import librosa
+        y, _ = librosa.load(args.clip, sr=FingerPrinter.SAMPLE_RATE, mono=True)
+    else:
+        y = synthetic_recording(args.minutes)
+    print(f"{len(y) / FingerPrinter.SAMPLE_RATE / 60:.1f} min track, {args.segment_seconds:g}s segments\n")
+
+    FingerPrinter().fingerprint_signal(y[: 10 * FingerPrinter.SAMPLE_RATE])  # warm-up
+    start = time.perf_counter()
+    serial = FingerPrinter().fingerprint_signal(y)
+    serial_seconds = time.perf_counter() - start
+    print(f"{'mode':<16}{'seconds':>10}{'speed-up':>10}{'landmarks':>12}{'equal':>8}")
+    print(f"{'serial':<16}{serial_seconds:>10.2f}{1.0:>10.2f}{len(serial):>12}{'-':>8}")
+
+    for workers in args.workers:
+        with create_executor(workers, "process") as executor:
+            executor.submit(int).result()  # start the pool outside the timing
+            start = time.perf_counter()
+            segmented = fingerprint_signal_segmented(y, args.segment_seconds, executor=executor)
+            seconds = time.perf_counter() - start
+        print(f"{f'{workers} workers':<16}{seconds:>10.2f}{serial_seconds / seconds:>10.2f}"
+              f"{len(segmented):>12}{str(segmented == serial):>8}")
+
+
+if __name__ == "__main__":
+    main()
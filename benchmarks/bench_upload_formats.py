@@ -0,0 +1,125 @@
+"""
+Compare recognition latency of encoded uploads (WAV, MP3) with raw PCM uploads.
+
+The same clip is encoded in each format. By default the server-side path
+from upload bytes to fingerprints (decode, resample, fingerprint) is timed
+in-process. With --url, every payload is instead POSTed to a running API's
+/recognize/sync endpoint, which times the full request including upload and
+matching.
+
+Usage:
+    python -m benchmarks.bench_upload_formats --seconds 5 --repeat 20
+    python -m benchmarks.bench_upload_formats --url http://localhost:8000 --clip path/to/song.wav
+"""
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+import soundfile as sf
+
+from core.fingerprint.extractor import extract_fingerprint_from_bytes, extract_fingerprint_from_pcm
+from benchmarks.bench_fingerprint_index import percentile
+
+
+def synthetic_clip(seconds: float, sr: int = 44100) -> np.ndarray:
+    """A stereo clip with tonal content and noise, like a phone recording of music."""
+    t = np.arange(int(seconds * sr)) / sr
+    rng = np.random.default_rng(3)
+    tones = sum(np.sin(2 * np.pi * f * t) for f in (220, 330, 440, 660, 880)) / 5
+    mono = 0.6 * tones + 0.1 * rng.standard_normal(t.size)
+    return np.stack([mono, np.roll(mono, 37)], axis=1).astype(np.float32)
+
+
+def encode(y: np.ndarray, sr: int, fmt: str, subtype: str = None) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format=fmt, subtype=subtype)
+    return buffer.getvalue()
+
+
+def to_pcm(y: np.ndarray, sr: int, target_sr: int) -> bytes:
+    """Downmix and resample on the "client" side, then pack as 16-bit little-endian."""
+    import librosa
+
+    mono = y.mean(axis=1) if y.ndim == 2 else y
+    if sr != target_sr:
+        mono = librosa.resample(mono, orig_sr=sr, target_sr=target_sr)
+    return (np.clip(mono, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def build_payloads(y: np.ndarray, sr: int):
+    """Return (name, body, form fields, in-process extractor) for each format."""
+    import librosa
+
+    mono_22k = librosa.resample(y.mean(axis=1), orig_sr=sr, target_sr=22050)
+    payloads = [
+        ("wav 44.1k stereo", encode(y, sr, "WAV", "PCM_16"), {}, lambda b: extract_fingerprint_from_bytes(b, ".wav")),
+        ("wav 22.05k mono", encode(mono_22k, 22050, "WAV", "PCM_16"), {}, lambda b: extract_fingerprint_from_bytes(b, ".wav")),
+    ]
+    if "MP3" in sf.available_formats():
+        payloads.append(("mp3 44.1k stereo", encode(y, sr, "MP3"), {}, lambda b: extract_fingerprint_from_bytes(b, ".mp3")))
+    for rate in (22050, 16000):
+        payloads.append((
+            f"pcm_s16le {rate / 1000:g}k",
+            to_pcm(y, sr, rate),
+            {"format": "pcm_s16le", "sample_rate": str(rate)},
+            lambda b, rate=rate: extract_fingerprint_from_pcm(b, rate),
+        ))
+    return payloads
+
+
+def time_in_process(extract, body: bytes, repeat: int):
+    extract(body)  # warm-up
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract(body)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def time_http(url: str, name: str, body: bytes, fields: dict, repeat: int):
+    import httpx
+
+    filename = "clip.pcm" if fields else ("clip.mp3" if name.startswith("mp3") else "clip.wav")
+    latencies = []
+    with httpx.Client(base_url=url, timeout=60) as client:
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            client.post("/recognize/sync", files={"file": (filename, body)}, data=fields)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clip", help="audio file to use instead of a synthetic clip")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--url", help="base URL of a running API to measure end-to-end requests")
+    args = parser.parse_args()
+
+    if args.clip:
+        y, sr = sf.read(args.clip, dtype="float32", always_2d=True)
+        y = y[: int(args.seconds * sr)]
+        if y.shape[1] == 1:
+            y = np.repeat(y, 2, axis=1)
+    else:
+        sr = 44100
+        y = synthetic_clip(args.seconds, sr)
+
+    mode = f"POST {args.url}/recognize/sync" if args.url else "in-process decode + fingerprint"
+    print(f"{args.seconds:g}s clip, {mode}\n")
+    print(f"{'format':<20}{'KB':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, body, fields, extract in build_payloads(y, sr):
+        if args.url:
+            latencies = time_http(args.url, name, body, fields, args.repeat)
+        else:
+            latencies = time_in_process(extract, body, args.repeat)
+        print(f"{name:<20}{len(body) / 1024:>8.0f}{statistics.mean(latencies):>10.1f}"
+              f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
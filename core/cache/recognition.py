@@ -0,0 +1,315 @@
+"""
+Recognition result cache for duplicate and near-duplicate uploads.
+
+Two keys are used:
+  * a content key, the SHA-256 of the uploaded bytes, which catches client
+    retries and identical files before any decoding happens;
+  * a MinHash sketch of the query fingerprint hash set, which catches clips
+    that decode to nearly the same landmarks (e.g. many users recording the
+    same broadcast). Sketches are bucketed with LSH banding so a lookup only
+    compares against a handful of candidates.
+
+Both keys are scoped to the active fingerprint algorithm version, so a
+version switch stops serving results matched against the previous index.
+"""
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from core.cache.lru import LRUTTLCache
+
+
+def _default_backend() -> str:
+    """
+    "redis" when a Redis URL is configured, otherwise "memory". A memory
+    cache only sees results stored by its own process: results cached by
+    a worker never answer uploads arriving at the API.
+    """
+    return "redis" if os.getenv("RECOGNITION_CACHE_REDIS_URL") or os.getenv("CELERY_BROKER_URL") else "memory"
+
+
+# "memory" (per-process), "redis" (shared between API and workers) or "none"
+RECOGNITION_CACHE_BACKEND = os.getenv("RECOGNITION_CACHE_BACKEND") or _default_backend()
+RECOGNITION_CACHE_TTL = float(os.getenv("RECOGNITION_CACHE_TTL", "600"))
+RECOGNITION_CACHE_MAX_ENTRIES = int(os.getenv("RECOGNITION_CACHE_MAX_ENTRIES", "5000"))
+RECOGNITION_CACHE_REDIS_URL = os.getenv("RECOGNITION_CACHE_REDIS_URL") or os.getenv(
+    "CELERY_BROKER_URL", "redis://localhost:6379/0"
+)
+# Minimum estimated Jaccard similarity of two hash sets for a sketch hit
+SKETCH_MIN_SIMILARITY = float(os.getenv("RECOGNITION_CACHE_SKETCH_SIMILARITY", "0.6"))
+
+SKETCH_SIZE = 64
+SKETCH_BANDS = 16  # 4 rows per band
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+_SEEDS = np.random.default_rng(0x7E11EAF).integers(0, 2 ** 63, size=SKETCH_SIZE, dtype=np.uint64)
+
+
+def _active_version() -> int:
+    from core.fingerprint.versions import get_active_version
+    return get_active_version()
+
+
+def content_key(data: bytes) -> str:
+    """Return the content key (SHA-256 hex digest) of uploaded bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_key_from_file(fileobj: BinaryIO, chunk_size: int = 1 << 20) -> str:
+    """
+    Return the content key of a file object, reading it in chunks.
+    The file is rewound before and after hashing.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser: a fast, well-distributed 64-bit hash."""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (x ^ (x >> np.uint64(31))) & _MASK64
+
+
+def fingerprint_sketch(hashes: Iterable[str]) -> Optional[List[int]]:
+    """
+    Compute a MinHash signature of a set of fingerprint hashes.
+    Returns None for an empty set.
+    """
+    values = np.fromiter({int(h[:16], 16) for h in hashes}, dtype=np.uint64)
+    if values.size == 0:
+        return None
+    mixed = _mix64(values[:, None] ^ _SEEDS[None, :])
+    return [int(v) for v in mixed.min(axis=0)]
+
+
+def sketch_similarity(a: List[int], b: List[int]) -> float:
+    """Estimate the Jaccard similarity of two hash sets from their signatures."""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def sketch_bands(signature: List[int]) -> List[str]:
+    """Split a signature into LSH band keys; similar sets share at least one band."""
+    rows = len(signature) // SKETCH_BANDS
+    bands = []
+    for band in range(SKETCH_BANDS):
+        chunk = signature[band * rows:(band + 1) * rows]
+        digest = hashlib.blake2b(repr(chunk).encode(), digest_size=8).hexdigest()
+        bands.append(f"{band}:{digest}")
+    return bands
+
+
+def sketch_id(signature: List[int]) -> str:
+    return hashlib.blake2b(repr(signature).encode(), digest_size=12).hexdigest()
+
+
+class RecognitionCache(ABC):
+    """
+    Abstract base class for recognition result caches.
+    """
+
+    @abstractmethod
+    def get_by_content(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for an upload's content key."""
+        pass
+
+    @abstractmethod
+    def put_by_content(self, key: str, result: Dict[str, Any]) -> None:
+        """Cache a result under an upload's content key."""
+        pass
+
+    @abstractmethod
+    def get_by_sketch(self, signature: List[int]) -> Optional[Dict[str, Any]]:
+        """Return the cached result of the most similar previously seen query, if close enough."""
+        pass
+
+    @abstractmethod
+    def put_by_sketch(self, signature: List[int], result: Dict[str, Any]) -> None:
+        """Cache a result under a query's fingerprint sketch."""
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class NullRecognitionCache(RecognitionCache):
+    """
+    Cache that stores nothing; used when RECOGNITION_CACHE_BACKEND is "none".
+    """
+
+    def get_by_content(self, key):
+        return None
+
+    def put_by_content(self, key, result):
+        pass
+
+    def get_by_sketch(self, signature):
+        return None
+
+    def put_by_sketch(self, signature, result):
+        pass
+
+
+class InMemoryRecognitionCache(RecognitionCache):
+    """
+    Per-process cache backed by LRU/TTL maps. Only useful when the process
+    that stores a result also serves the repeated upload.
+    """
+
+    def __init__(self, ttl: float = RECOGNITION_CACHE_TTL, max_entries: int = RECOGNITION_CACHE_MAX_ENTRIES,
+                 min_similarity: float = SKETCH_MIN_SIMILARITY, clock=time.monotonic):
+        self.min_similarity = min_similarity
+        self._content = LRUTTLCache(maxsize=max_entries, ttl=ttl, clock=clock)
+        self._sketches = LRUTTLCache(maxsize=max_entries, ttl=ttl, clock=clock)
+        self._bands = LRUTTLCache(maxsize=max_entries * SKETCH_BANDS, ttl=ttl, clock=clock)
+
+    def get_by_content(self, key):
+        return self._content.get((_active_version(), key))
+
+    def put_by_content(self, key, result):
+        self._content.set((_active_version(), key), result)
+
+    def get_by_sketch(self, signature):
+        version = _active_version()
+        best, best_similarity = None, self.min_similarity
+        seen = set()
+        for band in sketch_bands(signature):
+            entry_id = self._bands.get((version, band))
+            if entry_id is None or entry_id in seen:
+                continue
+            seen.add(entry_id)
+            entry = self._sketches.get(entry_id)
+            if entry is None:
+                continue
+            stored_signature, result = entry
+            similarity = sketch_similarity(signature, stored_signature)
+            if similarity >= best_similarity:
+                best, best_similarity = result, similarity
+        return best
+
+    def put_by_sketch(self, signature, result):
+        version = _active_version()
+        entry_id = (version, sketch_id(signature))
+        self._sketches.set(entry_id, (signature, result))
+        for band in sketch_bands(signature):
+            self._bands.set((version, band), entry_id)
+
+    def stats(self):
+        return {"content": self._content.stats(), "sketch": self._sketches.stats()}
+
+
+class RedisRecognitionCache(RecognitionCache):
+    """
+    Cache shared by the API and all workers through Redis.
+    Entries expire with SETEX; a sorted set of insertion times caps the
+    number of entries by dropping the oldest ones, in the same round trip
+    as the write.
+    """
+
+    PREFIX = "reco-cache"
+    # Drop the oldest entries beyond the cap, atomically: KEYS[1] index, ARGV[1] cap
+    TRIM_SCRIPT = """
+local overflow = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if overflow > 0 then
+    local oldest = redis.call('ZPOPMIN', KEYS[1], overflow)
+    for i = 1, #oldest, 2 do
+        redis.call('DEL', oldest[i])
+    end
+    return overflow
+end
+return 0
+"""
+
+    def __init__(self, url: str = RECOGNITION_CACHE_REDIS_URL, ttl: float = RECOGNITION_CACHE_TTL,
+                 max_entries: int = RECOGNITION_CACHE_MAX_ENTRIES, min_similarity: float = SKETCH_MIN_SIMILARITY,
+                 client=None):
+        if client is None:
+            import redis
+            if "upstash.io" in url:
+                url = url.replace("redis://", "rediss://")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = int(ttl)
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._index_key = f"{self.PREFIX}:index"
+
+    def _key(self, kind: str, name: str, version: Optional[int] = None) -> str:
+        return f"{self.PREFIX}:v{version or _active_version()}:{kind}:{name}"
+
+    def _load(self, raw) -> Optional[Any]:
+        return json.loads(raw) if raw is not None else None
+
+    def _store(self, pipe, key: str, value: Any) -> None:
+        pipe.setex(key, self.ttl, json.dumps(value, default=float))
+        pipe.zadd(self._index_key, {key: time.time()})
+
+    def _trim(self, pipe) -> None:
+        pipe.eval(self.TRIM_SCRIPT, 1, self._index_key, self.max_entries)
+
+    def get_by_content(self, key):
+        return self._load(self.client.get(self._key("content", key)))
+
+    def put_by_content(self, key, result):
+        pipe = self.client.pipeline()
+        self._store(pipe, self._key("content", key), result)
+        self._trim(pipe)
+        pipe.execute()
+
+    def get_by_sketch(self, signature):
+        version = _active_version()
+        band_keys = [self._key("band", band, version) for band in sketch_bands(signature)]
+        entry_ids = {raw.decode() for raw in self.client.mget(band_keys) if raw is not None}
+        if not entry_ids:
+            return None
+        best, best_similarity = None, self.min_similarity
+        entry_keys = [self._key("sketch", entry_id, version) for entry_id in entry_ids]
+        for raw in self.client.mget(entry_keys):
+            entry = self._load(raw)
+            if entry is None:
+                continue
+            similarity = sketch_similarity(signature, entry["signature"])
+            if similarity >= best_similarity:
+                best, best_similarity = entry["result"], similarity
+        return best
+
+    def put_by_sketch(self, signature, result):
+        version = _active_version()
+        entry_id = sketch_id(signature)
+        pipe = self.client.pipeline()
+        self._store(pipe, self._key("sketch", entry_id, version), {"signature": signature, "result": result})
+        for band in sketch_bands(signature):
+            # Band pointers are small and expire with their entry; they are not counted in the index
+            pipe.setex(self._key("band", band, version), self.ttl, entry_id)
+        self._trim(pipe)
+        pipe.execute()
+
+
+_cache: Optional[RecognitionCache] = None
+
+
+def get_recognition_cache() -> RecognitionCache:
+    """
+    Return this process's recognition cache, selected by RECOGNITION_CACHE_BACKEND.
+    """
+    global _cache
+    if _cache is None:
+        if RECOGNITION_CACHE_BACKEND == "redis":
+            _cache = RedisRecognitionCache()
+        elif RECOGNITION_CACHE_BACKEND == "memory":
+            _cache = InMemoryRecognitionCache()
+        else:
+            _cache = NullRecognitionCache()
+    return _cache
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# "process" (default) or "thread"; threads avoid fork/pickle overhead for tiny jobs
+EXTRACT_POOL_KIND = os.getenv("EXTRACT_POOL_KIND", "process")
+EXTRACT_POOL_WORKERS = int(os.getenv("EXTRACT_POOL_WORKERS", "0")) or None
+
+
+def default_workers() -> int:
+    """Number of workers to use when none is configured."""
+    return EXTRACT_POOL_WORKERS or os.cpu_count() or 1
+
+
+def _can_fork_children() -> bool:
+    """Daemonic processes (e.g. some pool children) may not start child processes."""
+    if multiprocessing.current_process().daemon:
+        return False
+    try:
+        import billiard
+        return not billiard.current_process().daemon
+    except ImportError:
+        return True
+
+
+def create_executor(max_workers: Optional[int] = None, kind: Optional[str] = None,
+                    initializer: Optional[Callable] = None, initargs: tuple = ()) -> Executor:
+    """
+    Create an executor for CPU-bound audio work.
+
+    Uses a process pool unless threads are requested or the current process
+    is not allowed to have children, in which case a thread pool is used
+    (numpy/librosa release the GIL for most of the heavy lifting).
+
+    :param max_workers: pool size; defaults to default_workers()
+    :param kind: "process" or "thread"; defaults to EXTRACT_POOL_KIND
+    :param initializer: called with initargs once in each worker as it starts
+    """
+    max_workers = max_workers or default_workers()
+    kind = kind or EXTRACT_POOL_KIND
+    if kind == "process" and _can_fork_children():
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+
+
+class BoundedExecutor:
+    """
+    Executor that refuses work instead of queueing it without limit.
+
+    At most max_pending jobs (running or queued) are accepted; try_submit
+    returns None beyond that so callers can send the work elsewhere. The
+    underlying pool is created on first use.
+
+    :param max_workers: pool size; defaults to default_workers()
+    :param max_pending: accepted jobs at a time; defaults to max_workers
+    :param kind: "process" or "thread"; defaults to EXTRACT_POOL_KIND
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 kind: Optional[str] = None):
+        self.max_workers = max_workers or default_workers()
+        self.max_pending = max_pending or self.max_workers
+        self.kind = kind
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = create_executor(self.max_workers, self.kind)
+            return self._executor
+
+    def try_submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """Submit fn(*args, **kwargs), or return None if the pool is saturated."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,151 @@
+"""
+Micro-batching for concurrent recognition queries.
+
+Queries submitted from many threads within a short window (or until a batch
+is full) are collected by one dispatcher thread, their hashes are looked up
+in the fingerprint index with a single merged query, and the postings are
+then matched per query. Callers get a Future resolving to the query's
+song_id -> match score dict, exactly as if it had been matched on its own.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.fingerprint.extractor import FingerPrinter
+
+# How long the first query of a batch waits for company, in milliseconds
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "5"))
+MICROBATCH_MAX_BATCH_SIZE = int(os.getenv("MICROBATCH_MAX_BATCH_SIZE", "32"))
+
+_STOP = object()
+
+
+class MicroBatchRecognizer:
+    """
+    Collects recognition queries and serves them with merged index lookups.
+
+    :param repository: anything with get_fingerprints_by_hashes(hashes);
+        defaults to get_fingerprint_repository()
+    :param max_wait_ms: maximum time a query waits for the batch to fill
+    :param max_batch_size: maximum number of queries per lookup
+    :param match_fn: (query_fingerprints, stored_fingerprints) -> song scores;
+        defaults to FingerPrinter.match_fingerprints
+    """
+
+    def __init__(self, repository=None, max_wait_ms: float = MICROBATCH_MAX_WAIT_MS,
+                 max_batch_size: int = MICROBATCH_MAX_BATCH_SIZE,
+                 match_fn: Optional[Callable[[List[Tuple[str, int]], dict], Dict[int, int]]] = None):
+        if repository is None:
+            from core.repository.fingerprint_repository import get_fingerprint_repository
+            repository = get_fingerprint_repository()
+        self.repository = repository
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.match_fn = match_fn or FingerPrinter().match_fingerprints
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._thread = threading.Thread(target=self._run, name="microbatch-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query_fingerprints: List[Tuple[str, int]]) -> Future:
+        """
+        Queue a query for the next batch.
+        Returns a Future resolving to a dict of song_id -> match score.
+        """
+        if self._closed:
+            raise RuntimeError("MicroBatchRecognizer is closed")
+        future = Future()
+        self._queue.put((query_fingerprints, future))
+        return future
+
+    def match(self, query_fingerprints: List[Tuple[str, int]], timeout: Optional[float] = None) -> Dict[int, int]:
+        """Submit a query and wait for its song scores."""
+        return self.submit(query_fingerprints).result(timeout=timeout)
+
+    def close(self) -> None:
+        """Stop the dispatcher after the queries already submitted are served."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "queries": self._queries,
+                "mean_batch_size": self._queries / self._batches if self._batches else 0.0,
+            }
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        """Gather queries until the batch is full or the first one waited max_wait."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect(first)
+            self._serve(batch)
+
+    def _serve(self, batch: list) -> None:
+        # Skip queries whose caller already gave up
+        batch = [(fingerprints, future) for fingerprints, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            union_hashes = list({fp[0] for fingerprints, _ in batch for fp in fingerprints})
+            stored = self.repository.get_fingerprints_by_hashes(union_hashes) if union_hashes else {}
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self._batches += 1
+            self._queries += len(batch)
+
+        # The matcher only reads postings for the query's own hashes
+        for fingerprints, future in batch:
+            try:
+                future.set_result(self.match_fn(fingerprints, stored))
+            except Exception as e:
+                future.set_exception(e)
+
+
+_batchers: Dict[Optional[int], MicroBatchRecognizer] = {}
+_batcher_lock = threading.Lock()
+
+
+def get_micro_batcher(version: Optional[int] = None) -> MicroBatchRecognizer:
+    """
+    Return this process's micro-batcher for an algorithm version's index,
+    started on first use.
+
+    :param version: fingerprint algorithm version; None for the active index
+    """
+    with _batcher_lock:
+        if version not in _batchers:
+            from core.repository.fingerprint_repository import get_fingerprint_repository
+            _batchers[version] = MicroBatchRecognizer(repository=get_fingerprint_repository(version))
+        return _batchers[version]
@@ -1,10 +1,17 @@
-﻿import numpy as np
+﻿import os
+
+import numpy as np
 import librosa
 import hashlib
 from scipy.ndimage import maximum_filter
-from typing import List, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set, Type
 import struct
 
+# Tracks at least this long (seconds) are fingerprinted in segments on a worker pool (0 = never)
+FINGERPRINT_SEGMENT_MIN_SECONDS = float(os.getenv("FINGERPRINT_SEGMENT_MIN_SECONDS", "600"))
+# Length of each segment (seconds)
+FINGERPRINT_SEGMENT_SECONDS = float(os.getenv("FINGERPRINT_SEGMENT_SECONDS", "60"))
+
 
 class FingerPrinter:
     """
@@ -31,9 +38,28 @@ class FingerPrinter:
     TARGET_ZONE_WIDTH = 100  # Look up to 100 frames ahead
     MAX_PAIRS_PER_PEAK = 3  # Maximum number of pairs per peak
 
+    # Bump whenever a change to the parameters above or the hashing code
+    # produces different hashes; stored and query fingerprints must agree.
+    # A new version is a subclass registered with register_algorithm, so the
+    # old one keeps serving until its index is switched over.
+    ALGORITHM_VERSION = 1
+
     def __init__(self):
         self.hop_length = int(self.FFT_WINDOW_SIZE * (1 - self.OVERLAP_RATIO))
 
+    @classmethod
+    def params_signature(cls) -> int:
+        """CRC32 of the parameters that shape the hashes, to detect silent parameter drift."""
+        import zlib
+
+        params = (
+            cls.SAMPLE_RATE, cls.FFT_WINDOW_SIZE, cls.OVERLAP_RATIO,
+            cls.PEAK_NEIGHBORHOOD_SIZE, cls.MIN_PEAK_AMPLITUDE,
+            cls.MAX_HASH_TIME_DELTA, cls.MIN_HASH_TIME_DELTA, cls.FINGERPRINT_REDUCTION,
+            cls.TARGET_ZONE_START, cls.TARGET_ZONE_WIDTH, cls.MAX_PAIRS_PER_PEAK,
+        )
+        return zlib.crc32(repr(params).encode())
+
     def extract_fingerprints(self, file_path: str) -> List[Tuple[str, int]]:
         """
         Extract SpectralMatch fingerprints from an audio file.
@@ -42,6 +68,13 @@ class FingerPrinter:
         # Load audio
         y, sr = librosa.load(file_path, sr=self.SAMPLE_RATE, mono=True)
 
+        return self.fingerprint_signal(y)
+
+    def fingerprint_signal(self, y: np.ndarray) -> List[Tuple[str, int]]:
+        """
+        Extract SpectralMatch fingerprints from a mono signal already sampled at SAMPLE_RATE.
+        Returns list of (hash, time_offset) tuples.
+        """
         # Compute spectrogram
         spectrogram = self._compute_spectrogram(y)
 
@@ -55,12 +88,15 @@ class FingerPrinter:
 
     def _compute_spectrogram(self, audio: np.ndarray) -> np.ndarray:
         """Compute the magnitude spectrogram of the audio."""
-        # Use STFT to get spectrogram
+        # Use STFT to get spectrogram; frames are centred on zero-padded edges,
+        # which _segment_peak_candidates reproduces for a slice of the track
         D = librosa.stft(
             audio,
             n_fft=self.FFT_WINDOW_SIZE,
             hop_length=self.hop_length,
-            window='hann'
+            window='hann',
+            center=True,
+            pad_mode='constant'
         )
 
         # Convert to magnitude and apply log scaling
@@ -76,6 +112,12 @@ class FingerPrinter:
         Find local maxima (peaks) in the spectrogram.
         Returns list of (frequency_bin, time_frame) tuples.
         """
+        return self._select_peaks(*self._peak_candidates(spectrogram))
+
+    def _peak_candidates(self, spectrogram: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Local maxima above the amplitude threshold, as (frequency_bins, time_frames, amplitudes).
+        """
         # Apply local maximum filter
         neighborhood_size = (self.PEAK_NEIGHBORHOOD_SIZE, self.PEAK_NEIGHBORHOOD_SIZE)
         local_max = maximum_filter(spectrogram, neighborhood_size, mode='constant')
@@ -85,22 +127,21 @@ class FingerPrinter:
 
         # Get peak coordinates
         freq_indices, time_indices = np.where(is_peak)
+        return freq_indices, time_indices, spectrogram[freq_indices, time_indices]
 
-        # Create list of peaks with their amplitudes
-        peaks_with_amplitude = []
-        for f, t in zip(freq_indices, time_indices):
-            amplitude = spectrogram[f, t]
-            peaks_with_amplitude.append((f, t, amplitude))
-
-        # Sort by amplitude and keep strongest peaks
-        peaks_with_amplitude.sort(key=lambda x: x[2], reverse=True)
-        max_peaks = len(peaks_with_amplitude) // self.FINGERPRINT_REDUCTION
-        peaks_with_amplitude = peaks_with_amplitude[:max_peaks]
-
-        # Return just the coordinates
-        peaks = [(f, t) for f, t, _ in peaks_with_amplitude]
+    def _select_peaks(self, freq_indices: np.ndarray, time_indices: np.ndarray,
+                      amplitudes: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        Keep the strongest 1/FINGERPRINT_REDUCTION of the candidate peaks.
+        Equal amplitudes keep frequency-then-time order, whatever order the candidates came in.
+        """
+        order = np.lexsort((time_indices, freq_indices))
+        # Stable sort by amplitude, strongest first
+        order = order[np.argsort(-amplitudes[order], kind='stable')]
+        max_peaks = len(order) // self.FINGERPRINT_REDUCTION
+        order = order[:max_peaks]
 
-        return peaks
+        return list(zip(freq_indices[order].tolist(), time_indices[order].tolist()))
 
     def _generate_fingerprints(self, peaks: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
         """
@@ -176,11 +217,237 @@ class FingerPrinter:
 
         return song_scores
 
-def extract_fingerprint(file_path: str) -> List[Tuple[str, int]]:
+# Fingerprint algorithms by version; each version is served from its own index
+ALGORITHMS: Dict[int, Type[FingerPrinter]] = {FingerPrinter.ALGORITHM_VERSION: FingerPrinter}
+
+
+def register_algorithm(cls: Type[FingerPrinter]) -> Type[FingerPrinter]:
+    """
+    Class decorator registering a FingerPrinter subclass as a new algorithm version.
+
+        @register_algorithm
+        class FingerPrinterV2(FingerPrinter):
+            ALGORITHM_VERSION = 2
+            FINGERPRINT_REDUCTION = 15
+    """
+    existing = ALGORITHMS.get(cls.ALGORITHM_VERSION)
+    if existing is not None and existing is not cls:
+        raise ValueError(f"Fingerprint algorithm version {cls.ALGORITHM_VERSION} is already registered")
+    ALGORITHMS[cls.ALGORITHM_VERSION] = cls
+    return cls
+
+
+def get_algorithm(version: Optional[int] = None) -> Type[FingerPrinter]:
+    """
+    Return the FingerPrinter class of an algorithm version (FingerPrinter when None).
+
+    :raises ValueError: if the version is not registered
+    """
+    if version is None:
+        return FingerPrinter
+    try:
+        return ALGORITHMS[version]
+    except KeyError:
+        raise ValueError(f"Unknown fingerprint algorithm version {version}") from None
+
+
+def _segment_peak_candidates(samples: np.ndarray, first_frame: int, own_start: int,
+                             own_end: int, version: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Peak candidates of frames [own_start, own_end) of a track.
+
+    :param samples: the track's zero-padded samples covering frames first_frame onwards,
+        including the context frames around the owned range
+    :param first_frame: index of the first frame samples starts at
+    """
+    fingerprinter = get_algorithm(version)()
+    D = librosa.stft(
+        samples,
+        n_fft=fingerprinter.FFT_WINDOW_SIZE,
+        hop_length=fingerprinter.hop_length,
+        window='hann',
+        center=False
+    )
+    spectrogram = np.log1p(np.abs(D))
+    freqs, times, amplitudes = fingerprinter._peak_candidates(spectrogram)
+    times = times + first_frame
+    owned = (times >= own_start) & (times < own_end)
+    return freqs[owned], times[owned], amplitudes[owned]
+
+
+def _frame_samples(y: np.ndarray, first_frame: int, last_frame: int, n_fft: int, hop: int) -> np.ndarray:
+    """
+    Samples that frames [first_frame, last_frame) of a centred STFT are computed from,
+    zero-padded beyond the ends of the track exactly as librosa pads them.
+    """
+    start = first_frame * hop - n_fft // 2
+    end = (last_frame - 1) * hop + n_fft - n_fft // 2
+    segment = y[max(start, 0):min(end, len(y))]
+    if start < 0 or end > len(y):
+        segment = np.pad(segment, (max(-start, 0), max(end - len(y), 0)))
+    return segment
+
+
+def fingerprint_signal_segmented(y: np.ndarray, segment_seconds: Optional[float] = None,
+                                 max_workers: Optional[int] = None, executor=None,
+                                 version: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Fingerprint a long signal in time segments on a worker pool.
+
+    Each segment computes the spectrogram and local-maximum peaks of the frames
+    it owns, from its own samples plus PEAK_NEIGHBORHOOD_SIZE frames of context
+    on either side. The context is only used to look at, never reported, so
+    overlapping segments produce no duplicate peaks. Offsets are rebased to the
+    whole track. Keeping the strongest peaks and pairing them into landmarks then
+    runs once over the merged peaks, as both depend on the whole track. The
+    result equals FingerPrinter().fingerprint_signal(y).
+
+    :param segment_seconds: segment length; defaults to FINGERPRINT_SEGMENT_SECONDS
+    :param max_workers: pool size when no executor is given; defaults to default_workers()
+    :param executor: existing executor to run segments on
+    :param version: algorithm version; FingerPrinter by default
+    """
+    from core.compute.pool import create_executor
+
+    fingerprinter = get_algorithm(version)()
+    n_fft, hop = fingerprinter.FFT_WINDOW_SIZE, fingerprinter.hop_length
+    n_frames = 1 + len(y) // hop
+    segment_frames = max(1, int((segment_seconds or FINGERPRINT_SEGMENT_SECONDS) * fingerprinter.SAMPLE_RATE / hop))
+    context = fingerprinter.PEAK_NEIGHBORHOOD_SIZE
+
+    jobs = []
+    for own_start in range(0, n_frames, segment_frames):
+        own_end = min(own_start + segment_frames, n_frames)
+        first, last = max(own_start - context, 0), min(own_end + context, n_frames)
+        jobs.append((_frame_samples(y, first, last, n_fft, hop), first, own_start, own_end, version))
+
+    if len(jobs) == 1:
+        candidates = [_segment_peak_candidates(*jobs[0])]
+    elif executor is not None:
+        candidates = list(executor.map(_segment_peak_candidates, *zip(*jobs)))
+    else:
+        with create_executor(min(len(jobs), max_workers or len(jobs))) as pool:
+            candidates = list(pool.map(_segment_peak_candidates, *zip(*jobs)))
+
+    freqs, times, amplitudes = (np.concatenate(parts) for parts in zip(*candidates))
+    peaks = fingerprinter._select_peaks(freqs, times, amplitudes)
+    return fingerprinter._generate_fingerprints(peaks)
+
+
+def extract_fingerprint_segmented(file_path: str, segment_seconds: Optional[float] = None,
+                                  max_workers: Optional[int] = None,
+                                  min_seconds: Optional[float] = None,
+                                  version: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Extract SpectralMatch fingerprints from an audio file, splitting tracks of at
+    least min_seconds (default FINGERPRINT_SEGMENT_MIN_SECONDS) into segments
+    fingerprinted in parallel. Shorter tracks are processed serially.
+    Returns list of (hash, time_offset) tuples.
+    """
+    algorithm = get_algorithm(version)
+    y, sr = librosa.load(file_path, sr=algorithm.SAMPLE_RATE, mono=True)
+    min_seconds = FINGERPRINT_SEGMENT_MIN_SECONDS if min_seconds is None else min_seconds
+    if min_seconds <= 0 or len(y) < min_seconds * sr:
+        return algorithm().fingerprint_signal(y)
+    return fingerprint_signal_segmented(y, segment_seconds, max_workers, version=version)
+
+
+def extract_fingerprint(file_path: str, version: Optional[int] = None) -> List[Tuple[str, int]]:
     """
     Extract SpectralMatch fingerprints from an audio file.
     Wrapper function that creates a FingerPrinter instance and extracts fingerprints.
     Returns list of (hash, time_offset) tuples.
+
+    :param version: algorithm version; FingerPrinter by default
+    """
+    fingerprinter = get_algorithm(version)()
+    return fingerprinter.extract_fingerprints(file_path)
+
+
+def extract_fingerprint_from_bytes(data: bytes, suffix: str = "", version: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Extract SpectralMatch fingerprints from encoded audio held in memory.
+    Formats libsndfile can read (WAV, FLAC, OGG) are decoded without touching
+    disk; anything else (e.g. MP3) is decoded from a temporary file.
+    Returns list of (hash, time_offset) tuples.
+
+    :param data: encoded audio bytes
+    :param suffix: original file extension, used for the temporary file
+    :param version: algorithm version; FingerPrinter by default
+    """
+    import io
+    import tempfile
+
+    fingerprinter = get_algorithm(version)()
+    try:
+        y, _ = librosa.load(io.BytesIO(data), sr=fingerprinter.SAMPLE_RATE, mono=True)
+        return fingerprinter.fingerprint_signal(y)
+    except Exception:
+        pass
+
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return fingerprinter.extract_fingerprints(path)
+    finally:
+        os.remove(path)
+
+
+# Raw upload formats accepted instead of an encoded container
+PCM_FORMAT_S16LE = "pcm_s16le"
+PCM_SAMPLE_RATES = (8000, 11025, 16000, 22050, 44100, 48000)
+
+
+def pcm_s16le_to_signal(data: bytes, sample_rate: int = FingerPrinter.SAMPLE_RATE,
+                        target_rate: int = FingerPrinter.SAMPLE_RATE) -> np.ndarray:
+    """
+    Turn raw 16-bit little-endian mono PCM into the float signal fingerprinting expects.
+    The buffer is viewed in place; resampling only happens when the rate is not
+    target_rate, so clients sending 22050 Hz skip it entirely.
+
+    :raises ValueError: if the buffer length is not a whole number of samples
+    """
+    samples = np.frombuffer(data, dtype="<i2")
+    # Same scaling as libsndfile's PCM_16 -> float conversion used by librosa.load
+    y = samples.astype(np.float32) / 32768.0
+    if sample_rate != target_rate:
+        y = librosa.resample(y, orig_sr=sample_rate, target_sr=target_rate)
+    return y
+
+
+def extract_fingerprint_from_pcm(data: bytes, sample_rate: int = FingerPrinter.SAMPLE_RATE,
+                                 version: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Extract SpectralMatch fingerprints from raw 16-bit little-endian mono PCM.
+    Returns list of (hash, time_offset) tuples.
     """
-    fingerprinter = FingerPrinter()
-    return fingerprinter.extract_fingerprints(file_path)
\ No newline at end of file
+    fingerprinter = get_algorithm(version)()
+    return fingerprinter.fingerprint_signal(pcm_s16le_to_signal(data, sample_rate, fingerprinter.SAMPLE_RATE))
+
+
+def _extract_fingerprint_or_empty(file_path: str, version: Optional[int] = None) -> List[Tuple[str, int]]:
+    try:
+        return extract_fingerprint(file_path, version)
+    except Exception as e:
+        print(f"Error extracting fingerprints from {file_path}: {e}")
+        return []
+
+
+def extract_fingerprints_parallel(file_paths: List[str], max_workers: int = None,
+                                  version: Optional[int] = None) -> List[List[Tuple[str, int]]]:
+    """
+    Extract SpectralMatch fingerprints from several audio files on a worker pool.
+    Returns one list of (hash, time_offset) tuples per input path, in order;
+    files that cannot be decoded yield an empty list.
+    """
+    from core.compute.pool import create_executor, default_workers
+
+    if not file_paths:
+        return []
+    if len(file_paths) == 1:
+        return [_extract_fingerprint_or_empty(file_paths[0], version)]
+
+    workers = min(len(file_paths), max_workers or default_workers())
+    with create_executor(workers) as executor:
+        return list(executor.map(_extract_fingerprint_or_empty, file_paths, [version] * len(file_paths)))
@@ -1,5 +1,4 @@
-﻿from typing import Dict, List, Optional
-from db.nosql.collections import Fingerprint
+﻿from typing import Dict, Optional, Sequence
 
 class FingerprintMatcher:
     """
@@ -11,26 +10,46 @@ class FingerprintMatcher:
         # Use provided strategy or default to exact matching
         self.strategy = threshold_strategy or ExactMatchStrategy()
 
-    def match(self, fp_hash: str, query_file_path: Optional[str] = None) -> Dict[int, int]:
+    def match_batch(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                    query_file_path: Optional[str] = None) -> Dict[int, float]:
         """
-        Return a mapping of song_id to the number of matching fingerprints.
+        Return a mapping of song_id to the strategy's score for a whole query:
+        matching fingerprints (or, with offsets, time-aligned matches) for
+        hash strategies, the feature similarity for feature-based ones.
+        
+        Args:
+            hashes: The fingerprint hashes of the query audio
+            offsets: Optional time offset of each hash in the query
+            query_file_path: Optional path to the query audio file for feature extraction
+        """
+        return self.strategy.get_batch_scores(hashes, offsets, query_file_path)
+
+    def match_report(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                     query_file_path: Optional[str] = None) -> dict:
+        """
+        Like match_batch, but return how the match went: the strategy's run()
+        report for staged strategies (HybridMatchStrategy: stage, early exit,
+        skipped and timed-out stages, per-stage timings), otherwise a report
+        with just the scores.
+        
+        Args:
+            hashes: The fingerprint hashes of the query audio
+            offsets: Optional time offset of each hash in the query
+            query_file_path: Optional path to the query audio file for feature extraction
+        """
+        run = getattr(self.strategy, "run", None)
+        if callable(run):
+            return run(hashes, offsets, query_file_path)
+        scores = self.match_batch(hashes, offsets, query_file_path)
+        return {"scores": scores, "stage": None, "early_exit": False, "skipped": [], "timed_out": [],
+                "timings_ms": {}}
+
+    def match(self, fp_hash: str, query_file_path: Optional[str] = None) -> Dict[int, float]:
+        """
+        Return a mapping of song_id to the strategy's score for a single hash.
         
         Args:
             fp_hash: The fingerprint hash of the query audio
             query_file_path: Optional path to the query audio file for feature extraction
         """
-        # Pass the query file path to strategies that support it
-        if hasattr(self.strategy, 'get_matches'):
-            try:
-                # Try calling with query_file_path parameter
-                fps: List[Fingerprint] = self.strategy.get_matches(fp_hash, query_file_path)
-            except TypeError:
-                # Fallback for strategies that don't support query_file_path
-                fps: List[Fingerprint] = self.strategy.get_matches(fp_hash)
-        else:
-            fps: List[Fingerprint] = self.strategy.get_matches(fp_hash)
-            
-        counts: Dict[int, int] = {}
-        for fp in fps:
-            counts[fp.song_id] = counts.get(fp.song_id, 0) + 1
-        return counts
+        return self.match_batch([fp_hash], query_file_path=query_file_path)
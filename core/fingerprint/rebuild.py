@@ -0,0 +1,185 @@
+"""
+Resumable re-fingerprinting of the whole catalog into a staging index.
+
+RebuildJob pages through song IDs in the SQL catalog, finds each song's
+source file in the ingest manifest, and fingerprints songs in batches on a
+worker pool into the index of an algorithm version that is not serving
+queries (see core.fingerprint.versions). After every batch the outcome of
+each song is recorded, so a job that crashed or was stopped skips what it
+already finished when run again. Live recognition is protected by running
+fewer workers than CPUs, at a lower CPU priority, with optional pauses
+between batches and a cap on songs per minute.
+"""
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from core.compute.pool import create_executor, default_workers
+
+# CPU priority increment of rebuild workers, so recognition workers win contended cores
+REBUILD_NICE = int(os.getenv("REBUILD_NICE", "10"))
+# Song IDs read from the catalog per query
+REBUILD_PAGE_SIZE = 1000
+
+
+def default_rebuild_workers() -> int:
+    """Half of the usual pool size, leaving the other half to live recognition."""
+    return max(1, default_workers() // 2)
+
+
+def _lower_priority(increment: int) -> None:
+    if increment > 0 and hasattr(os, "nice"):
+        os.nice(increment)
+
+
+def rebuild_song(path: str, version: int) -> Tuple[List[Tuple[str, int]], Optional[str]]:
+    """
+    Fingerprint one source file with `version`'s algorithm in a pool worker.
+    Never raises: returns (fingerprints, error).
+    """
+    from core.fingerprint.extractor import extract_fingerprint
+
+    try:
+        fingerprints = extract_fingerprint(path, version)
+    except Exception as e:
+        return [], str(e)
+    if not fingerprints:
+        return [], "no fingerprints extracted"
+    return fingerprints, None
+
+
+class RebuildJob:
+    """
+    Rebuild the fingerprint index of one algorithm version, song by song.
+
+    :param version: algorithm version to fingerprint with and write to; must
+        not be the active version, whose index is serving queries
+    :param session: SQLAlchemy session to enumerate songs from; only needed
+        when run() is not given the songs
+    :param repository: index to write; get_fingerprint_repository(version) by default
+    :param manifest_repository: source of the audio file of each song;
+        IngestManifestRepository() by default
+    :param progress_repository: per-song progress; RebuildProgressRepository(version) by default
+    :param batch_size: songs fingerprinted in parallel and written per batch
+    :param max_workers: pool size; defaults to default_rebuild_workers()
+    :param pause_seconds: sleep after every batch
+    :param max_songs_per_minute: upper bound on the rebuild rate (0 = unlimited)
+    :param nice: CPU priority increment of the pool workers
+    :param pool_kind: "process" or "thread"; defaults to EXTRACT_POOL_KIND
+    """
+
+    def __init__(self, version: int, session=None, repository=None, manifest_repository=None,
+                 progress_repository=None, batch_size: int = 32, max_workers: Optional[int] = None,
+                 pause_seconds: float = 0.0, max_songs_per_minute: float = 0.0,
+                 nice: int = REBUILD_NICE, pool_kind: Optional[str] = None):
+        from core.fingerprint.extractor import get_algorithm
+        from core.fingerprint.versions import get_active_version
+        from core.repository.fingerprint_repository import get_fingerprint_repository
+        from core.repository.rebuild_progress_repository import RebuildProgressRepository
+
+        get_algorithm(version)
+        if version == get_active_version(refresh=True):
+            raise ValueError(f"Fingerprint algorithm version {version} is serving queries; "
+                             f"rebuild into a version that is being built")
+        self.version = version
+        self.session = session
+        self.repository = repository or get_fingerprint_repository(version)
+        self.manifest_repository = manifest_repository
+        self.progress = progress_repository or RebuildProgressRepository(version)
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max_workers or default_rebuild_workers()
+        self.pause_seconds = max(0.0, pause_seconds)
+        self.max_songs_per_minute = max(0.0, max_songs_per_minute)
+        self.nice = nice
+        self.pool_kind = pool_kind
+
+    def songs(self) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Yield (song_id, source path) for every song in the catalog, in ID order.
+        The path is None for songs without an ingest manifest record.
+        """
+        from core.repository.ingest_manifest_repository import IngestManifestRepository
+        from core.repository.song_repository import SongRepository
+
+        if self.session is None:
+            raise ValueError("RebuildJob needs a session to enumerate songs")
+        songs = SongRepository(self.session)
+        manifest = self.manifest_repository or IngestManifestRepository()
+        after_id = 0
+        while True:
+            song_ids = songs.list_ids(after_id, REBUILD_PAGE_SIZE)
+            if not song_ids:
+                return
+            sources = manifest.get_sources(song_ids)
+            for song_id in song_ids:
+                yield song_id, sources.get(song_id)
+            after_id = song_ids[-1]
+
+    def run(self, songs: Optional[Iterable[Tuple[int, Optional[str]]]] = None) -> Dict[str, Any]:
+        """
+        Rebuild every song not finished by an earlier run.
+
+        :param songs: (song_id, source path) pairs; songs() by default
+        :return: {"songs": rebuilt, "fingerprints": written, "failed": songs that
+            failed this run, "skipped": songs finished earlier, "elapsed": seconds,
+            "songs_per_second": rate}
+        """
+        stats = {"songs": 0, "fingerprints": 0, "failed": 0, "skipped": 0}
+        started = time.perf_counter()
+        songs = self.songs() if songs is None else songs
+
+        executor = create_executor(self.max_workers, self.pool_kind,
+                                   initializer=_lower_priority, initargs=(self.nice,))
+        try:
+            batch: List[Tuple[int, Optional[str]]] = []
+            for song in songs:
+                batch.append(song)
+                if len(batch) >= self.batch_size:
+                    self._run_batch(executor, batch, stats, started)
+                    batch = []
+            if batch:
+                self._run_batch(executor, batch, stats, started)
+        finally:
+            executor.shutdown(wait=True)
+
+        stats["elapsed"] = time.perf_counter() - started
+        stats["songs_per_second"] = stats["songs"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        return stats
+
+    def _run_batch(self, executor, batch: List[Tuple[int, Optional[str]]], stats: Dict[str, Any],
+                   started: float) -> None:
+        done = self.progress.done(song_id for song_id, _ in batch)
+        pending = [(song_id, path) for song_id, path in batch if song_id not in done]
+        stats["skipped"] += len(batch) - len(pending)
+        if not pending:
+            return
+
+        records = [{"song_id": song_id, "status": "failed", "error": "no source file in the ingest manifest"}
+                   for song_id, path in pending if path is None]
+        sources = [(song_id, path) for song_id, path in pending if path is not None]
+        results = executor.map(rebuild_song, [path for _, path in sources], [self.version] * len(sources))
+
+        fingerprints_by_song = {}
+        for (song_id, _), (fingerprints, error) in zip(sources, results):
+            if error is None:
+                fingerprints_by_song[song_id] = fingerprints
+                records.append({"song_id": song_id, "status": "done", "fingerprints": len(fingerprints)})
+            else:
+                records.append({"song_id": song_id, "status": "failed", "error": error})
+        # Index first: a crash in between only means the songs are rebuilt again
+        stats["fingerprints"] += self.repository.store_many(fingerprints_by_song)
+        self.progress.record_many(records)
+        stats["songs"] += len(fingerprints_by_song)
+        stats["failed"] += len(records) - len(fingerprints_by_song)
+        print(f"Worker: Rebuilt {stats['songs']} songs into fingerprint index v{self.version} "
+              f"({stats['failed']} failed, {stats['skipped']} already done)")
+        self._throttle(stats, started)
+
+    def _throttle(self, stats: Dict[str, Any], started: float) -> None:
+        delay = self.pause_seconds
+        if self.max_songs_per_minute:
+            # Earliest time the songs processed so far are allowed to have taken
+            processed = stats["songs"] + stats["failed"]
+            delay = max(delay, started + processed * 60.0 / self.max_songs_per_minute - time.perf_counter())
+        if delay > 0:
+            time.sleep(delay)
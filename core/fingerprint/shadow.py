@@ -0,0 +1,151 @@
+"""
+Shadow matching of a candidate fingerprint algorithm against the active one.
+
+The same clip is recognized with both versions, each extracted with its own
+algorithm and matched against its own index, and the answers and latencies are
+compared. Comparisons come from labelled test clips (ShadowMatcher.compare_file
+with an expected song) or from a sample of live traffic while a version is being
+built (FINGERPRINT_SHADOW_SAMPLE_RATE), and summarize() turns them into the
+accuracy and latency report to check before switching.
+"""
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import librosa
+import numpy as np
+
+from core.fingerprint.extractor import FingerPrinter, get_algorithm
+
+# Fraction of recognition tasks also matched with the version being built (0 = off)
+FINGERPRINT_SHADOW_SAMPLE_RATE = float(os.getenv("FINGERPRINT_SHADOW_SAMPLE_RATE", "0"))
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q)) if values else None
+
+
+class ShadowMatcher:
+    """
+    Recognize clips with two algorithm versions and compare the results.
+
+    :param active_version: version serving queries
+    :param candidate_version: version being evaluated
+    :param repositories: version -> index; get_fingerprint_repository(version) by default
+    :param match_fn: (query_fingerprints, stored_fingerprints) -> song scores;
+        defaults to FingerPrinter.match_fingerprints
+    """
+
+    def __init__(self, active_version: int, candidate_version: int,
+                 repositories: Optional[Dict[int, Any]] = None,
+                 match_fn: Optional[Callable[[List[Tuple[str, int]], dict], Dict[int, int]]] = None):
+        from core.repository.fingerprint_repository import get_fingerprint_repository
+
+        self.versions = (active_version, candidate_version)
+        repositories = repositories or {}
+        self.repositories = {v: repositories.get(v) or get_fingerprint_repository(v) for v in self.versions}
+        self.match_fn = match_fn or FingerPrinter().match_fingerprints
+
+    def _recognize(self, version: int, y: np.ndarray) -> Tuple[Optional[int], float]:
+        """Top song (None for no match) and milliseconds spent extracting and matching."""
+        start = time.perf_counter()
+        fingerprints = get_algorithm(version)().fingerprint_signal(y)
+        stored = self.repositories[version].get_fingerprints_by_hashes([h for h, _ in fingerprints]) if fingerprints else {}
+        scores = self.match_fn(fingerprints, stored) if stored else {}
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        return (max(scores, key=scores.get) if scores else None), elapsed_ms
+
+    def compare_signals(self, signals: Dict[int, np.ndarray],
+                        expected_song_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Compare both versions on one clip.
+
+        :param signals: version -> the clip sampled at that algorithm's SAMPLE_RATE
+        """
+        (active, candidate) = self.versions
+        active_song, active_ms = self._recognize(active, signals[active])
+        candidate_song, candidate_ms = self._recognize(candidate, signals[candidate])
+        return {
+            "active_version": active,
+            "candidate_version": candidate,
+            "active_song_id": active_song,
+            "candidate_song_id": candidate_song,
+            "active_ms": active_ms,
+            "candidate_ms": candidate_ms,
+            "expected_song_id": expected_song_id,
+        }
+
+    def compare_file(self, path: str, expected_song_id: Optional[int] = None) -> Dict[str, Any]:
+        """Compare both versions on an audio file, decoding it once per sample rate."""
+        signals: Dict[int, np.ndarray] = {}
+        decoded: Dict[int, np.ndarray] = {}
+        for version in self.versions:
+            sr = get_algorithm(version).SAMPLE_RATE
+            if sr not in decoded:
+                decoded[sr], _ = librosa.load(path, sr=sr, mono=True)
+            signals[version] = decoded[sr]
+        return self.compare_signals(signals, expected_song_id)
+
+
+def record_comparison(comparison: Dict[str, Any]) -> None:
+    """Store a comparison for shadow_report(); failures are logged, not raised."""
+    from db.nosql.collections import ShadowComparison
+
+    try:
+        ShadowComparison(**comparison).save()
+    except Exception as e:
+        print(f"Worker: Could not record shadow comparison: {e}")
+
+
+def should_shadow(sample_rate: Optional[float] = None) -> bool:
+    """Whether this recognition should also be matched with the candidate version."""
+    rate = FINGERPRINT_SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate
+    return rate > 0 and random.random() < rate
+
+
+def summarize(comparisons: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate comparisons into a report.
+
+    Agreement is over all clips; accuracy (top song is the expected song) only
+    over labelled clips. Latencies are in milliseconds.
+    """
+    comparisons = list(comparisons)
+    labelled = [c for c in comparisons if c.get("expected_song_id") is not None]
+    report: Dict[str, Any] = {
+        "clips": len(comparisons),
+        "labelled": len(labelled),
+        "agreement": (sum(c["active_song_id"] == c["candidate_song_id"] for c in comparisons) / len(comparisons)
+                      if comparisons else None),
+    }
+    for role in ("active", "candidate"):
+        latencies = [c[f"{role}_ms"] for c in comparisons if c.get(f"{role}_ms") is not None]
+        report[role] = {
+            "version": comparisons[0][f"{role}_version"] if comparisons else None,
+            "match_rate": (sum(c[f"{role}_song_id"] is not None for c in comparisons) / len(comparisons)
+                           if comparisons else None),
+            "accuracy": (sum(c[f"{role}_song_id"] == c["expected_song_id"] for c in labelled) / len(labelled)
+                         if labelled else None),
+            "mean_ms": float(np.mean(latencies)) if latencies else None,
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+        }
+    if comparisons and report["active"]["mean_ms"] is not None and report["candidate"]["mean_ms"] is not None:
+        report["latency_change"] = report["candidate"]["mean_ms"] / report["active"]["mean_ms"] - 1.0
+    if labelled:
+        report["accuracy_change"] = report["candidate"]["accuracy"] - report["active"]["accuracy"]
+    return report
+
+
+def shadow_report(active_version: int, candidate_version: int, limit: int = 0) -> Dict[str, Any]:
+    """Summarize recorded comparisons between two versions (the most recent `limit`, 0 = all)."""
+    from db.nosql.collections import ShadowComparison
+
+    fields = ("active_version", "candidate_version", "active_song_id", "candidate_song_id",
+              "active_ms", "candidate_ms", "expected_song_id")
+    query = ShadowComparison.objects(active_version=active_version, candidate_version=candidate_version)
+    query = query.order_by("-created_at")
+    if limit:
+        query = query.limit(limit)
+    return summarize({field: doc[field] for field in fields} for doc in query)
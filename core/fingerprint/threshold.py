@@ -1,11 +1,38 @@
-﻿from abc import ABC, abstractmethod
-from typing import List
-from db.nosql.collections import Fingerprint
+﻿import heapq
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Sequence, Tuple
+from db.nosql.collections import Fingerprint, fingerprint_document
+from core.fingerprint.versions import get_active_version
+from core.repository.fingerprint_repository import get_fingerprint_repository
+from core.compute.pool import BoundedExecutor
+from core.reco.search import STRATEGY_FEATURE_WEIGHTS, weighted_cosine_similarity
 import numpy as np
 
+# HybridMatchStrategy: hashes looked up per landmark round trip
+HYBRID_LANDMARK_CHUNK = int(os.getenv("HYBRID_LANDMARK_CHUNK", "256"))
+# Time the landmark stage may take before it stops looking up further chunks (ms)
+HYBRID_LANDMARK_BUDGET_MS = float(os.getenv("HYBRID_LANDMARK_BUDGET_MS", "500"))
+# Time a whole hybrid match should take (ms)
+HYBRID_TOTAL_BUDGET_MS = float(os.getenv("HYBRID_TOTAL_BUDGET_MS", "3000"))
+# Budget that must remain for the feature stage (extraction + search) to start (ms)
+HYBRID_FEATURE_BUDGET_MS = float(os.getenv("HYBRID_FEATURE_BUDGET_MS", "1500"))
+# Threads running feature stages; a stage that overran its budget keeps its thread until it finishes
+HYBRID_FEATURE_WORKERS = int(os.getenv("HYBRID_FEATURE_WORKERS", "2"))
+# Landmark matching stops early once the best song has this many votes...
+HYBRID_DECISIVE_VOTES = int(os.getenv("HYBRID_DECISIVE_VOTES", "10"))
+# ...and leads the runner-up by this fraction of its score
+HYBRID_DECISIVE_MARGIN = float(os.getenv("HYBRID_DECISIVE_MARGIN", "0.5"))
+
 class ThresholdStrategy(ABC):
     """
     Abstract base class for fingerprint matching strategies.
+
+    FingerprintMatcher scores a whole query at once with get_batch_scores().
+    Strategies should override it with one lookup per batch; the default
+    calls get_matches() per hash and counts the documents it returns.
     """
 
     @abstractmethod
@@ -19,13 +46,115 @@ class ThresholdStrategy(ABC):
         """
         pass
 
+    def get_batch_scores(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                         query_file_path: str = None) -> Dict[int, float]:
+        """
+        Return a mapping of song_id to match score (higher is better) for a
+        whole query.
+
+        Args:
+            hashes: The fingerprint hashes of the query audio
+            offsets: Optional time offset of each hash in the query
+            query_file_path: Optional path to the query audio file for feature extraction
+        """
+        scores: Dict[int, float] = {}
+        for fp_hash in hashes:
+            # Older strategies may only accept the hash
+            fps = self.get_matches(fp_hash, query_file_path) if query_file_path else self.get_matches(fp_hash)
+            for fp in fps:
+                scores[fp.song_id] = scores.get(fp.song_id, 0) + 1
+        return scores
+
+    def get_scores(self, fp_hash: str, query_file_path: str = None) -> Dict[int, float]:
+        """
+        Return a mapping of song_id to match score for a single hash.
+        """
+        return self.get_batch_scores([fp_hash], query_file_path=query_file_path)
+
+
+class LandmarkVotes:
+    """
+    Song scores accumulated over successive lookups of a query's hashes.
+
+    With offsets, a song scores its largest group of matches sharing one
+    time difference (as FingerPrinter.match_fingerprints); without, its
+    number of matching fingerprints.
+    """
+
+    def __init__(self):
+        self.scores: Dict[int, float] = {}
+        self._aligned: Dict[Tuple[int, int], int] = {}
+
+    def add(self, hashes: Sequence[str], offsets: Optional[Sequence[int]],
+            stored: Dict[str, List[Tuple[int, int]]]) -> None:
+        """
+        :param stored: {hash: [(song_id, time_offset), ...]} for (at least) these hashes
+        """
+        for i, fp_hash in enumerate(hashes):
+            for song_id, stored_time in stored.get(fp_hash, ()):
+                if offsets is None:
+                    self.scores[song_id] = self.scores.get(song_id, 0) + 1
+                    continue
+                key = (song_id, stored_time - offsets[i])
+                count = self._aligned.get(key, 0) + 1
+                self._aligned[key] = count
+                if count > self.scores.get(song_id, 0):
+                    self.scores[song_id] = count
+
+    def is_decisive(self, min_votes: int, margin: float) -> bool:
+        """True once the best song has min_votes and leads the runner-up by `margin` of its score."""
+        if not self.scores:
+            return False
+        top = heapq.nlargest(2, self.scores.values())
+        best, second = top[0], top[1] if len(top) > 1 else 0
+        return best >= min_votes and best - second >= margin * best
+
+
+def _fingerprints_of(song_ids: List[int]) -> List[Fingerprint]:
+    """Fingerprint docs of the given songs in the active index, in one query."""
+    if not song_ids:
+        return []
+    return list(fingerprint_document(get_active_version()).objects(song_id__in=song_ids))
+
 class ExactMatchStrategy(ThresholdStrategy):
     """
     Strategy that matches fingerprints with exact hash equality.
     """
 
+    def __init__(self, version: Optional[int] = None):
+        """
+        Args:
+            version: Fingerprint algorithm version whose index to search; the active version by default
+        """
+        self.version = version
+
+    def _version(self) -> int:
+        return self.version or get_active_version()
+
     def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
-        return list(Fingerprint.objects(hash=fp_hash))
+        return list(fingerprint_document(self._version()).objects(hash=fp_hash))
+
+    def get_batch_scores(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                         query_file_path: str = None) -> Dict[int, float]:
+        """
+        Look all hashes up in one query. Without offsets a song scores its
+        number of matching fingerprints (per query hash, so the result is the
+        sum of get_scores() over the hashes); with offsets, the size of its
+        largest group of matches with the same time difference, as in
+        FingerPrinter.match_fingerprints.
+        """
+        if not hashes:
+            return {}
+        votes = LandmarkVotes()
+        votes.add(hashes, offsets, self.lookup(hashes))
+        return votes.scores
+
+    def lookup(self, hashes: Sequence[str]) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Stored (song_id, time_offset) pairs of the given hashes, in one query
+        to the fingerprint index (Mongo or SQLite, see FINGERPRINT_BACKEND).
+        """
+        return get_fingerprint_repository(self._version()).get_fingerprints_by_hashes(list(set(hashes)))
 
 class SimilarityMatchStrategy(ThresholdStrategy):
     """
@@ -63,94 +192,50 @@ class SimilarityMatchStrategy(ThresholdStrategy):
         - Rhythm (2): Weight 0.8 - Less reliable for short clips
         - ZCR (2): Weight 0.7 - Least important for melody recognition
         """
-        if len(features1) == 0 or len(features2) == 0:
-            return 0.0
-        
-        # Ensure same length
-        min_len = min(len(features1), len(features2))
-        f1 = features1[:min_len]
-        f2 = features2[:min_len]
-        
-        # Create feature weights (55 features)
-        if min_len >= 55:
-            weights = np.concatenate([
-                np.full(12, 2.0),  # Chroma - highest weight
-                np.full(13, 1.5),  # MFCC mean - high weight  
-                np.full(13, 1.0),  # MFCC std - medium weight
-                np.full(6, 1.2),   # Spectral features - medium-high weight
-                np.full(7, 1.3),   # Spectral contrast - medium-high weight
-                np.full(2, 0.8),   # Rhythm - lower weight for short clips
-                np.full(2, 0.7)    # ZCR - lowest weight
-            ])
-        else:
-            # Fallback to uniform weights if feature vector is different length
-            weights = np.ones(min_len)
-        
-        weights = weights[:min_len]  # Ensure same length as features
-        
-        # Apply weights
-        f1_weighted = f1 * weights
-        f2_weighted = f2 * weights
-        
-        # Normalize vectors
-        norm1 = np.linalg.norm(f1_weighted)
-        norm2 = np.linalg.norm(f2_weighted)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        # Weighted cosine similarity
-        return float(np.dot(f1_weighted, f2_weighted) / (norm1 * norm2))
-    
-    def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
+        return weighted_cosine_similarity(features1, features2, STRATEGY_FEATURE_WEIGHTS)
+
+    def get_batch_scores(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                         query_file_path: str = None) -> Dict[int, float]:
         """
-        Find fingerprints similar to the uploaded audio using stored features.
+        Similarity of every song at or above the threshold to the uploaded audio.
         
         Args:
-            fp_hash: The fingerprint hash (not used in similarity matching)
+            hashes: The fingerprint hashes (not used in similarity matching)
+            offsets: Not used in similarity matching
             query_file_path: Path to the uploaded audio file for feature extraction
         """
         if not query_file_path:
             print("No query file path provided for similarity matching")
-            return []
+            return {}
         
         # Extract features from the uploaded file
         query_features = self._extract_query_features(query_file_path)
         if len(query_features) == 0:
             print("Could not extract features from query file")
-            return []
-        
-        matches = []
-        similarity_scores = []
+            return {}
         
         try:
-            # Get all stored song features
-            from core.repository.song_feature_repository import SongFeatureRepository
-            feature_repo = SongFeatureRepository()
-            all_features = feature_repo.get_all_features()
-            
-            print(f"Comparing against {len(all_features)} stored songs")
+            # Stored song features, cached in this process and scored as one matrix product
+            from core.reco.feature_store import get_feature_store
+            engine = get_feature_store().engine(STRATEGY_FEATURE_WEIGHTS)
             
-            # Compare with each stored song's features
-            for song_id, stored_features in all_features.items():
-                similarity = self._compute_weighted_cosine_similarity(query_features, stored_features)
-                similarity_scores.append((song_id, similarity))
-                
-                if similarity >= self.similarity_threshold:
-                    # Get the fingerprint for this song to maintain consistency
-                    fingerprints = list(Fingerprint.objects(song_id=song_id))
-                    matches.extend(fingerprints)
+            print(f"Comparing against {len(engine)} stored songs")
             
-            # Sort by similarity for debugging
-            similarity_scores.sort(key=lambda x: x[1], reverse=True)
-            print(f"Top 5 similarities: {similarity_scores[:5]}")
-            print(f"Found {len(matches)} matches above threshold {self.similarity_threshold}")
+            similarities = engine.search(query_features, k=len(engine), threshold=self.similarity_threshold)
+            print(f"Found {len(similarities)} songs above threshold {self.similarity_threshold}")
+            print(f"Top 5 similarities: {similarities[:5]}")
             
         except Exception as e:
             print(f"Error in similarity matching: {e}")
-            return []
+            return {}
         
-        return matches
+        return dict(similarities)
+
+    def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
+        """
+        Fingerprints of the songs get_scores() finds similar to the uploaded audio.
+        """
+        return _fingerprints_of(list(self.get_scores(fp_hash, query_file_path)))
 
 class FeatureBasedMatchStrategy(ThresholdStrategy):
     """
@@ -178,114 +263,152 @@ class FeatureBasedMatchStrategy(ThresholdStrategy):
         """
         Compute weighted cosine similarity optimized for partial song recognition.
         """
-        if len(features1) == 0 or len(features2) == 0:
-            return 0.0
-        
-        # Ensure same length
-        min_len = min(len(features1), len(features2))
-        f1 = features1[:min_len]
-        f2 = features2[:min_len]
-        
-        # Create feature weights (55 features expected)
-        if min_len >= 55:
-            weights = np.concatenate([
-                np.full(12, 2.0),  # Chroma - highest weight for harmony/melody
-                np.full(13, 1.5),  # MFCC mean - high weight for timbre
-                np.full(13, 1.0),  # MFCC std - medium weight
-                np.full(6, 1.2),   # Spectral features - medium-high weight
-                np.full(7, 1.3),   # Spectral contrast - medium-high weight
-                np.full(2, 0.8),   # Rhythm - lower weight for short clips
-                np.full(2, 0.7)    # ZCR - lowest weight
-            ])
-        else:
-            # Fallback for different feature lengths
-            weights = np.ones(min_len)
-        
-        weights = weights[:min_len]
-        
-        # Apply weights and normalize
-        f1_weighted = f1 * weights
-        f2_weighted = f2 * weights
-        
-        norm1 = np.linalg.norm(f1_weighted)
-        norm2 = np.linalg.norm(f2_weighted)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        return float(np.dot(f1_weighted, f2_weighted) / (norm1 * norm2))
+        return weighted_cosine_similarity(features1, features2, STRATEGY_FEATURE_WEIGHTS)
     
-    def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
+    def get_batch_scores(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                         query_file_path: str = None, deadline: Optional[float] = None) -> Dict[int, float]:
         """
-        Find similar songs based on audio features and return their fingerprints 
-        weighted by similarity scores.
+        Similarity of the max_results most similar songs at or above the
+        threshold, without loading any fingerprints. The hashes are not used.
+
+        Args:
+            deadline: Optional time.perf_counter() value after which the
+                search is not started once the features are extracted
         """
         if not query_file_path:
-            return []
+            return {}
         
         query_features = self._extract_query_features(query_file_path)
         if len(query_features) == 0:
-            return []
+            return {}
+        if deadline is not None and time.perf_counter() >= deadline:
+            print("Feature budget spent during extraction, skipping the search")
+            return {}
         
         try:
-            from core.repository.song_feature_repository import SongFeatureRepository
-            feature_repo = SongFeatureRepository()
-            all_features = feature_repo.get_all_features()
-            
-            # Calculate similarities and sort
-            similarities = []
-            for song_id, stored_features in all_features.items():
-                similarity = self._compute_weighted_cosine_similarity(query_features, stored_features)
-                if similarity >= self.similarity_threshold:
-                    similarities.append((song_id, similarity))
-            
-            # Sort by similarity descending and limit results
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            similarities = similarities[:self.max_results]
+            from core.reco.feature_store import get_feature_store
+            engine = get_feature_store().engine(STRATEGY_FEATURE_WEIGHTS)
+            similarities = engine.search(query_features, k=self.max_results, threshold=self.similarity_threshold)
             
             print(f"Feature-based matching found {len(similarities)} similar songs")
             if similarities:
                 print(f"Best match: song_id={similarities[0][0]}, similarity={similarities[0][1]:.3f}")
                 print(f"Top matches: {[(s[0], f'{s[1]:.3f}') for s in similarities]}")
             
-            # Create weighted fingerprints based on similarity scores
-            weighted_matches = []
-            for song_id, similarity in similarities:
-                # Get fingerprints for this song
-                fingerprints = list(Fingerprint.objects(song_id=song_id))
-                
-                # Create multiple copies based on similarity score to weight the results
-                # Scale similarity to get integer weights (multiply by 100 and round)
-                weight = max(1, int(similarity * 100))  # Minimum weight of 1
-                
-                # Add weighted copies of fingerprints
-                for _ in range(weight):
-                    weighted_matches.extend(fingerprints)
-            
-            return weighted_matches
+            return dict(similarities)
             
         except Exception as e:
             print(f"Error in feature-based matching: {e}")
-            return []
+            return {}
+
+    def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
+        """
+        Fingerprints of the songs get_scores() finds similar, once each. Use
+        get_scores() to rank them.
+        """
+        return _fingerprints_of(list(self.get_scores(fp_hash, query_file_path)))
 
 class HybridMatchStrategy(ThresholdStrategy):
     """
     Strategy that first tries exact matching, then falls back to feature-based similarity matching.
     Best approach for partial song recognition.
+
+    Matching runs as a budgeted cascade (see run()): landmark lookups go
+    chunk by chunk and stop as soon as one song clearly leads or the
+    landmark budget is spent, and the feature stage only starts if enough of
+    the total budget is left. The feature stage runs on a small thread pool
+    and is abandoned when the rest of the total budget runs out.
     """
+
+    _feature_pool = BoundedExecutor(max_workers=HYBRID_FEATURE_WORKERS, kind="thread")
     
-    def __init__(self, similarity_threshold: float = 0.65):
+    def __init__(self, similarity_threshold: float = 0.65,
+                 landmark_budget_ms: float = HYBRID_LANDMARK_BUDGET_MS,
+                 total_budget_ms: float = HYBRID_TOTAL_BUDGET_MS,
+                 feature_budget_ms: float = HYBRID_FEATURE_BUDGET_MS,
+                 decisive_votes: int = HYBRID_DECISIVE_VOTES,
+                 decisive_margin: float = HYBRID_DECISIVE_MARGIN,
+                 chunk_size: int = HYBRID_LANDMARK_CHUNK):
         self.exact_strategy = ExactMatchStrategy()
         self.feature_strategy = FeatureBasedMatchStrategy(similarity_threshold, max_results=3)
+        self.landmark_budget_ms = landmark_budget_ms
+        self.total_budget_ms = total_budget_ms
+        self.feature_budget_ms = feature_budget_ms
+        self.decisive_votes = decisive_votes
+        self.decisive_margin = decisive_margin
+        self.chunk_size = chunk_size
+
+    def run(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+            query_file_path: str = None) -> dict:
+        """
+        Match a query through the cascade and report how it went.
+
+        Returns a dict with:
+            scores: song_id -> score, from the stage that produced the answer
+            stage: "landmark", "features" or None when nothing matched
+            early_exit: True if landmark lookups stopped on a decisive lead
+            skipped: stages not run for lack of budget (or of a free feature thread)
+            timed_out: stages abandoned when the total budget ran out
+            timings_ms: time spent per stage that ran
+        """
+        start = time.perf_counter()
+        report = {"scores": {}, "stage": None, "early_exit": False, "skipped": [], "timed_out": [],
+                  "timings_ms": {}}
+
+        votes = LandmarkVotes()
+        for i in range(0, len(hashes), self.chunk_size):
+            chunk = hashes[i:i + self.chunk_size]
+            votes.add(chunk, offsets[i:i + self.chunk_size] if offsets is not None else None,
+                      self.exact_strategy.lookup(chunk))
+            done = i + self.chunk_size >= len(hashes)
+            if not done and votes.is_decisive(self.decisive_votes, self.decisive_margin):
+                report["early_exit"] = True
+                break
+            if not done and (time.perf_counter() - start) * 1000 >= self.landmark_budget_ms:
+                print(f"Landmark budget spent after {i + len(chunk)} of {len(hashes)} hashes")
+                break
+        report["timings_ms"]["landmark"] = (time.perf_counter() - start) * 1000
+
+        if votes.scores:
+            print(f"Found exact matches for {len(votes.scores)} songs")
+            report["scores"], report["stage"] = votes.scores, "landmark"
+        elif self.total_budget_ms - report["timings_ms"]["landmark"] < self.feature_budget_ms:
+            print("No exact matches and no budget left for feature-based matching")
+            report["skipped"].append("features")
+        else:
+            # Fall back to feature-based similarity matching
+            print("No exact matches, trying feature-based similarity matching...")
+            self._run_feature_stage(report, hashes, offsets, query_file_path, start + self.total_budget_ms / 1000)
+
+        timings = ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in report["timings_ms"].items())
+        print(f"Hybrid match: stage={report['stage']} early_exit={report['early_exit']} {timings}")
+        return report
+
+    def _run_feature_stage(self, report: dict, hashes: Sequence[str], offsets: Optional[Sequence[int]],
+                           query_file_path: str, deadline: float) -> None:
+        """Run the feature stage into report, waiting for it no later than deadline."""
+        feature_start = time.perf_counter()
+        future = self._feature_pool.try_submit(self.feature_strategy.get_batch_scores,
+                                               hashes, offsets, query_file_path, deadline)
+        if future is None:
+            print("No free thread for feature-based matching")
+            report["skipped"].append("features")
+            return
+        try:
+            report["scores"] = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout:
+            print("Feature-based matching ran out of the total budget")
+            report["timed_out"].append("features")
+        report["timings_ms"]["features"] = (time.perf_counter() - feature_start) * 1000
+        report["stage"] = "features" if report["scores"] else None
     
+    def get_batch_scores(self, hashes: Sequence[str], offsets: Optional[Sequence[int]] = None,
+                         query_file_path: str = None) -> Dict[int, float]:
+        """Scores of run(); use FingerprintMatcher.match_report() to get the whole report."""
+        return self.run(hashes, offsets, query_file_path)["scores"]
+
     def get_matches(self, fp_hash: str, query_file_path: str = None) -> List[Fingerprint]:
-        # First try exact matching
         exact_matches = self.exact_strategy.get_matches(fp_hash)
-        
         if exact_matches:
-            print(f"Found {len(exact_matches)} exact matches")
             return exact_matches
-        
-        # Fall back to feature-based similarity matching
-        print("No exact matches, trying weighted feature-based similarity matching...")
         return self.feature_strategy.get_matches(fp_hash, query_file_path)
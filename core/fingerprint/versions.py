@@ -0,0 +1,175 @@
+"""
+Fingerprint algorithm versions in service.
+
+Every algorithm version has its own index (`fingerprints` for version 1,
+`fingerprints_v<version>` after that, or one SQLite file each). The
+`index_state` document names the active version, which recognition queries
+are extracted with and matched against, and optionally a version being built
+next to it:
+
+1. start_build(2): songs stored from now on are fingerprinted into both indexes;
+2. backfill_index(2, ...) fills in the rest of the catalog in the background;
+3. shadow matching (core.fingerprint.shadow) compares both versions on real clips;
+4. switch_active_version(2): one update of the state document. Processes pick it
+   up within INDEX_STATE_TTL_SECONDS, and each query resolves the version once,
+   so it is extracted and matched with the same algorithm.
+
+The old index is left untouched, so switching back is just as quick.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.fingerprint.extractor import ALGORITHMS
+from db.nosql.collections import IndexState, LEGACY_FINGERPRINT_VERSION
+
+INDEX_NAME = "fingerprints"
+# Version served until a state has been recorded
+FINGERPRINT_DEFAULT_VERSION = int(os.getenv("FINGERPRINT_DEFAULT_VERSION", str(LEGACY_FINGERPRINT_VERSION)))
+# How long a process trusts its copy of the state before re-reading it
+INDEX_STATE_TTL_SECONDS = float(os.getenv("INDEX_STATE_TTL_SECONDS", "5"))
+
+_state: Optional[Dict[str, Optional[int]]] = None
+_state_loaded_at = 0.0
+_state_lock = threading.Lock()
+
+
+def _default_state() -> Dict[str, Optional[int]]:
+    return {"active_version": FINGERPRINT_DEFAULT_VERSION, "building_version": None, "previous_version": None}
+
+
+def _as_state(doc: Optional[Dict[str, Any]]) -> Dict[str, Optional[int]]:
+    if not doc:
+        return _default_state()
+    return {
+        "active_version": doc["active_version"],
+        "building_version": doc.get("building_version"),
+        "previous_version": doc.get("previous_version"),
+    }
+
+
+def get_index_state(refresh: bool = False) -> Dict[str, Optional[int]]:
+    """
+    Return {"active_version", "building_version", "previous_version"}.
+
+    The state is cached for INDEX_STATE_TTL_SECONDS. If it cannot be read, the
+    last state this process saw (or the default) is used, so a database hiccup
+    never flips queries to another version.
+    """
+    global _state, _state_loaded_at
+    with _state_lock:
+        if not refresh and _state is not None and time.monotonic() - _state_loaded_at < INDEX_STATE_TTL_SECONDS:
+            return dict(_state)
+        try:
+            _state = _as_state(IndexState._get_collection().find_one({"name": INDEX_NAME}))
+        except Exception as e:
+            print(f"Worker: Could not read fingerprint index state: {e}")
+            if _state is None:
+                return _default_state()
+        _state_loaded_at = time.monotonic()
+        return dict(_state)
+
+
+def get_active_version(refresh: bool = False) -> int:
+    """Algorithm version recognition queries are served with."""
+    return get_index_state(refresh)["active_version"]
+
+
+def serving_versions(refresh: bool = False) -> List[int]:
+    """Versions new fingerprints must be written to: the active one, plus the one being built."""
+    state = get_index_state(refresh)
+    versions = [state["active_version"]]
+    if state["building_version"] is not None and state["building_version"] != state["active_version"]:
+        versions.append(state["building_version"])
+    return versions
+
+
+def _check_registered(version: int) -> None:
+    if version not in ALGORITHMS:
+        raise ValueError(f"Unknown fingerprint algorithm version {version}; "
+                         f"registered: {sorted(ALGORITHMS)}")
+
+
+def start_build(version: int) -> Dict[str, Optional[int]]:
+    """
+    Start building the index of `version` next to the active one.
+
+    :raises ValueError: if the version is not registered or is already active
+    """
+    _check_registered(version)
+    state = get_index_state(refresh=True)
+    if version == state["active_version"]:
+        raise ValueError(f"Fingerprint algorithm version {version} is already active")
+    IndexState._get_collection().update_one(
+        {"name": INDEX_NAME},
+        {"$set": {"building_version": version, "updated_at": datetime.utcnow()},
+         "$setOnInsert": {"active_version": state["active_version"]}},
+        upsert=True,
+    )
+    return get_index_state(refresh=True)
+
+
+def cancel_build() -> Dict[str, Optional[int]]:
+    """Stop writing to the version being built; its index is kept."""
+    IndexState._get_collection().update_one(
+        {"name": INDEX_NAME},
+        {"$set": {"building_version": None, "updated_at": datetime.utcnow()}},
+    )
+    return get_index_state(refresh=True)
+
+
+def switch_active_version(version: int) -> Dict[str, Optional[int]]:
+    """
+    Serve queries from `version`, in one atomic update of the state document.
+    The previously active version is remembered for rollback. If `version` was
+    being built, the build is finished.
+
+    :raises ValueError: if the version is not registered
+    :raises RuntimeError: if another process switched concurrently
+    """
+    _check_registered(version)
+    collection = IndexState._get_collection()
+    doc = collection.find_one({"name": INDEX_NAME})
+    current = _as_state(doc)
+    building = current["building_version"]
+    update = {
+        "active_version": version,
+        "previous_version": current["active_version"],
+        "building_version": None if building == version else building,
+        "updated_at": datetime.utcnow(),
+    }
+    if doc is None:
+        IndexState.ensure_indexes()  # the unique name makes a concurrent first insert fail
+        try:
+            collection.insert_one(dict(update, name=INDEX_NAME))
+        except Exception:
+            raise RuntimeError("Fingerprint index state changed concurrently; retry") from None
+    else:
+        # Compare-and-set on the active version, so two concurrent switches cannot interleave
+        result = collection.update_one({"name": INDEX_NAME, "active_version": current["active_version"]},
+                                       {"$set": update})
+        if result.matched_count != 1:
+            raise RuntimeError("Fingerprint index state changed concurrently; retry")
+    return get_index_state(refresh=True)
+
+
+def backfill_index(version: int, sources: Iterable[Tuple[int, str]], batch_size: int = 32,
+                   max_workers: Optional[int] = None, repository=None) -> Dict[str, int]:
+    """
+    Fingerprint songs with `version`'s algorithm into that version's index.
+    Songs a previous backfill or rebuild finished are skipped; see
+    core.fingerprint.rebuild.RebuildJob for throttling and enumerating the catalog.
+
+    :param sources: (song_id, audio path) pairs, e.g. from the ingest manifest
+    :param batch_size: songs extracted in parallel and written per batch
+    :param max_workers: extraction pool size
+    :param repository: index to write; get_fingerprint_repository(version) by default
+    :return: {"songs": written, "fingerprints": written, "failed": songs without fingerprints}
+    """
+    from core.fingerprint.rebuild import RebuildJob
+
+    job = RebuildJob(version, repository=repository, batch_size=batch_size, max_workers=max_workers)
+    stats = job.run(sources)
+    return {key: stats[key] for key in ("songs", "fingerprints", "failed")}
@@ -0,0 +1,100 @@
+"""
+Binary wire format for precomputed fingerprints (client-side fingerprinting).
+
+All integers are little-endian.
+
+    header (16 bytes)
+        magic               4 bytes   b"TLFP"
+        format_version      u16       layout of this message, currently 1
+        algorithm_version   u16       FingerPrinter.ALGORITHM_VERSION of the extractor
+        params_signature    u32       FingerPrinter.params_signature() of the extractor
+        count               u32       number of records that follow
+    records (12 bytes each)
+        hash                u64       the 16 hex digit landmark hash, as an integer
+        offset              u32       time offset of the anchor peak, in frames
+
+A 10 second clip (~600 landmarks) is about 7 KB, against ~440 KB of 22 kHz WAV.
+"""
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.fingerprint.extractor import FingerPrinter, get_algorithm
+
+MAGIC = b"TLFP"
+FORMAT_VERSION = 1
+MEDIA_TYPE = "application/x-tuneleap-fingerprints"
+
+_HEADER = struct.Struct("<4sHHII")
+RECORD_DTYPE = np.dtype([("hash", "<u8"), ("offset", "<u4")])
+HEADER_SIZE = _HEADER.size
+
+
+class WireFormatError(ValueError):
+    """Raised when a message is not a well-formed fingerprint message."""
+    pass
+
+
+class IncompatibleFingerprints(WireFormatError):
+    """Raised when a message was produced by a different extractor version or parameters."""
+
+    def __init__(self, message: str, algorithm_version: int, params_signature: int):
+        super().__init__(message)
+        self.algorithm_version = algorithm_version
+        self.params_signature = params_signature
+
+
+def encode_fingerprints(fingerprints: List[Tuple[str, int]],
+                        algorithm_version: int = FingerPrinter.ALGORITHM_VERSION,
+                        params_signature: int = None) -> bytes:
+    """
+    Reference encoder: pack (hash, offset) fingerprints into a wire message.
+
+    :param fingerprints: output of FingerPrinter.extract_fingerprints / fingerprint_signal
+    :param algorithm_version: extractor version to declare
+    :param params_signature: extractor parameter signature to declare; defaults to that of
+        this server's extractor for algorithm_version
+    """
+    if params_signature is None:
+        params_signature = get_algorithm(algorithm_version).params_signature()
+    records = np.empty(len(fingerprints), dtype=RECORD_DTYPE)
+    records["hash"] = np.fromiter((int(h, 16) for h, _ in fingerprints), dtype=np.uint64, count=len(fingerprints))
+    records["offset"] = np.fromiter((t for _, t in fingerprints), dtype=np.uint32, count=len(fingerprints))
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, algorithm_version, params_signature, len(records))
+    return header + records.tobytes()
+
+
+def decode_fingerprints(data: bytes, max_count: int = 0, version: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Unpack a wire message into (hash, offset) fingerprints.
+
+    :param data: the message
+    :param max_count: maximum accepted number of records (0 = unlimited)
+    :param version: algorithm version the fingerprints must come from; FingerPrinter by default
+    :raises WireFormatError: if the message is malformed or too large
+    :raises IncompatibleFingerprints: if it was produced by another extractor version
+    """
+    if len(data) < HEADER_SIZE:
+        raise WireFormatError("Message shorter than header")
+    magic, format_version, algorithm_version, params_signature, count = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise WireFormatError("Not a fingerprint message")
+    if format_version != FORMAT_VERSION:
+        raise WireFormatError(f"Unsupported format version {format_version}")
+    algorithm = get_algorithm(version)
+    if algorithm_version != algorithm.ALGORITHM_VERSION or params_signature != algorithm.params_signature():
+        raise IncompatibleFingerprints(
+            f"Fingerprints from extractor version {algorithm_version} "
+            f"(params {params_signature:08x}) are not compatible with version "
+            f"{algorithm.ALGORITHM_VERSION} (params {algorithm.params_signature():08x})",
+            algorithm_version,
+            params_signature,
+        )
+    if max_count and count > max_count:
+        raise WireFormatError(f"Too many fingerprints ({count} > {max_count})")
+    if len(data) != HEADER_SIZE + count * RECORD_DTYPE.itemsize:
+        raise WireFormatError("Record count does not match message length")
+
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+    return [(f"{h:016x}", int(t)) for h, t in zip(records["hash"].tolist(), records["offset"].tolist())]
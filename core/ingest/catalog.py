@@ -0,0 +1,462 @@
+"""
+Bulk ingestion of a music library.
+
+Files come from a directory walk (Artist/Album/Title.ext or "Artist - Title.ext")
+or a CSV manifest. Each file is decoded once in a worker pool, which returns
+both its fingerprints and its feature vector; the parent process creates the
+Artist/Album/Song rows and writes fingerprints and features in batches, then
+records the finished files in a checkpoint so an interrupted run resumes
+where it stopped. A run that completes removes its checkpoint.
+
+With an ingest manifest, every song also remembers the content hash of its
+source file and the extractor versions that processed it. Files whose size
+and modification time are unchanged are skipped without being read, touched
+files are hashed and skipped if their content is the same, and only new or
+changed audio (or audio processed by an older extractor) is decoded again.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.cache.recognition import content_key_from_file
+from core.compute.pool import create_executor, default_workers
+from core.repository.album_repository import AlbumRepository
+from core.repository.artist_repository import ArtistRepository
+from core.repository.song_repository import SongRepository
+from db.sql.models import Album, Artist, Song
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".m4a", ".aac", ".aiff", ".aif")
+UNKNOWN_ARTIST = "Unknown Artist"
+
+# decode/fingerprint/extract_features are worker time summed over the pool;
+# the rest is time the parent spends writing
+STAGES = ("hash", "decode", "fingerprint", "extract_features", "catalog", "store_fingerprints", "store_features", "checkpoint")
+
+
+def _entry(path: str, title: str, artist: str, album: Optional[str] = None,
+           duration: Optional[int] = None) -> Dict[str, Any]:
+    return {
+        "path": os.path.abspath(path),
+        "title": title.strip(),
+        "artist": (artist or UNKNOWN_ARTIST).strip(),
+        "album": album.strip() if album else None,
+        "duration": duration,
+    }
+
+
+def scan_directory(root: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield catalog entries for the audio files under root, in a stable order.
+
+    Metadata comes from the layout: Artist/Album/Title.ext, Artist/Title.ext,
+    or "Artist - Title.ext" for files directly under root.
+    """
+    root = os.path.abspath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() not in AUDIO_EXTENSIONS:
+                continue
+            parts = os.path.relpath(dirpath, root).split(os.sep)
+            parts = [] if parts == ["."] else parts
+            if len(parts) >= 2:
+                artist, album, title = parts[-2], parts[-1], stem
+            elif len(parts) == 1:
+                artist, album, title = parts[0], None, stem
+            elif " - " in stem:
+                artist, title = stem.split(" - ", 1)
+                album = None
+            else:
+                artist, album, title = None, None, stem
+            yield _entry(os.path.join(dirpath, filename), title, artist, album)
+
+
+def read_manifest(manifest_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield catalog entries from a CSV manifest with a header row.
+
+    Columns: path (required), title, artist, album, duration. Relative paths
+    are resolved against the manifest's directory; a missing title defaults
+    to the file name.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            path = (row.get("path") or "").strip()
+            if not path:
+                continue
+            duration = (row.get("duration") or "").strip()
+            yield _entry(
+                os.path.join(base, path),
+                row.get("title") or os.path.splitext(os.path.basename(path))[0],
+                row.get("artist"),
+                row.get("album") or None,
+                int(float(duration)) if duration else None,
+            )
+
+
+def extractor_versions(version: Optional[int] = None) -> Dict[str, int]:
+    """
+    Versions of the extractors whose output ingestion stores.
+
+    :param version: fingerprint algorithm version; the default FingerPrinter if None
+    """
+    from core.fingerprint.extractor import get_algorithm
+    from core.reco.features import FEATURE_VERSION
+
+    algorithm = get_algorithm(version)
+    return {
+        "algorithm_version": algorithm.ALGORITHM_VERSION,
+        "params_signature": algorithm.params_signature(),
+        "feature_version": FEATURE_VERSION,
+    }
+
+
+def file_signature(path: str) -> Dict[str, Any]:
+    """Size, modification time and content hash of a file."""
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        content_hash = content_key_from_file(f)
+    return {"file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": content_hash}
+
+
+def analyze_file(path: str, known_hash: Optional[str] = None, version: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Decode a file once and compute its fingerprints and feature vector.
+
+    Runs in a pool worker, so it never raises: failures are returned in "error".
+
+    :param known_hash: content hash the file was last ingested with; if it still
+        matches, the file is not decoded and the result has "unchanged" set
+    :param version: fingerprint algorithm version; the default FingerPrinter if None
+    """
+    import librosa
+
+    from core.fingerprint.extractor import get_algorithm
+    from core.reco.features import extract_features_from_signal
+
+    result = {"path": path, "error": None, "unchanged": False, "timings": {}}
+    try:
+        start = time.perf_counter()
+        result["signature"] = file_signature(path)
+        hashed = time.perf_counter()
+        result["timings"]["hash"] = hashed - start
+        if known_hash is not None and result["signature"]["content_hash"] == known_hash:
+            result["unchanged"] = True
+            return result
+        algorithm = get_algorithm(version)
+        y, sr = librosa.load(path, sr=algorithm.SAMPLE_RATE, mono=True)
+        decoded = time.perf_counter()
+        fingerprints = algorithm().fingerprint_signal(y)
+        fingerprinted = time.perf_counter()
+        features = extract_features_from_signal(y, sr=sr)
+        done = time.perf_counter()
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    result["duration"] = int(round(len(y) / sr))
+    result["fingerprints"] = fingerprints
+    result["features"] = features
+    result["timings"].update(decode=decoded - hashed, fingerprint=fingerprinted - decoded,
+                             extract_features=done - fingerprinted)
+    return result
+
+
+class IngestCheckpoint:
+    """
+    Record of the files a previous run already finished, kept in a JSON file.
+
+    :param path: checkpoint file; None keeps the checkpoint in memory only
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.done: Dict[str, int] = {}
+        self.failed: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.done = state.get("done", {})
+            self.failed = state.get("failed", {})
+
+    def is_done(self, path: str) -> bool:
+        return path in self.done
+
+    def mark_done(self, path: str, song_id: int) -> None:
+        self.done[path] = song_id
+        self.failed.pop(path, None)
+
+    def mark_failed(self, path: str, error: str) -> None:
+        self.failed[path] = error
+
+    def clear(self) -> None:
+        """Forget all progress; called once a run has finished."""
+        self.done, self.failed = {}, {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self) -> None:
+        """Write atomically, so a crash mid-write never loses the previous checkpoint."""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"done": self.done, "failed": self.failed}, f)
+        os.replace(tmp_path, self.path)
+
+
+class CatalogIngester:
+    """
+    Ingest catalog entries into the SQL catalog, the fingerprint index and the feature store.
+
+    :param session: SQLAlchemy session for Artist/Album/Song rows
+    :param fingerprint_repository: fingerprint store with store_many()
+    :param feature_repository: feature store with bulk_upsert()
+    :param workers: analysis pool size; defaults to default_workers()
+    :param batch_size: analyzed files per store write and checkpoint
+    :param checkpoint: progress record; in memory only by default
+    :param pool_kind: "process" or "thread"; defaults to EXTRACT_POOL_KIND
+    :param manifest_repository: IngestManifestRepository recording what each song
+        was ingested from; used to skip unchanged files
+    :param force: process every file even if the manifest says it is unchanged
+    :param version: fingerprint algorithm version to extract with; must match
+        the index fingerprint_repository writes to. The default FingerPrinter if None
+    """
+
+    def __init__(self, session: Session, fingerprint_repository, feature_repository,
+                 workers: Optional[int] = None, batch_size: int = 32,
+                 checkpoint: Optional[IngestCheckpoint] = None, pool_kind: Optional[str] = None,
+                 manifest_repository=None, force: bool = False, version: Optional[int] = None):
+        self.session = session
+        self.fingerprint_repository = fingerprint_repository
+        self.feature_repository = feature_repository
+        self.workers = workers or default_workers()
+        self.batch_size = max(1, batch_size)
+        self.checkpoint = checkpoint or IngestCheckpoint()
+        self.pool_kind = pool_kind
+        self.manifest_repository = manifest_repository
+        self.force = force
+        self.version = version
+        self._known: Dict[str, Dict[str, Any]] = {}
+        self._artist_ids: Dict[str, int] = {}
+        self._album_ids: Dict[Tuple[int, str], int] = {}
+
+    def run(self, entries: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Ingest entries not yet in the checkpoint and return run statistics:
+        counts, wall time, files/sec and seconds spent per stage. "skipped"
+        counts files finished by an interrupted earlier run, "unchanged" files
+        whose audio and extractors are the same as at their last ingest.
+        """
+        stats = {"ingested": 0, "failed": 0, "skipped": 0, "unchanged": 0, "fingerprints": 0,
+                 "stages": {stage: 0.0 for stage in STAGES}}
+        started = time.perf_counter()
+
+        pending = []
+        for entry in entries:
+            if self.checkpoint.is_done(entry["path"]):
+                stats["skipped"] += 1
+            else:
+                pending.append(entry)
+        if self.manifest_repository is not None and pending and not self.force:
+            pending = self._drop_untouched(pending, stats)
+
+        batch: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        if pending:
+            executor = create_executor(self.workers, self.pool_kind)
+            try:
+                for entry, result in self._analyze(executor, pending):
+                    for stage, seconds in result["timings"].items():
+                        stats["stages"][stage] += seconds
+                    if result["error"] is not None:
+                        print(f"Ingest: Failed to analyze {entry['path']}: {result['error']}")
+                        self.checkpoint.mark_failed(entry["path"], result["error"])
+                        stats["failed"] += 1
+                        continue
+                    batch.append((entry, result))
+                    if len(batch) >= self.batch_size:
+                        self._write_batch(batch, stats)
+                        batch = []
+                if batch:
+                    self._write_batch(batch, stats)
+            finally:
+                executor.shutdown(wait=True)
+        # Finished: the next run starts from the manifest, not from this run's progress
+        stats["failed_paths"] = dict(self.checkpoint.failed)
+        self.checkpoint.clear()
+
+        stats["elapsed"] = time.perf_counter() - started
+        stats["files_per_second"] = stats["ingested"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        return stats
+
+    def _drop_untouched(self, entries: List[Dict[str, Any]], stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Skip files whose manifest record is from the current extractors and whose size
+        and modification time did not change; remember the records of the rest so the
+        workers can compare content hashes.
+        """
+        start = time.perf_counter()
+        versions = extractor_versions(self.version)
+        records = self.manifest_repository.get_by_paths(entry["path"] for entry in entries)
+        remaining = []
+        for entry in entries:
+            record = records.get(entry["path"])
+            if record is None or any(record.get(key) != value for key, value in versions.items()):
+                remaining.append(entry)
+                continue
+            try:
+                stat = os.stat(entry["path"])
+            except OSError:
+                remaining.append(entry)  # reported as a failure by the worker
+                continue
+            if stat.st_size == record.get("file_size") and stat.st_mtime_ns == record.get("mtime_ns"):
+                self.checkpoint.mark_done(entry["path"], record["song_id"])
+                stats["unchanged"] += 1
+            else:
+                self._known[entry["path"]] = record
+                remaining.append(entry)
+        stats["stages"]["hash"] += time.perf_counter() - start
+        return remaining
+
+    def _analyze(self, executor, entries: List[Dict[str, Any]]):
+        """Yield (entry, analysis) as files finish, keeping a bounded number in flight."""
+        max_in_flight = self.workers * 2
+        in_flight = {}
+        remaining = iter(entries)
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                entry = next(remaining, None)
+                if entry is None:
+                    exhausted = True
+                    break
+                known = self._known.get(entry["path"])
+                known_hash = known["content_hash"] if known else None
+                in_flight[executor.submit(analyze_file, entry["path"], known_hash, self.version)] = entry
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                entry = in_flight.pop(future)
+                try:
+                    yield entry, future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. a broken process pool)
+                    yield entry, {"path": entry["path"], "error": str(e), "timings": {}}
+
+    def _write_batch(self, batch: List[Tuple[Dict[str, Any], Dict[str, Any]]], stats: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        unchanged = [(entry, result) for entry, result in batch if result["unchanged"]]
+        batch = [(entry, result) for entry, result in batch if not result["unchanged"]]
+        song_ids = self._song_ids([entry for entry, _ in batch], [result for _, result in batch]) if batch else []
+        catalogued = time.perf_counter()
+
+        fingerprints_by_song = {song_id: result["fingerprints"] for song_id, (_, result) in zip(song_ids, batch)}
+        stats["fingerprints"] += self.fingerprint_repository.store_many(fingerprints_by_song)
+        fingerprinted = time.perf_counter()
+
+        features_by_song = {
+            song_id: result["features"]
+            for song_id, (_, result) in zip(song_ids, batch)
+            if result["features"] is not None and len(result["features"])
+        }
+        self.feature_repository.bulk_upsert(features_by_song)
+        featured = time.perf_counter()
+
+        if self.manifest_repository is not None:
+            # Touched but unchanged files get their new size and mtime, so the next run skips them by stat
+            songs = [(song_id, result) for song_id, (_, result) in zip(song_ids, batch)]
+            songs += [(self._known[entry["path"]]["song_id"], result) for entry, result in unchanged]
+            versions = extractor_versions(self.version)
+            self.manifest_repository.record_many([
+                dict(result["signature"], song_id=song_id, source_path=result["path"], **versions)
+                for song_id, result in songs
+            ])
+        for song_id, (entry, _) in zip(song_ids, batch):
+            self.checkpoint.mark_done(entry["path"], song_id)
+        for entry, _ in unchanged:
+            self.checkpoint.mark_done(entry["path"], self._known.pop(entry["path"])["song_id"])
+        self.checkpoint.save()
+        done = time.perf_counter()
+
+        stats["ingested"] += len(batch)
+        stats["unchanged"] += len(unchanged)
+        stats["stages"]["catalog"] += catalogued - start
+        stats["stages"]["store_fingerprints"] += fingerprinted - catalogued
+        stats["stages"]["store_features"] += featured - fingerprinted
+        stats["stages"]["checkpoint"] += done - featured
+        print(f"Ingest: {stats['ingested']} files written ({stats['fingerprints']} fingerprints)")
+
+    def _song_ids(self, entries: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> List[int]:
+        """
+        Return the song id of each entry, creating missing artists, albums and songs in bulk.
+        A song with the same artist, album and title is reused, so re-ingesting a file
+        replaces its fingerprints instead of duplicating the song.
+        """
+        self._ensure_artists({entry["artist"] for entry in entries})
+        self._ensure_albums({(self._artist_ids[entry["artist"]], entry["album"])
+                             for entry in entries if entry["album"]})
+
+        keys = [
+            (self._artist_ids[entry["artist"]],
+             self._album_ids[(self._artist_ids[entry["artist"]], entry["album"])] if entry["album"] else None,
+             entry["title"])
+            for entry in entries
+        ]
+        existing = {
+            (song.artist_id, song.album_id, song.title): song.id
+            for song in self.session.query(Song).filter(
+                Song.artist_id.in_({key[0] for key in keys}),
+                Song.title.in_({key[2] for key in keys}),
+            )
+        }
+
+        new_songs = {}
+        for key, entry, result in zip(keys, entries, results):
+            if key not in existing and key not in new_songs:
+                new_songs[key] = {
+                    "title": key[2],
+                    "artist_id": key[0],
+                    "album_id": key[1],
+                    "duration": entry["duration"] if entry["duration"] is not None else result.get("duration"),
+                }
+        if new_songs:
+            created = SongRepository(self.session).bulk_insert(list(new_songs.values()))
+            existing.update({key: song.id for key, song in zip(new_songs, created)})
+        return [existing[key] for key in keys]
+
+    def _ensure_artists(self, names) -> None:
+        missing = [name for name in names if name not in self._artist_ids]
+        if not missing:
+            return
+        for artist in self.session.query(Artist).filter(Artist.name.in_(missing)):
+            self._artist_ids[artist.name] = artist.id
+        new_names = sorted(name for name in missing if name not in self._artist_ids)
+        if new_names:
+            created = ArtistRepository(self.session).bulk_insert([{"name": name} for name in new_names])
+            self._artist_ids.update({artist.name: artist.id for artist in created})
+
+    def _ensure_albums(self, keys) -> None:
+        missing = [key for key in keys if key not in self._album_ids]
+        if not missing:
+            return
+        for album in self.session.query(Album).filter(
+            Album.artist_id.in_({artist_id for artist_id, _ in missing}),
+            Album.title.in_({title for _, title in missing}),
+        ):
+            self._album_ids.setdefault((album.artist_id, album.title), album.id)
+        new_keys = sorted(key for key in missing if key not in self._album_ids)
+        if new_keys:
+            created = AlbumRepository(self.session).bulk_insert(
+                [{"artist_id": artist_id, "title": title} for artist_id, title in new_keys]
+            )
+            self._album_ids.update({(album.artist_id, album.title): album.id for album in created})
@@ -1,6 +1,34 @@
 ﻿import os
+import shutil
 import uuid
+from typing import Dict, Optional
+
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+# Largest accepted audio upload, in bytes (0 = unlimited)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Where uploads are written for the worker; point at a tmpfs (e.g. /dev/shm/tuneleap) to keep them in memory
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "tmp")
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Room for multipart boundaries and headers on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+def _temp_path(upload_file: UploadFile, dir: str) -> str:
+    # generate a unique filename
+    filename = f"{uuid.uuid4().hex}_{os.path.basename(upload_file.filename or 'upload')}"
+    return os.path.join(dir, filename)
+
 
 def save_temp(upload_file: UploadFile, dir: str) -> str:
     """
@@ -12,17 +40,119 @@ def save_temp(upload_file: UploadFile, dir: str) -> str:
     """
     # ensure target directory exists
     os.makedirs(dir, exist_ok=True)
+    path = _temp_path(upload_file, dir)
 
-    # generate a unique filename
-    filename = f"{uuid.uuid4().hex}_{upload_file.filename}"
-    path = os.path.join(dir, filename)
-
-    # rewind and read all bytes
+    # rewind and copy in chunks so memory use doesn't grow with the upload
     upload_file.file.seek(0)
-    content = upload_file.file.read()
-
-    # write to disk
     with open(path, "wb") as f:
-        f.write(content)
+        shutil.copyfileobj(upload_file.file, f, UPLOAD_CHUNK_SIZE)
+
+    return path
+
+
+async def save_temp_async(upload_file: UploadFile, dir: Optional[str] = None,
+                          max_bytes: int = UPLOAD_MAX_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """
+    Save an incoming UploadFile to a temporary file without blocking the event loop.
+
+    The upload is copied one chunk at a time, so memory per upload stays at
+    chunk_size, and file I/O runs on the thread pool. Uploads whose declared
+    size is too large are rejected before anything is written; otherwise the
+    copy stops as soon as the limit is crossed and the partial file is removed.
+
+    :param upload_file: FastAPI UploadFile instance
+    :param dir: directory in which to write the temp file; defaults to UPLOAD_SPOOL_DIR
+    :param max_bytes: maximum upload size (0 = unlimited)
+    :param chunk_size: bytes read and written per step
+    :return: full path to the saved file
+    :raises UploadTooLarge: if the upload is larger than max_bytes
+    """
+    if max_bytes and upload_file.size is not None and upload_file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    dir = dir or UPLOAD_SPOOL_DIR
+    await run_in_threadpool(os.makedirs, dir, exist_ok=True)
+    path = _temp_path(upload_file, dir)
+
+    await upload_file.seek(0)
+    f = await run_in_threadpool(open, path, "wb")
+    written = 0
+    try:
+        while True:
+            chunk = await upload_file.read(chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if max_bytes and written > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, path)
+        raise
+    await run_in_threadpool(f.close)
 
     return path
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that rejects oversized request bodies with 413 before they are parsed.
+
+    Requests with a Content-Length above the limit are answered without
+    reading the body at all; chunked bodies are counted while they stream
+    and cut off as soon as they cross the limit.
+
+    :param app: ASGI application
+    :param limits: path prefix -> maximum body size in bytes; the longest matching prefix applies
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str) -> int:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return 0
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope.get("path", "")) if scope["type"] == "http" else 0
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(status_code=413, content={"detail": f"Request body too large (max {limit} bytes)."})
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await response(scope, receive, send)
+                return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _BodyTooLarge:
+            if not started:
+                await response(scope, receive, send)
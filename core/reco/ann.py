@@ -0,0 +1,201 @@
+"""
+Approximate nearest-neighbour search over unit-length feature vectors.
+
+IVFIndex is an inverted file index: spherical k-means splits the vectors
+into n_lists clusters, and a query is scored only against the vectors of
+its `nprobe` closest clusters. Higher nprobe trades latency for recall;
+nprobe = n_lists is exact search. Similarity is the inner product, i.e. the
+cosine of the (pre-weighted) unit vectors FeatureSearchEngine stores.
+"""
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Catalog size from which recommendations (and feature search, with FEATURE_SEARCH_ANN) use the index
+FEATURE_ANN_MIN_SONGS = int(os.getenv("FEATURE_ANN_MIN_SONGS", "200000"))
+# Clusters searched per query
+FEATURE_ANN_NPROBE = int(os.getenv("FEATURE_ANN_NPROBE", "32"))
+
+# Rows per block when assigning vectors to centroids (bounds the n x n_lists score matrix)
+_ASSIGN_BLOCK = 65536
+
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length; all-zero rows stay zero."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def default_n_lists(count: int) -> int:
+    """About 4 * sqrt(n) clusters, the usual IVF sizing."""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+
+class IVFIndex:
+    """
+    Inverted file index with inner-product scoring.
+
+    :param centroids: (n_lists, dim) unit-length cluster centres
+    :param nprobe: clusters searched per query (the recall/latency knob)
+    :param tag: label saved with the index, e.g. a digest of the vectors it
+        was built from; add() and remove() leave it alone, copies start without one
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = FEATURE_ANN_NPROBE, tag: str = ""):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self.tag = tag
+        self._ids: List[np.ndarray] = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._vectors: List[np.ndarray] = [np.empty((0, self.dim), dtype=np.float32) for _ in range(len(self.centroids))]
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + sum(ids.nbytes + vectors.nbytes
+                                           for ids, vectors in zip(self._ids, self._vectors))
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, n_lists: Optional[int] = None,
+              iterations: int = 10, sample_size: Optional[int] = None, nprobe: int = FEATURE_ANN_NPROBE,
+              seed: int = 0) -> "IVFIndex":
+        """
+        Train centroids with spherical k-means on a sample and add every vector.
+
+        :param ids: one integer ID per row
+        :param vectors: (n, dim) unit-length rows
+        :param n_lists: number of clusters; default_n_lists(n) by default
+        :param iterations: k-means iterations
+        :param sample_size: training rows; 64 per cluster by default
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_lists = n_lists or default_n_lists(len(vectors))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), sample_size or 64 * n_lists)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(centroids, sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            # Empty clusters restart from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = unit_rows(sums)
+
+        index = cls(centroids, nprobe=nprobe)
+        index.add(ids, vectors)
+        return index
+
+    def copy(self) -> "IVFIndex":
+        """
+        An independent index sharing this one's arrays. add() and remove()
+        replace a list's arrays rather than modifying them, so neither index
+        sees the other's changes.
+        """
+        index = IVFIndex(self.centroids, nprobe=self.nprobe)
+        index._ids = list(self._ids)
+        index._vectors = list(self._vectors)
+        return index
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Add vectors under new IDs (use remove() first to replace a vector)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        if not len(ids):
+            return
+        assignment = _nearest(self.centroids, vectors)
+        order = np.argsort(assignment, kind="stable")
+        lists, starts = np.unique(assignment[order], return_index=True)
+        for list_id, rows in zip(lists, np.split(order, starts[1:])):
+            self._ids[list_id] = np.concatenate([self._ids[list_id], ids[rows]])
+            self._vectors[list_id] = np.concatenate([self._vectors[list_id], vectors[rows]])
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Remove vectors by ID; returns how many were found."""
+        ids = np.asarray(ids, dtype=np.int64)
+        removed = 0
+        for list_id, list_ids in enumerate(self._ids):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                removed += int((~keep).sum())
+                self._ids[list_id] = list_ids[keep]
+                self._vectors[list_id] = self._vectors[list_id][keep]
+        return removed
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k best (id, score) pairs among the nprobe nearest clusters,
+        best first, as two arrays.
+
+        :param query: unit-length vector
+        """
+        nprobe = min(self.n_lists, nprobe or self.nprobe)
+        query = np.asarray(query, dtype=np.float32)
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        ids = np.concatenate([self._ids[i] for i in probe])
+        if not len(ids) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.concatenate([self._vectors[i] for i in probe]) @ query
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order]
+
+    def save(self, path: str) -> None:
+        """Write the index to `path` in NumPy's .npz format."""
+        sizes = np.array([len(ids) for ids in self._ids], dtype=np.int64)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                sizes=sizes,
+                ids=np.concatenate(self._ids),
+                vectors=np.concatenate(self._vectors),
+                nprobe=np.array(self.nprobe),
+                tag=np.array(self.tag),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """Read an index written by save()."""
+        with np.load(path) as data:
+            # Indexes saved before tags were added have none
+            tag = str(data["tag"]) if "tag" in data.files else ""
+            index = cls(data["centroids"], nprobe=int(data["nprobe"]), tag=tag)
+            bounds = np.cumsum(data["sizes"])[:-1]
+            index._ids = list(np.split(data["ids"], bounds))
+            index._vectors = list(np.split(data["vectors"], bounds))
+        return index
+
+
+def _nearest(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Index of the highest-scoring centroid of each vector."""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK):
+        block = vectors[start:start + _ASSIGN_BLOCK]
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def recall_at_k(index: IVFIndex, ids: np.ndarray, vectors: np.ndarray, queries: np.ndarray,
+                k: int = 10, nprobe: Optional[int] = None) -> float:
+    """Share of the exact top k (by inner product) that the index returns, averaged over queries."""
+    hits = 0
+    for query in queries:
+        exact = ids[np.argpartition(-(vectors @ query), k - 1)[:k]]
+        found, _ = index.search(query, k, nprobe)
+        hits += len(np.intersect1d(exact, found))
+    return hits / (k * len(queries))
@@ -1,4 +1,6 @@
-﻿from typing import List, Dict
+﻿from typing import List, Dict, Optional
+from core.reco.ann import IVFIndex
+from core.reco.cascade import CascadeSearchEngine
 from core.reco.engine import RecommenderEngine
 
 class PlaylistBuilder:
@@ -6,11 +8,14 @@ class PlaylistBuilder:
     Builds a playlist of recommended songs given precomputed features.
     """
 
-    def __init__(self, feature_map: Dict[int, any]):
+    def __init__(self, feature_map: Dict[int, any], index: Optional[IVFIndex] = None,
+                 cascade: Optional[CascadeSearchEngine] = None):
         """
         :param feature_map: { song_id: feature_vector }
+        :param index: optional approximate index, see RecommenderEngine
+        :param cascade: optional coarse-to-fine engine, see RecommenderEngine
         """
-        self.engine = RecommenderEngine(feature_map)
+        self.engine = RecommenderEngine(feature_map, index=index, cascade=cascade)
 
     def build(self, song_id: int, top_n: int = 5) -> List[int]:
         """
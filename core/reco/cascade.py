@@ -0,0 +1,144 @@
+"""
+Two-stage (coarse-to-fine) search over the catalog's audio feature vectors.
+
+The first COARSE_FEATURE_DIM elements of a feature vector are the chroma and
+MFCC means, i.e. exactly what extract_lightweight_features returns (pinned
+by tests/test_feature_cascade.py). The first stage keeps only those,
+pre-weighted and normalized, as float32 rows (100 bytes per song) and
+shortlists the FEATURE_CASCADE_SHORTLIST best songs. The second stage scores
+the shortlist with the full weighted cosine similarity, from a float32 copy
+of the vectors made once per engine.
+
+Songs outside the shortlist are never fine-scored, so results are
+approximate; a longer shortlist raises recall and latency.
+
+FEATURE_CASCADE_DTYPE=float16 halves the coarse rows. NumPy has no float16
+matrix product, though, so they are converted to float32 block by block
+while scoring, which makes the first stage slower than single-stage search.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.reco.ann import unit_rows
+from core.reco.search import (
+    FALLBACK_FEATURE_WEIGHTS,
+    FEATURE_DIM,
+    feature_weights,
+    rescored_top_k,
+    weighted_cosine_similarity,
+)
+
+# Length of extract_lightweight_features vectors: 12 chroma + 13 MFCC means
+COARSE_FEATURE_DIM = 25
+# Use the cascade for the recognition fallback and recommendations
+FEATURE_SEARCH_CASCADE = os.getenv("FEATURE_SEARCH_CASCADE", "false").lower() in ("1", "true", "yes")
+# Songs passed from the coarse to the fine stage per query
+FEATURE_CASCADE_SHORTLIST = int(os.getenv("FEATURE_CASCADE_SHORTLIST", "500"))
+# Storage type of the coarse rows: float32 (fastest) or float16 (smallest)
+FEATURE_CASCADE_DTYPE = os.getenv("FEATURE_CASCADE_DTYPE", "float32")
+
+# Rows scored per block when converting float16 coarse rows or fine-scoring many rows; small blocks stay in cache
+_SCORE_BLOCK = 4096
+
+
+class CascadeSearchEngine:
+    """
+    Coarse-to-fine weighted cosine search; same interface as FeatureSearchEngine.
+
+    Only FEATURE_DIM vectors go through the coarse stage; songs with other
+    vector lengths (legacy rows) are always fine-scored. The input mapping
+    is kept by reference for the fine stage, so it must not be modified
+    while the engine is in use.
+
+    :param features: song_id -> feature vector
+    :param profile: per-feature weights, e.g. FALLBACK_FEATURE_WEIGHTS
+    :param shortlist: songs fine-scored per query (at least k)
+    :param dtype: storage type of the coarse rows, "float16" or "float32"
+    """
+
+    def __init__(self, features: Dict[int, np.ndarray], profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS,
+                 shortlist: int = FEATURE_CASCADE_SHORTLIST, dtype: str = FEATURE_CASCADE_DTYPE):
+        self.features = features
+        self.profile = profile
+        self.shortlist = shortlist
+        self.song_ids = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+
+        lengths = np.fromiter((len(v) for v in features.values()), dtype=np.int64, count=len(features))
+        self._coarse_rows = np.flatnonzero(lengths == FEATURE_DIM)
+        self._other_rows = np.flatnonzero((lengths != FEATURE_DIM) & (lengths > 0))
+        vectors = list(features.values())
+        # Fine-stage rows; weights and norms depend on the query's length, so they are applied per query
+        self._fine = np.array([vectors[i] for i in self._coarse_rows], dtype=np.float32)
+        self._fine = self._fine.reshape(len(self._coarse_rows), FEATURE_DIM)
+        coarse = self._fine[:, :COARSE_FEATURE_DIM].astype(np.float64) * self._coarse_weights
+        self._coarse = unit_rows(coarse).astype(dtype)
+
+    @property
+    def _coarse_weights(self) -> np.ndarray:
+        return feature_weights(FEATURE_DIM, self.profile)[:COARSE_FEATURE_DIM]
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the coarse and fine matrices, not counting `features`."""
+        return self._coarse.nbytes + self._fine.nbytes + self._coarse_rows.nbytes + self._other_rows.nbytes
+
+    def coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        """First-stage similarity of the query to each FEATURE_DIM song (float32)."""
+        q = np.asarray(query, dtype=np.float64)[:COARSE_FEATURE_DIM] * self._coarse_weights
+        norm = np.linalg.norm(q)
+        scores = np.zeros(len(self._coarse), dtype=np.float32)
+        if norm == 0:
+            return scores
+        q = (q / norm).astype(np.float32)
+        if self._coarse.dtype == np.float32:
+            return self._coarse @ q
+        buffer = np.empty((_SCORE_BLOCK, COARSE_FEATURE_DIM), dtype=np.float32)
+        for start in range(0, len(self._coarse), _SCORE_BLOCK):
+            block = self._coarse[start:start + _SCORE_BLOCK]
+            converted = buffer[:len(block)]
+            converted[...] = block
+            np.matmul(converted, q, out=scores[start:start + len(block)])
+        return scores
+
+    def search(self, query: np.ndarray, k: int = 10,
+               threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        The k most similar songs among the shortlist as (song_id, similarity),
+        best first; songs below `threshold` are left out.
+        """
+        if k <= 0 or len(self.song_ids) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float64)
+        if len(query) < FEATURE_DIM:
+            # Compared over the query's length; the coarse stage does not apply
+            picked = np.arange(len(self._coarse_rows))
+        else:
+            coarse = self.coarse_scores(query)
+            size = min(len(coarse), max(k, self.shortlist))
+            picked = np.argpartition(-coarse, size - 1)[:size] if size else np.arange(0)
+
+        approx = np.full(len(self.song_ids), -np.inf)
+        approx[self._coarse_rows[picked]] = self._fine_scores(query, picked)
+        for row in self._other_rows:
+            approx[row] = weighted_cosine_similarity(query, self.features[int(self.song_ids[row])], self.profile)
+        return rescored_top_k(query, approx, self.song_ids, self.features, self.profile, k, threshold)
+
+    def _fine_scores(self, query: np.ndarray, picked: np.ndarray) -> np.ndarray:
+        """Full weighted cosine of the query to the given rows of the fine matrix."""
+        length = min(FEATURE_DIM, len(query))
+        weights = feature_weights(length, self.profile)
+        q = query[:length] * weights
+        q_norm = np.linalg.norm(q)
+        scores = np.zeros(len(picked))
+        if q_norm == 0:
+            return scores
+        for start in range(0, len(picked), _SCORE_BLOCK):
+            block = self._fine[picked[start:start + _SCORE_BLOCK], :length] * weights
+            norms = np.linalg.norm(block, axis=1) * q_norm
+            np.divide(block @ q, norms, out=scores[start:start + len(block)], where=norms > 0)
+        return scores
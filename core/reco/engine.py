@@ -1,5 +1,10 @@
-﻿import numpy as np
-from typing import Dict, List, Tuple
+﻿import hashlib
+
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from core.reco.ann import FEATURE_ANN_NPROBE, IVFIndex, unit_rows
+from core.reco.cascade import CascadeSearchEngine
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     """
@@ -14,11 +19,25 @@ class RecommenderEngine:
     Given a mapping of song_id to feature vectors, compute top-N similar songs.
     """
 
-    def __init__(self, feature_map: Dict[int, np.ndarray]):
+    def __init__(self, feature_map: Dict[int, np.ndarray], index: Optional[IVFIndex] = None,
+                 nprobe: int = FEATURE_ANN_NPROBE, cascade: Optional[CascadeSearchEngine] = None):
         """
         :param feature_map: { song_id: feature_vector }
+        :param index: optional IVFIndex from build_index(feature_map); songs
+            are then picked from the query's nearest clusters and only those
+            are scored (approximate)
+        :param nprobe: clusters searched per query when an index is given
+        :param cascade: optional coarse-to-fine engine from build_cascade(feature_map),
+            used when there is no index (approximate)
         """
         self.feature_map = feature_map
+        self.index = index
+        self.nprobe = nprobe
+        self.cascade = cascade
+        # Songs the index leaves out, scored on every query
+        self._unindexed: List[int] = []
+        if index is not None:
+            self._unindexed = [sid for sid, vec in feature_map.items() if len(vec) != index.dim]
 
     def recommend(self, song_id: int, top_n: int = 5) -> List[Tuple[int, float]]:
         """
@@ -33,8 +52,21 @@ class RecommenderEngine:
             return []
 
         query_vec = self.feature_map[song_id]
+        if self.index is None and self.cascade is not None:
+            # One extra for the query song itself
+            recs = self.cascade.search(query_vec, k=top_n + 1)
+            return [(sid, sim) for sid, sim in recs if sid != song_id][:top_n]
+
+        candidates = self.feature_map.keys()
+        if self.index is not None and len(query_vec) == self.index.dim:
+            # One extra for the query song itself
+            found, _ = self.index.search(unit_rows(np.asarray(query_vec, dtype=np.float64)[None])[0], top_n + 1,
+                                         self.nprobe)
+            candidates = [int(sid) for sid in found] + self._unindexed
+
         scores: List[Tuple[int, float]] = []
-        for sid, vec in self.feature_map.items():
+        for sid in candidates:
+            vec = self.feature_map[sid]
             if sid == song_id:
                 continue
             sim = cosine_similarity(query_vec, vec)
@@ -43,3 +75,41 @@ class RecommenderEngine:
         # Sort by similarity descending
         scores.sort(key=lambda x: x[1], reverse=True)
         return scores[:top_n]
+
+
+def catalog_digest(feature_map: Dict[int, np.ndarray], dim: int = 55) -> str:
+    """
+    SHA-256 of the song IDs and vectors of length `dim`, in song ID order.
+    build_index() tags its index with it, so a saved index can be checked
+    against the current catalog.
+    """
+    digest = hashlib.sha256()
+    for song_id in sorted(sid for sid, vec in feature_map.items() if len(vec) == dim):
+        digest.update(np.int64(song_id).tobytes())
+        digest.update(np.asarray(feature_map[song_id], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def build_index(feature_map: Dict[int, np.ndarray], dim: int = 55, **kwargs) -> IVFIndex:
+    """
+    IVFIndex over the unit-length feature vectors of length `dim`, for
+    RecommenderEngine, tagged with catalog_digest(feature_map, dim). Other
+    lengths are left out and always scored exactly.
+
+    :param kwargs: passed to IVFIndex.build
+    """
+    ids = [sid for sid, vec in feature_map.items() if len(vec) == dim]
+    vectors = np.array([feature_map[sid] for sid in ids], dtype=np.float64).reshape(len(ids), dim)
+    index = IVFIndex.build(np.array(ids, dtype=np.int64), unit_rows(vectors), **kwargs)
+    index.tag = catalog_digest(feature_map, dim)
+    return index
+
+
+def build_cascade(feature_map: Dict[int, np.ndarray], dim: int = 55, **kwargs) -> CascadeSearchEngine:
+    """
+    CascadeSearchEngine scoring plain (unweighted) cosine similarity, for
+    RecommenderEngine.
+
+    :param kwargs: passed to CascadeSearchEngine
+    """
+    return CascadeSearchEngine(feature_map, profile=np.ones(dim), **kwargs)
@@ -0,0 +1,188 @@
+"""
+Process-wide cache of the catalog's audio feature vectors.
+
+The first use loads every SongFeature once. After that the store re-checks
+MongoDB at most every FEATURE_STORE_REFRESH_SECONDS and pulls only vectors
+whose updated_at is past its watermark. A full reload happens only when the
+document count shows songs were removed. Every change bumps `version`, and
+search engines (FeatureSearchEngine, or CascadeSearchEngine with
+FEATURE_SEARCH_CASCADE) are built once per version and profile. A
+large catalog's IVFIndex is carried over to the next version by re-adding
+only the changed vectors.
+
+Snapshots are replaced, never modified, so a caller can keep using the
+features or engine it got while a refresh happens.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from core.reco.ann import IVFIndex
+from core.reco.cascade import FEATURE_SEARCH_CASCADE, CascadeSearchEngine
+from core.reco.search import FALLBACK_FEATURE_WEIGHTS, FEATURE_DIM, FeatureSearchEngine, weighted_unit_rows
+
+# How often a process looks for new or changed feature vectors, in seconds
+FEATURE_STORE_REFRESH_SECONDS = float(os.getenv("FEATURE_STORE_REFRESH_SECONDS", "30"))
+# Writes are re-read this far behind the watermark, in case writers' clocks disagree
+FEATURE_STORE_CLOCK_SKEW = timedelta(seconds=60)
+
+
+class FeatureStore:
+    """
+    Cached song_id -> feature vector map with incremental refresh.
+
+    :param repository: anything with get_features_since(since) and count();
+        SongFeatureRepository() by default
+    :param refresh_seconds: minimum time between checks for changes
+    """
+
+    def __init__(self, repository=None, refresh_seconds: float = FEATURE_STORE_REFRESH_SECONDS):
+        if repository is None:
+            from core.repository.song_feature_repository import SongFeatureRepository
+            repository = SongFeatureRepository()
+        self.repository = repository
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self.watermark: Optional[datetime] = None
+        self._features: Dict[int, np.ndarray] = {}
+        self._checked_at: Optional[float] = None
+        self._engines: Dict[Tuple[int, bytes, bool], Union[FeatureSearchEngine, CascadeSearchEngine]] = {}
+        # Per profile, the latest engine's index and its version
+        self._indexes: Dict[bytes, Tuple[int, IVFIndex]] = {}
+        # Song IDs changed by each incremental version
+        self._changes: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._full_loads = 0
+        self._incremental_loads = 0
+
+    def features(self) -> Dict[int, np.ndarray]:
+        """The current snapshot; must be treated as read-only."""
+        self._refresh_if_due()
+        return self._features
+
+    def engine(self, profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS,
+               cascade: bool = FEATURE_SEARCH_CASCADE) -> Union[FeatureSearchEngine, CascadeSearchEngine]:
+        """
+        A search engine over the current snapshot, built once per version and profile.
+
+        :param cascade: a coarse-to-fine CascadeSearchEngine instead of a FeatureSearchEngine
+        """
+        self._refresh_if_due()
+        with self._lock:
+            key = (self.version, np.asarray(profile).tobytes(), cascade)
+            engine = self._engines.get(key)
+            if engine is None:
+                if cascade:
+                    engine = CascadeSearchEngine(self._features, profile)
+                else:
+                    engine = FeatureSearchEngine(self._features, profile, index=self._updated_index(key[1], profile))
+                # Engines of older versions are dropped with their snapshots
+                self._engines = {k: v for k, v in self._engines.items() if k[0] == self.version}
+                self._engines[key] = engine
+                if not cascade and engine.index is not None:
+                    self._indexes[key[1]] = (self.version, engine.index)
+                    oldest = min(version for version, _ in self._indexes.values())
+                    self._changes = {v: ids for v, ids in self._changes.items() if v > oldest}
+            return engine
+
+    def _updated_index(self, profile_key: bytes, profile: np.ndarray) -> Optional[IVFIndex]:
+        """
+        The profile's last index brought up to the current version, or None
+        when there is none or a full reload happened since.
+        """
+        if profile_key not in self._indexes:
+            return None
+        version, index = self._indexes[profile_key]
+        versions = range(version + 1, self.version + 1)
+        if any(v not in self._changes for v in versions):
+            return None
+        index = index.copy()
+        if not versions:
+            return index
+        song_ids = np.unique(np.concatenate([self._changes[v] for v in versions]))
+        index.remove(song_ids)
+        current = [int(song_id) for song_id in song_ids if len(self._features.get(int(song_id), ())) == FEATURE_DIM]
+        if current:
+            index.add(current, weighted_unit_rows([self._features[s] for s in current], FEATURE_DIM, profile))
+        return index
+
+    def _refresh_if_due(self) -> None:
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.refresh_seconds:
+            self.refresh()
+
+    def refresh(self, full: bool = False) -> bool:
+        """
+        Pull changes now. Returns True if the snapshot changed.
+
+        :param full: reload every vector instead of only those past the watermark
+        """
+        with self._lock:
+            if full or self._checked_at is None:
+                changed = self._load_all()
+            else:
+                changed = self._load_changes()
+            self._checked_at = time.monotonic()
+            return changed
+
+    def _load_all(self) -> bool:
+        features, latest = self.repository.get_features_since(None)
+        self._features = features
+        self._changes = {}
+        self.watermark = latest
+        self.version += 1
+        self._full_loads += 1
+        return True
+
+    def _load_changes(self) -> bool:
+        since = self.watermark - FEATURE_STORE_CLOCK_SKEW if self.watermark is not None else None
+        changes, latest = self.repository.get_features_since(since)
+        changed = {
+            song_id: vector for song_id, vector in changes.items()
+            if song_id not in self._features or not np.array_equal(self._features[song_id], vector)
+        }
+        features = self._features
+        if changed:
+            features = dict(self._features)
+            features.update(changed)
+        if self.repository.count() != len(features):
+            # Songs were deleted; the watermark cannot tell which
+            return self._load_all()
+        if latest is not None and (self.watermark is None or latest > self.watermark):
+            self.watermark = latest
+        if not changed:
+            return False
+        self._features = features
+        self.version += 1
+        if self._indexes:
+            self._changes[self.version] = np.fromiter(changed.keys(), dtype=np.int64, count=len(changed))
+        self._incremental_loads += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "songs": len(self._features),
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "full_loads": self._full_loads,
+            "incremental_loads": self._incremental_loads,
+        }
+
+
+_store: Optional[FeatureStore] = None
+_store_lock = threading.Lock()
+
+
+def get_feature_store() -> FeatureStore:
+    """
+    Return this process's feature store, created on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeatureStore()
+        return _store
@@ -1,6 +1,9 @@
 ﻿import numpy as np
 import librosa
 
+# Bump whenever extract_features changes the layout or meaning of the vector
+FEATURE_VERSION = 1
+
 
 def extract_features(file_path: str, sr: int = 22050) -> np.ndarray:
     """
@@ -28,83 +31,7 @@ def extract_features(file_path: str, sr: int = 22050) -> np.ndarray:
     try:
         # Load audio as mono
         y, _ = librosa.load(file_path, sr=sr, mono=True)
-        
-        if len(y) == 0:
-            return np.array([])
-        
-        # Initialize feature list
-        features = []
-        
-        # 1. CHROMA FEATURES (12 features) - Excellent for partial song matching
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_chroma=12)
-        chroma_mean = np.mean(chroma, axis=1)
-        features.extend(chroma_mean.tolist())
-        
-        # 2. MFCC STATISTICS (26 features) - Robust timbre representation
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_mean = np.mean(mfcc, axis=1)
-        mfcc_std = np.std(mfcc, axis=1)
-        features.extend(mfcc_mean.tolist())
-        features.extend(mfcc_std.tolist())
-        
-        # 3. SPECTRAL FEATURES (6 features) - Texture and brightness
-        spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
-        
-        features.extend([
-            float(np.mean(spectral_centroids)),
-            float(np.std(spectral_centroids)),
-            float(np.mean(spectral_rolloff)),
-            float(np.std(spectral_rolloff)),
-            float(np.mean(spectral_bandwidth)),
-            float(np.std(spectral_bandwidth))
-        ])
-        
-        # 4. SPECTRAL CONTRAST (7 features) - Captures spectral shape
-        spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr, n_bands=6)
-        contrast_mean = np.mean(spectral_contrast, axis=1)
-        features.extend(contrast_mean.tolist())
-        
-        # 5. RHYTHM FEATURES (2 features)
-        if len(y) > sr * 2:  # At least 2 seconds
-            try:
-                tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-                # Calculate rhythm strength (beat consistency)
-                if len(beats) > 1:
-                    beat_times = librosa.frames_to_time(beats, sr=sr)
-                    beat_intervals = np.diff(beat_times)
-                    rhythm_strength = 1.0 / (np.std(beat_intervals) + 1e-8)  # Lower std = more consistent rhythm
-                else:
-                    rhythm_strength = 0.0
-            except:
-                tempo = 0.0
-                rhythm_strength = 0.0
-        else:
-            tempo = 0.0
-            rhythm_strength = 0.0
-            
-        features.extend([float(tempo), float(rhythm_strength)])
-        
-        # 6. ZERO CROSSING RATE (2 features) - Texture analysis
-        zcr = librosa.feature.zero_crossing_rate(y)
-        features.extend([
-            float(np.mean(zcr)),
-            float(np.std(zcr))
-        ])
-        
-        # Convert to numpy array and ensure consistent length
-        feature_vector = np.array(features, dtype=np.float32)
-        
-        # Verify expected length (should be 55)
-        expected_length = 12 + 26 + 6 + 7 + 2 + 2  # 55 total
-        if len(feature_vector) != expected_length:
-            print(f"Warning: Expected {expected_length} features, got {len(feature_vector)}")
-        
-        # Handle any NaN or infinite values
-        feature_vector = np.nan_to_num(feature_vector, nan=0.0, posinf=1e6, neginf=-1e6)
-        
-        return feature_vector
+        return extract_features_from_signal(y, sr)
 
     except Exception as e:
         print(f"ERROR during feature extraction for {file_path}: {e}")
@@ -112,10 +39,101 @@ def extract_features(file_path: str, sr: int = 22050) -> np.ndarray:
         return np.zeros(55, dtype=np.float32)
 
 
+def extract_features_from_signal(y: np.ndarray, sr: int = 22050) -> np.ndarray:
+    """
+    Compute the 55-feature vector of extract_features from an already loaded
+    mono signal, so callers that also fingerprint the audio decode it once.
+
+    :param y: mono signal
+    :param sr: sampling rate of y
+    :return: 1D numpy array of 55 features (empty for an empty signal)
+    """
+    if len(y) == 0:
+        return np.array([])
+
+    # Initialize feature list
+    features = []
+    
+    # 1. CHROMA FEATURES (12 features) - Excellent for partial song matching
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_chroma=12)
+    chroma_mean = np.mean(chroma, axis=1)
+    features.extend(chroma_mean.tolist())
+    
+    # 2. MFCC STATISTICS (26 features) - Robust timbre representation
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    mfcc_mean = np.mean(mfcc, axis=1)
+    mfcc_std = np.std(mfcc, axis=1)
+    features.extend(mfcc_mean.tolist())
+    features.extend(mfcc_std.tolist())
+    
+    # 3. SPECTRAL FEATURES (6 features) - Texture and brightness
+    spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)
+    spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
+    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
+    
+    features.extend([
+        float(np.mean(spectral_centroids)),
+        float(np.std(spectral_centroids)),
+        float(np.mean(spectral_rolloff)),
+        float(np.std(spectral_rolloff)),
+        float(np.mean(spectral_bandwidth)),
+        float(np.std(spectral_bandwidth))
+    ])
+    
+    # 4. SPECTRAL CONTRAST (7 features) - Captures spectral shape
+    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr, n_bands=6)
+    contrast_mean = np.mean(spectral_contrast, axis=1)
+    features.extend(contrast_mean.tolist())
+    
+    # 5. RHYTHM FEATURES (2 features)
+    if len(y) > sr * 2:  # At least 2 seconds
+        try:
+            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
+            # librosa >= 0.10 returns tempo as a one-element array
+            tempo = float(np.atleast_1d(tempo)[0])
+            # Calculate rhythm strength (beat consistency)
+            if len(beats) > 1:
+                beat_times = librosa.frames_to_time(beats, sr=sr)
+                beat_intervals = np.diff(beat_times)
+                rhythm_strength = 1.0 / (np.std(beat_intervals) + 1e-8)  # Lower std = more consistent rhythm
+            else:
+                rhythm_strength = 0.0
+        except:
+            tempo = 0.0
+            rhythm_strength = 0.0
+    else:
+        tempo = 0.0
+        rhythm_strength = 0.0
+        
+    features.extend([float(tempo), float(rhythm_strength)])
+    
+    # 6. ZERO CROSSING RATE (2 features) - Texture analysis
+    zcr = librosa.feature.zero_crossing_rate(y)
+    features.extend([
+        float(np.mean(zcr)),
+        float(np.std(zcr))
+    ])
+    
+    # Convert to numpy array and ensure consistent length
+    feature_vector = np.array(features, dtype=np.float32)
+    
+    # Verify expected length (should be 55)
+    expected_length = 12 + 26 + 6 + 7 + 2 + 2  # 55 total
+    if len(feature_vector) != expected_length:
+        print(f"Warning: Expected {expected_length} features, got {len(feature_vector)}")
+    
+    # Handle any NaN or infinite values
+    feature_vector = np.nan_to_num(feature_vector, nan=0.0, posinf=1e6, neginf=-1e6)
+    
+    return feature_vector
+
+
 def extract_lightweight_features(file_path: str, sr: int = 22050) -> np.ndarray:
     """
     Extract a lightweight feature set for very fast matching (25 features).
-    Use this when you need maximum speed over accuracy.
+    Use this when you need maximum speed over accuracy. These are the first
+    25 elements of extract_features, which CascadeSearchEngine's coarse
+    stage uses (core.reco.cascade).
     
     Features:
     - Chroma mean (12): Core harmonic content
@@ -0,0 +1,217 @@
+"""
+Weighted cosine search over the catalog's audio feature vectors.
+
+The feature fallback scores a query against every song with a weighted
+cosine similarity. FeatureSearchEngine keeps the catalog as a matrix of
+pre-weighted, unit-length float32 rows, so scoring the whole catalog is one
+matrix-vector product and the top k come from argpartition. The few
+candidates near the cut-off are rescored in float64 with
+weighted_cosine_similarity, so results are exactly those of scoring every
+song one by one.
+
+With FEATURE_SEARCH_ANN set, from FEATURE_ANN_MIN_SONGS songs on, the
+FEATURE_DIM rows are also put in an IVFIndex (core.reco.ann) and search()
+only scores the clusters nearest the query. Those results are approximate;
+FEATURE_ANN_NPROBE sets the recall. It is off by default, so the
+recognition fallback stays exact at any catalog size.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.reco.ann import FEATURE_ANN_MIN_SONGS, FEATURE_ANN_NPROBE, IVFIndex, unit_rows
+
+# Let large catalogs' feature search use an IVFIndex (approximate results)
+FEATURE_SEARCH_ANN = os.getenv("FEATURE_SEARCH_ANN", "false").lower() in ("1", "true", "yes")
+
+# Length of a feature vector from core.reco.features.extract_features
+FEATURE_DIM = 55
+
+# Sizes of the feature blocks, in extract_features order:
+# chroma, MFCC mean, MFCC std, spectral, spectral contrast, rhythm, ZCR
+_BLOCK_SIZES = (12, 13, 13, 6, 7, 2, 2)
+
+
+def _profile(*weights: float) -> np.ndarray:
+    return np.concatenate([np.full(size, weight) for size, weight in zip(_BLOCK_SIZES, weights)])
+
+
+# Recognition fallback on phone recordings: noise-robust chroma and contrast count most
+FALLBACK_FEATURE_WEIGHTS = _profile(3.0, 1.5, 0.8, 1.0, 2.0, 0.3, 0.2)
+# Threshold strategies on short clips
+STRATEGY_FEATURE_WEIGHTS = _profile(2.0, 1.5, 1.0, 1.2, 1.3, 0.8, 0.7)
+
+# Rescore margin on float32 scores; their error is orders of magnitude smaller
+_RESCORE_MARGIN = 1e-4
+
+
+def feature_weights(length: int, profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS) -> np.ndarray:
+    """Weights for vectors compared over their first `length` elements; uniform below FEATURE_DIM."""
+    if length >= FEATURE_DIM:
+        return profile[:length]
+    return np.ones(length)
+
+
+def weighted_cosine_similarity(features1: np.ndarray, features2: np.ndarray,
+                               profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS) -> float:
+    """
+    Weighted cosine similarity of two feature vectors, over the length of the
+    shorter one. 0.0 if either is empty or weighs nothing.
+    """
+    if len(features1) == 0 or len(features2) == 0:
+        return 0.0
+
+    min_len = min(len(features1), len(features2))
+    weights = feature_weights(min_len, profile)
+    f1_weighted = features1[:min_len] * weights
+    f2_weighted = features2[:min_len] * weights
+
+    norm1 = np.linalg.norm(f1_weighted)
+    norm2 = np.linalg.norm(f2_weighted)
+    if norm1 == 0 or norm2 == 0:
+        return 0.0
+    return float(np.dot(f1_weighted, f2_weighted) / (norm1 * norm2))
+
+
+def weighted_unit_rows(vectors: List[np.ndarray], length: int,
+                       profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS) -> np.ndarray:
+    """Vectors of one length as pre-weighted, unit-length float32 rows."""
+    matrix = np.array(vectors, dtype=np.float64).reshape(len(vectors), length)
+    return unit_rows(matrix * feature_weights(length, profile)).astype(np.float32)
+
+
+class FeatureSearchEngine:
+    """
+    Top-k weighted cosine search over a fixed set of feature vectors.
+
+    Rows are grouped by vector length (normally all FEATURE_DIM). The input
+    mapping is kept by reference for exact rescoring, so it must not be
+    modified while the engine is in use.
+
+    :param features: song_id -> feature vector
+    :param profile: per-feature weights, e.g. FALLBACK_FEATURE_WEIGHTS
+    :param index: an IVFIndex over exactly the FEATURE_DIM vectors of
+        `features` (see FeatureStore); built here when None and the catalog
+        is large enough
+    :param ann_min_songs: FEATURE_DIM rows needed before an index is built;
+        by default FEATURE_ANN_MIN_SONGS with FEATURE_SEARCH_ANN, else never
+    :param nprobe: clusters searched per query when an index is used
+    """
+
+    def __init__(self, features: Dict[int, np.ndarray], profile: np.ndarray = FALLBACK_FEATURE_WEIGHTS,
+                 index: Optional[IVFIndex] = None, ann_min_songs: Optional[int] = None,
+                 nprobe: int = FEATURE_ANN_NPROBE):
+        self.features = features
+        self.profile = profile
+        self.nprobe = nprobe
+        self.song_ids = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        if ann_min_songs is None and FEATURE_SEARCH_ANN:
+            ann_min_songs = FEATURE_ANN_MIN_SONGS
+        self._groups: List[Tuple[int, np.ndarray, np.ndarray]] = []
+
+        lengths = np.fromiter((len(v) for v in features.values()), dtype=np.int64, count=len(features))
+        vectors = list(features.values())
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            length = int(length)
+            if length == 0:
+                continue
+            matrix = weighted_unit_rows([vectors[i] for i in rows], length, profile)
+            self._groups.append((length, rows, matrix))
+            if (length == FEATURE_DIM and index is None and ann_min_songs is not None
+                    and len(rows) >= ann_min_songs):
+                index = IVFIndex.build(self.song_ids[rows], matrix, nprobe=nprobe)
+
+        self.index = index
+        self._rows: Dict[int, int] = {}
+        if index is not None:
+            self._rows = {int(song_id): row for row, song_id in enumerate(self.song_ids)}
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the search matrices and index, not counting `features`."""
+        return sum(matrix.nbytes for _, _, matrix in self._groups) + (self.index.nbytes if self.index else 0)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate (float32) similarity of the query to every song, in song_ids order."""
+        query = np.asarray(query, dtype=np.float64)
+        scores = np.zeros(len(self.song_ids), dtype=np.float32)
+        if len(query) == 0:
+            return scores
+        for group in self._groups:
+            self._score_group(query, group, scores)
+        return scores
+
+    def _score_group(self, query: np.ndarray, group: Tuple[int, np.ndarray, np.ndarray],
+                     scores: np.ndarray) -> None:
+        length, rows, matrix = group
+        if len(query) >= length:
+            q = query[:length] * feature_weights(length, self.profile)
+            norm = np.linalg.norm(q)
+            scores[rows] = matrix @ (q / norm).astype(np.float32) if norm > 0 else 0.0
+        else:
+            # Compared over the query's length: these rows need renormalizing
+            for row in rows:
+                scores[row] = weighted_cosine_similarity(query, self.features[int(self.song_ids[row])],
+                                                         self.profile)
+
+    def _candidate_scores(self, query: np.ndarray, k: int) -> np.ndarray:
+        """
+        Like scores(), but FEATURE_DIM rows outside the index's k best for
+        the query score -inf.
+        """
+        if self.index is None or len(query) < FEATURE_DIM:
+            return self.scores(query)
+        q = query[:FEATURE_DIM] * feature_weights(FEATURE_DIM, self.profile)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return self.scores(query)
+        scores = np.full(len(self.song_ids), -np.inf, dtype=np.float32)
+        for group in self._groups:
+            if group[0] != FEATURE_DIM:
+                self._score_group(query, group, scores)
+        song_ids, found = self.index.search((q / norm).astype(np.float32), k, self.nprobe)
+        scores[[self._rows[int(song_id)] for song_id in song_ids]] = found
+        return scores
+
+    def search(self, query: np.ndarray, k: int = 10,
+               threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        The k most similar songs as (song_id, similarity), best first; songs
+        below `threshold` are left out. Equal similarities keep catalog order.
+        With an index, FEATURE_DIM songs outside the probed clusters are missed.
+        """
+        if k <= 0 or len(self.song_ids) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float64)
+        return rescored_top_k(query, self._candidate_scores(query, k), self.song_ids, self.features,
+                              self.profile, k, threshold)
+
+
+def rescored_top_k(query: np.ndarray, approx: np.ndarray, song_ids: np.ndarray, features: Dict[int, np.ndarray],
+                   profile: np.ndarray, k: int, threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+    """
+    The k best songs by weighted_cosine_similarity, given approximate scores
+    (within _RESCORE_MARGIN) for every row of song_ids; -inf rows are skipped.
+    Only the candidates that can still make the top k are rescored exactly.
+    """
+    candidates = np.flatnonzero(approx > -np.inf)
+    if threshold is not None:
+        candidates = np.flatnonzero(approx >= threshold - _RESCORE_MARGIN)
+    if len(candidates) > k:
+        top = np.argpartition(-approx[candidates], k - 1)[:k]
+        kth = approx[candidates[top]].min()
+        candidates = candidates[approx[candidates] >= kth - _RESCORE_MARGIN]
+
+    rescored = []
+    for row in candidates:
+        song_id = int(song_ids[row])
+        similarity = weighted_cosine_similarity(query, features[song_id], profile)
+        if threshold is None or similarity >= threshold:
+            rescored.append((-similarity, int(row), song_id))
+    rescored.sort()
+    return [(song_id, -negative) for negative, _, song_id in rescored[:k]]
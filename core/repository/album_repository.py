@@ -2,6 +2,8 @@ from typing import List, Optional, Dict, Any, Type
 from sqlalchemy.orm import Session
 
 from db.sql.models import Album
+from core.repository import metadata_cache
+from core.repository.metadata_cache import album_snapshot
 
 
 class AlbumRepository:
@@ -42,6 +44,20 @@ class AlbumRepository:
         """
         return self.session.query(Album).filter(Album.id == album_id).one_or_none()
 
+    def get_cached(self, album_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Return a read-only snapshot of an Album, served from the process-wide
+        metadata cache when possible.
+        """
+        snapshot = metadata_cache.album_cache.get(album_id)
+        if snapshot is None:
+            album = self.get_by_id(album_id)
+            if album is None:
+                return None
+            snapshot = album_snapshot(album)
+            metadata_cache.album_cache.set(album_id, snapshot)
+        return snapshot
+
     def list(
         self, skip: int = 0, limit: int = 100
     ) -> list[Type[Album]]:
@@ -63,14 +79,17 @@ class AlbumRepository:
             setattr(album, attr, value)
         self.session.commit()
         self.session.refresh(album)
+        metadata_cache.album_cache.invalidate(album.id)
         return album
 
     def delete(self, album: Album) -> None:
         """
         Delete an Album record.
         """
+        album_id = album.id
         self.session.delete(album)
         self.session.commit()
+        metadata_cache.album_cache.invalidate(album_id)
 
     def bulk_insert(
         self, albums_data: List[Dict[str, Any]]
@@ -2,6 +2,8 @@ from typing import List, Optional, Dict, Any, Type
 from sqlalchemy.orm import Session
 
 from db.sql.models import Artist
+from core.repository import metadata_cache
+from core.repository.metadata_cache import artist_snapshot
 
 
 class ArtistRepository:
@@ -34,6 +36,20 @@ class ArtistRepository:
         """
         return self.session.query(Artist).filter(Artist.id == artist_id).one_or_none()
 
+    def get_cached(self, artist_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Return a read-only snapshot of an Artist, served from the process-wide
+        metadata cache when possible.
+        """
+        snapshot = metadata_cache.artist_cache.get(artist_id)
+        if snapshot is None:
+            artist = self.get_by_id(artist_id)
+            if artist is None:
+                return None
+            snapshot = artist_snapshot(artist)
+            metadata_cache.artist_cache.set(artist_id, snapshot)
+        return snapshot
+
     def list(
         self, skip: int = 0, limit: int = 100
     ) -> list[Type[Artist]]:
@@ -55,14 +71,17 @@ class ArtistRepository:
             setattr(artist, attr, value)
         self.session.commit()
         self.session.refresh(artist)
+        metadata_cache.artist_cache.invalidate(artist.id)
         return artist
 
     def delete(self, artist: Artist) -> None:
         """
         Delete an Artist record.
         """
+        artist_id = artist.id
         self.session.delete(artist)
         self.session.commit()
+        metadata_cache.artist_cache.invalidate(artist_id)
 
     def bulk_insert(
         self, artists_data: List[Dict[str, Any]]
@@ -1,6 +1,14 @@
-﻿from typing import List, Dict, Any, Optional, Tuple
+﻿import os
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
 
-from db.nosql.collections import Fingerprint
+from db.nosql.collections import Fingerprint, LEGACY_FINGERPRINT_VERSION, fingerprint_document
+
+# Fingerprint index backend: "mongo" (default) or "sqlite" for single-node deployments
+FINGERPRINT_BACKEND = os.getenv("FINGERPRINT_BACKEND", "mongo")
+FINGERPRINT_SQLITE_PATH = os.getenv("FINGERPRINT_SQLITE_PATH", "data/fingerprints.sqlite3")
+
+_sqlite_repositories: Dict[int, Any] = {}
 
 
 class FingerprintRepository:
@@ -8,11 +16,19 @@ class FingerprintRepository:
     Repository for Fingerprint document: provides CRUD and bulk-insert operations.
     """
 
+    def __init__(self, version: Optional[int] = None):
+        """
+        :param version: fingerprint algorithm version whose index to use;
+            the legacy `fingerprints` collection by default
+        """
+        self.version = version or LEGACY_FINGERPRINT_VERSION
+        self.documents = fingerprint_document(self.version)
+
     def create(self, song_id: int, hash: str, time_offset: int = 0) -> Fingerprint:
         """
         Create and save a new Fingerprint document.
         """
-        fp = Fingerprint(song_id=song_id, hash=hash, time_offset=time_offset)
+        fp = self.documents(song_id=song_id, hash=hash, time_offset=time_offset)
         fp.save()
         return fp
 
@@ -20,14 +36,14 @@ class FingerprintRepository:
         """
         Retrieve a Fingerprint by its MongoDB ObjectId.
         """
-        return Fingerprint.objects(id=fp_id).first()
+        return self.documents.objects(id=fp_id).first()
 
     def list(self, skip: int = 0, limit: int = 100) -> List[Fingerprint]:
         """
         List fingerprints with pagination.
         """
         return list(
-            Fingerprint.objects.skip(skip).limit(limit)
+            self.documents.objects.skip(skip).limit(limit)
         )
 
     def delete(self, fp_id: str) -> bool:
@@ -35,7 +51,7 @@ class FingerprintRepository:
         Delete a Fingerprint document by its ObjectId.
         Returns True if deletion was acknowledged.
         """
-        result = Fingerprint.objects(id=fp_id).delete()
+        result = self.documents.objects(id=fp_id).delete()
         return result > 0
 
     def bulk_insert(
@@ -45,9 +61,9 @@ class FingerprintRepository:
         Bulk-insert multiple Fingerprint documents.
         Each dict should have keys 'song_id' and 'hash'.
         """
-        fps = [Fingerprint(**data) for data in fps_data]
+        fps = [self.documents(**data) for data in fps_data]
         # .insert is faster than saving one by one
-        Fingerprint.objects.insert(fps)
+        self.documents.objects.insert(fps)
         return fps
 
     def store_spectral_fingerprints(self, song_id: int, fingerprints: List[Tuple[str, int]]) -> int:
@@ -57,12 +73,12 @@ class FingerprintRepository:
         Returns the number of fingerprints stored.
         """
         # Delete existing fingerprints for this song
-        Fingerprint.objects(song_id=song_id).delete()
+        self.documents.objects(song_id=song_id).delete()
         
         # Prepare documents for bulk insert
         documents = []
         for hash_value, time_offset in fingerprints:
-            doc = Fingerprint(
+            doc = self.documents(
                 song_id=song_id,
                 hash=hash_value,
                 time_offset=time_offset
@@ -70,10 +86,39 @@ class FingerprintRepository:
             documents.append(doc)
         
         if documents:
-            Fingerprint.objects.insert(documents)
+            self.documents.objects.insert(documents)
         
         return len(documents)
 
+    def store_many(self, fingerprints_by_song: Dict[int, List[Tuple[str, int]]],
+                   batch_size: int = 50000) -> int:
+        """
+        Replace the fingerprints of several songs with one delete and batched inserts.
+        fingerprints_by_song maps song_id -> [(hash, time_offset), ...].
+        Returns the number of fingerprints stored.
+        """
+        if not fingerprints_by_song:
+            return 0
+        self.documents.objects(song_id__in=list(fingerprints_by_song)).delete()
+
+        # Raw documents skip per-document validation, which dominates for large batches
+        collection = self.documents._get_collection()
+        created_at = datetime.utcnow()
+        total = 0
+        batch = []
+        for song_id, fingerprints in fingerprints_by_song.items():
+            for hash_value, time_offset in fingerprints:
+                batch.append({"song_id": int(song_id), "hash": str(hash_value),
+                              "time_offset": int(time_offset), "created_at": created_at})
+                if len(batch) >= batch_size:
+                    collection.insert_many(batch, ordered=False)
+                    total += len(batch)
+                    batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+            total += len(batch)
+        return total
+
     def get_all_fingerprints_by_hash(self) -> Dict[str, List[Tuple[int, int]]]:
         """
         Get all fingerprints grouped by hash.
@@ -82,7 +127,7 @@ class FingerprintRepository:
         result = {}
 
         # Query all fingerprints
-        for fp in Fingerprint.objects():
+        for fp in self.documents.objects():
             if fp.hash not in result:
                 result[fp.hash] = []
             result[fp.hash].append((fp.song_id, fp.time_offset))
@@ -96,21 +141,58 @@ class FingerprintRepository:
         """
         result = {}
         
-        # Query fingerprints matching the given hashes
-        fingerprints = Fingerprint.objects(hash__in=hashes)
+        # Query fingerprints matching the given hashes, without building documents
+        fingerprints = self.documents.objects(hash__in=hashes).scalar("hash", "song_id", "time_offset")
         
-        for fp in fingerprints:
-            if fp.hash not in result:
-                result[fp.hash] = []
-            result[fp.hash].append((fp.song_id, fp.time_offset))
+        for fp_hash, song_id, time_offset in fingerprints:
+            if fp_hash not in result:
+                result[fp_hash] = []
+            result[fp_hash].append((song_id, time_offset))
         
         return result
     
     def delete_by_song_id(self, song_id: int) -> int:
         """Delete all fingerprints for a song. Returns number deleted."""
-        result = Fingerprint.objects(song_id=song_id).delete()
+        result = self.documents.objects(song_id=song_id).delete()
         return result
 
     def count_by_song_id(self, song_id: int) -> int:
         """Count fingerprints for a song."""
-        return Fingerprint.objects(song_id=song_id).count()
\ No newline at end of file
+        return self.documents.objects(song_id=song_id).count()
+
+    def count(self) -> int:
+        """Total number of fingerprints in the index."""
+        return self.documents.objects.count()
+
+    def song_count(self) -> int:
+        """Number of songs with fingerprints in the index."""
+        return len(self.documents._get_collection().distinct("song_id"))
+
+
+def sqlite_index_path(version: int) -> str:
+    """SQLite file of an algorithm version's index; the legacy version uses FINGERPRINT_SQLITE_PATH."""
+    if version == LEGACY_FINGERPRINT_VERSION:
+        return FINGERPRINT_SQLITE_PATH
+    root, ext = os.path.splitext(FINGERPRINT_SQLITE_PATH)
+    return f"{root}.v{version}{ext}"
+
+
+def get_fingerprint_repository(version: Optional[int] = None):
+    """
+    Return the fingerprint index selected by FINGERPRINT_BACKEND.
+    The SQLite repository is created once per process and reused.
+
+    :param version: algorithm version whose index to return; the active
+        version (see core.fingerprint.versions) by default
+    """
+    if version is None:
+        from core.fingerprint.versions import get_active_version
+        version = get_active_version()
+    if FINGERPRINT_BACKEND == "sqlite":
+        path = sqlite_index_path(version)
+        repository = _sqlite_repositories.get(version)
+        if repository is None or repository.path != path:
+            from core.repository.sqlite_fingerprint_repository import SQLiteFingerprintRepository
+            repository = _sqlite_repositories[version] = SQLiteFingerprintRepository(path)
+        return repository
+    return FingerprintRepository(version)
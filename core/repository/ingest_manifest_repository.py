@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from db.nosql.collections import IngestManifest
+
+# Paths per $in query when looking records up for a library walk
+_LOOKUP_CHUNK = 1000
+
+
+class IngestManifestRepository:
+    """
+    Repository for IngestManifest documents: what source file each song was
+    ingested from, and with which extractor.
+    """
+
+    def get_by_song_id(self, song_id: int) -> Optional[IngestManifest]:
+        return IngestManifest.objects(song_id=song_id).first()
+
+    def get_by_paths(self, paths: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the manifest records of the given source paths, keyed by path.
+        Records are raw documents, which is much faster than building Documents
+        for a whole library.
+        """
+        collection = IngestManifest._get_collection()
+        paths = list(paths)
+        records = {}
+        for i in range(0, len(paths), _LOOKUP_CHUNK):
+            for doc in collection.find({"source_path": {"$in": paths[i:i + _LOOKUP_CHUNK]}}):
+                records[doc["source_path"]] = doc
+        return records
+
+    def get_sources(self, song_ids: Iterable[int]) -> Dict[int, str]:
+        """Return the source path of each given song that has a manifest record."""
+        collection = IngestManifest._get_collection()
+        song_ids = list(song_ids)
+        sources = {}
+        for i in range(0, len(song_ids), _LOOKUP_CHUNK):
+            query = {"song_id": {"$in": song_ids[i:i + _LOOKUP_CHUNK]}}
+            for doc in collection.find(query, {"_id": 0, "song_id": 1, "source_path": 1}):
+                sources[doc["song_id"]] = doc["source_path"]
+        return sources
+
+    def record_many(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Create or replace the manifest records of several songs at once.
+        Each dict needs 'song_id', 'source_path' and 'content_hash'; the other
+        IngestManifest fields are optional.
+        """
+        if not records:
+            return 0
+        now = datetime.utcnow()
+        documents = [dict(record, updated_at=now) for record in records]
+        collection = IngestManifest._get_collection()
+        collection.delete_many({"song_id": {"$in": [doc["song_id"] for doc in documents]}})
+        collection.insert_many(documents, ordered=False)
+        return len(documents)
+
+    def delete_by_song_id(self, song_id: int) -> int:
+        return IngestManifest.objects(song_id=song_id).delete()
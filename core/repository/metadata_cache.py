@@ -0,0 +1,54 @@
+import os
+from typing import Any, Dict
+
+from core.cache.lru import LRUTTLCache
+from db.sql.models import Song, Artist, Album
+
+# Catalog metadata changes rarely; entries are also invalidated by the repositories' update/delete
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "10000"))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", "300"))
+
+# Process-wide caches of plain snapshots (never ORM instances, which are bound to a session)
+song_cache = LRUTTLCache(maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL)
+artist_cache = LRUTTLCache(maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL)
+album_cache = LRUTTLCache(maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL)
+
+
+def song_snapshot(song: Song) -> Dict[str, Any]:
+    return {
+        "id": song.id,
+        "title": song.title,
+        "artist_id": song.artist_id,
+        "album_id": song.album_id,
+        "duration": song.duration,
+    }
+
+
+def artist_snapshot(artist: Artist) -> Dict[str, Any]:
+    return {"id": artist.id, "name": artist.name}
+
+
+def album_snapshot(album: Album) -> Dict[str, Any]:
+    return {
+        "id": album.id,
+        "title": album.title,
+        "artist_id": album.artist_id,
+        "album_image": album.album_image,
+        "release_date": album.release_date,
+    }
+
+
+def metadata_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Return hit/miss statistics for the song, artist and album caches."""
+    return {
+        "songs": song_cache.stats(),
+        "artists": artist_cache.stats(),
+        "albums": album_cache.stats(),
+    }
+
+
+def clear_metadata_caches() -> None:
+    """Drop every cached snapshot (e.g. after a bulk catalog change)."""
+    song_cache.clear()
+    artist_cache.clear()
+    album_cache.clear()
@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Set
+
+from db.nosql.collections import RebuildProgress
+
+
+class RebuildProgressRepository:
+    """
+    Repository for RebuildProgress documents: which songs a rebuild of one
+    algorithm version's index has finished or failed.
+
+    :param version: algorithm version being rebuilt
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+
+    def done(self, song_ids: Iterable[int]) -> Set[int]:
+        """The given songs that were already rebuilt."""
+        query = {"version": self.version, "status": "done", "song_id": {"$in": list(song_ids)}}
+        return {doc["song_id"] for doc in RebuildProgress._get_collection().find(query, {"_id": 0, "song_id": 1})}
+
+    def record_many(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Create or replace the progress of several songs at once. Each dict needs
+        'song_id' and 'status'; 'fingerprints' and 'error' are optional.
+        """
+        if not records:
+            return 0
+        now = datetime.utcnow()
+        documents = [dict(record, version=self.version, updated_at=now) for record in records]
+        collection = RebuildProgress._get_collection()
+        collection.delete_many({"version": self.version, "song_id": {"$in": [doc["song_id"] for doc in documents]}})
+        collection.insert_many(documents, ordered=False)
+        return len(documents)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of songs per status."""
+        counts = {"done": 0, "failed": 0}
+        for status in counts:
+            counts[status] = RebuildProgress.objects(version=self.version, status=status).count()
+        return counts
+
+    def failed(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Songs that failed, with their errors."""
+        cursor = RebuildProgress._get_collection().find(
+            {"version": self.version, "status": "failed"}, {"_id": 0, "song_id": 1, "error": 1}
+        ).sort("song_id", 1).limit(limit)
+        return list(cursor)
+
+    def reset(self) -> int:
+        """Forget all progress, so the next run rebuilds every song."""
+        return RebuildProgress.objects(version=self.version).delete()
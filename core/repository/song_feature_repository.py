@@ -1,30 +1,124 @@
-﻿from typing import List, Dict, Optional
+﻿from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Dict, Optional, Tuple
 import numpy as np
-from db.nosql.collections import SongFeature
+from pymongo import UpdateOne
+from db.nosql.collections import FEATURE_VECTOR_DTYPE, SongFeature, encode_feature_vector
+
+# Fields read when loading feature vectors; feature_vector is the pre-binary list format
+_VECTOR_FIELDS = {"_id": 0, "song_id": 1, "vector": 1, "vector_dtype": 1, "vector_dim": 1, "feature_vector": 1}
+
+
+def _decode_vectors(docs: Iterable[dict]) -> Dict[int, np.ndarray]:
+    """
+    song_id -> vector for raw SongFeature documents. Vectors of one dtype and
+    length are rows of a single matrix built from the joined raw bytes.
+    """
+    groups = defaultdict(lambda: ([], []))
+    for doc in docs:
+        if doc.get("vector") is not None:
+            raw, dtype = bytes(doc["vector"]), doc.get("vector_dtype") or FEATURE_VECTOR_DTYPE
+        else:
+            # Not migrated yet
+            raw, dtype, _ = encode_feature_vector(doc.get("feature_vector") or [])
+        dim = len(raw) // np.dtype(dtype).itemsize
+        song_ids, blobs = groups[(dtype, dim)]
+        song_ids.append(doc["song_id"])
+        blobs.append(raw)
+
+    feature_map = {}
+    for (dtype, dim), (song_ids, blobs) in groups.items():
+        matrix = np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(song_ids), dim)
+        feature_map.update(zip(song_ids, matrix))
+    return feature_map
+
 
 class SongFeatureRepository:
     def create_or_update(self, song_id: int, feature_vector: np.ndarray) -> SongFeature:
-        feature_list = feature_vector.tolist()
+        raw, dtype, dim = encode_feature_vector(feature_vector)
         song_feature = SongFeature.objects(song_id=song_id).modify(
             upsert=True, # Create if not exists, update if it does
             new=True,    # Return the new/modified document
             set__song_id=song_id,
-            set__feature_vector=feature_list
+            set__vector=raw,
+            set__vector_dtype=dtype,
+            set__vector_dim=dim,
+            unset__legacy_vector=True
         )
         # modify might not automatically call save's updated_at logic, so handle manually if needed
         # or use `update_one` with `SongFeature.objects(song_id=song_id).update_one(...)`
         if not song_feature: # If upsert created a new one but modify didn't return it as expected
-             song_feature = SongFeature(song_id=song_id, feature_vector=feature_list)
+             song_feature = SongFeature(song_id=song_id, vector=raw, vector_dtype=dtype, vector_dim=dim)
              song_feature.save()
         elif hasattr(song_feature, 'save'): # If it's a full document instance
             song_feature.save() # To trigger updated_at
         return song_feature
 
+    def bulk_upsert(self, features_by_song: Dict[int, np.ndarray]) -> int:
+        """
+        Create or replace the feature vectors of several songs in one bulk
+        write of per-song upserts, keeping the created_at of songs that already
+        had features. A failed write leaves each song with its old or its new
+        vector, never without one. Returns the number of songs written.
+        """
+        if not features_by_song:
+            return 0
+        now = datetime.utcnow()
+        updates = []
+        for song_id, vector in features_by_song.items():
+            raw, dtype, dim = encode_feature_vector(vector)
+            updates.append(UpdateOne(
+                {"song_id": int(song_id)},
+                {"$set": {"vector": raw, "vector_dtype": dtype, "vector_dim": dim, "updated_at": now},
+                 "$setOnInsert": {"created_at": now},
+                 "$unset": {"feature_vector": ""}},
+                upsert=True,
+            ))
+        SongFeature._get_collection().bulk_write(updates, ordered=False)
+        return len(updates)
+
     def get_by_song_id(self, song_id: int) -> Optional[SongFeature]:
         return SongFeature.objects(song_id=song_id).first()
 
     def get_all_features(self) -> Dict[int, np.ndarray]:
-        feature_map = {}
-        for sf_doc in SongFeature.objects.all():
-            feature_map[sf_doc.song_id] = np.array(sf_doc.feature_vector)
-        return feature_map
\ No newline at end of file
+        """song_id -> float32 feature vector (read-only rows of one matrix) for every song."""
+        return self.get_features_since(None)[0]
+
+    def get_features_since(self, since: Optional[datetime] = None) -> Tuple[Dict[int, np.ndarray], Optional[datetime]]:
+        """
+        Feature vectors written at or after `since` (all of them if None), and
+        the latest updated_at among them (None if there are none).
+        """
+        query = {} if since is None else {"updated_at": {"$gte": since}}
+        docs = list(SongFeature._get_collection().find(query, {**_VECTOR_FIELDS, "updated_at": 1}))
+        latest = max((doc["updated_at"] for doc in docs if doc.get("updated_at") is not None), default=None)
+        return _decode_vectors(docs), latest
+
+    def migrate_to_binary(self, batch_size: int = 1000) -> int:
+        """
+        Convert documents still holding a feature_vector list to the packed
+        vector field, batch by batch, with one bulk write per batch. updated_at
+        is left alone, since the values only lose float64 precision. Safe to
+        re-run; returns the number of documents converted.
+        """
+        collection = SongFeature._get_collection()
+        converted = 0
+        while True:
+            docs = list(collection.find({"vector": {"$exists": False}}, {"_id": 1, "feature_vector": 1})
+                        .limit(batch_size))
+            if not docs:
+                return converted
+            updates = []
+            for doc in docs:
+                raw, dtype, dim = encode_feature_vector(doc.get("feature_vector") or [])
+                updates.append(UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"vector": raw, "vector_dtype": dtype, "vector_dim": dim},
+                     "$unset": {"feature_vector": ""}},
+                ))
+            collection.bulk_write(updates, ordered=False)
+            converted += len(docs)
+            print(f"Migrated {converted} song feature documents")
+
+    def count(self) -> int:
+        return SongFeature.objects.count()
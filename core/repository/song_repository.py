@@ -1,7 +1,22 @@
 ﻿from typing import List, Optional, Dict, Any, Type
 from sqlalchemy.orm import Session
 
-from db.sql.models import Song
+from db.sql.models import Song, Artist, Album
+from core.repository import metadata_cache
+from core.repository.metadata_cache import song_snapshot, artist_snapshot, album_snapshot
+
+
+def _song_details(song: Dict[str, Any], artist: Optional[Dict[str, Any]],
+                  album: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "song_id": song["id"],
+        "title": song["title"],
+        "artist_id": song["artist_id"],
+        "artist_name": artist["name"] if artist else None,
+        "album_id": song["album_id"],
+        "album_name": album["title"] if album else None,
+        "album_image": album["album_image"] if album else None,
+    }
 
 
 class SongRepository:
@@ -42,6 +57,74 @@ class SongRepository:
         """
         return self.session.query(Song).filter(Song.id == song_id).one_or_none()
 
+    def get_cached(self, song_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Return a read-only snapshot of a Song (id, title, artist_id, album_id,
+        duration), served from the process-wide metadata cache when possible.
+        """
+        snapshot = metadata_cache.song_cache.get(song_id)
+        if snapshot is None:
+            song = self.get_by_id(song_id)
+            if song is None:
+                return None
+            snapshot = song_snapshot(song)
+            metadata_cache.song_cache.set(song_id, snapshot)
+        return snapshot
+
+    def get_details_by_ids(self, song_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Retrieve denormalized display rows for several songs.
+        Returns {song_id: {song_id, title, artist_id, artist_name, album_id,
+        album_name, album_image}}; unknown ids are omitted.
+
+        Rows are assembled from the metadata cache; songs with any part missing
+        from the cache are loaded together in one joined query.
+        """
+        details: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for song_id in dict.fromkeys(song_ids):
+            row = self._cached_details(song_id)
+            if row is None:
+                missing.append(song_id)
+            else:
+                details[song_id] = row
+
+        if not missing:
+            return details
+
+        rows = (
+            self.session.query(Song, Artist, Album)
+            .outerjoin(Artist, Artist.id == Song.artist_id)
+            .outerjoin(Album, Album.id == Song.album_id)
+            .filter(Song.id.in_(missing))
+            .all()
+        )
+        for song, artist, album in rows:
+            song_data = song_snapshot(song)
+            artist_data = artist_snapshot(artist) if artist else None
+            album_data = album_snapshot(album) if album else None
+            metadata_cache.song_cache.set(song.id, song_data)
+            if artist_data:
+                metadata_cache.artist_cache.set(artist.id, artist_data)
+            if album_data:
+                metadata_cache.album_cache.set(album.id, album_data)
+            details[song.id] = _song_details(song_data, artist_data, album_data)
+        return details
+
+    def _cached_details(self, song_id: int) -> Optional[Dict[str, Any]]:
+        song = metadata_cache.song_cache.get(song_id)
+        if song is None:
+            return None
+        artist = metadata_cache.artist_cache.get(song["artist_id"])
+        if artist is None:
+            return None
+        album = None
+        if song["album_id"] is not None:
+            album = metadata_cache.album_cache.get(song["album_id"])
+            if album is None:
+                return None
+        return _song_details(song, artist, album)
+
     def list(
         self, skip: int = 0, limit: int = 100
     ) -> list[Type[Song]]:
@@ -55,6 +138,20 @@ class SongRepository:
             .all()
         )
 
+    def list_ids(self, after_id: int = 0, limit: int = 1000) -> List[int]:
+        """
+        IDs of songs after `after_id`, in ascending order. Paging on the ID
+        stays fast deep into a large catalog, unlike offsets.
+        """
+        rows = (
+            self.session.query(Song.id)
+            .filter(Song.id > after_id)
+            .order_by(Song.id)
+            .limit(limit)
+            .all()
+        )
+        return [song_id for (song_id,) in rows]
+
     def update(self, song: Song, **kwargs: Any) -> Song:
         """
         Update fields of an existing Song.
@@ -63,14 +160,17 @@ class SongRepository:
             setattr(song, attr, value)
         self.session.commit()
         self.session.refresh(song)
+        metadata_cache.song_cache.invalidate(song.id)
         return song
 
     def delete(self, song: Song) -> None:
         """
         Delete a Song record.
         """
+        song_id = song.id
         self.session.delete(song)
         self.session.commit()
+        metadata_cache.song_cache.invalidate(song_id)
 
     def bulk_insert(
         self, songs_data: List[Dict[str, Any]]
@@ -0,0 +1,223 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def hash_to_int(hash_value: str) -> int:
+    """
+    Convert a hex fingerprint hash into a signed 64-bit integer key.
+
+    SpectralMatch hashes are 16 hex characters (64 bits); longer legacy
+    hashes are truncated to their first 64 bits.
+    """
+    value = int(hash_value[:16], 16)
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def int_to_hash(value: int) -> str:
+    """
+    Inverse of hash_to_int for 16-character hashes.
+    """
+    if value < 0:
+        value += 1 << 64
+    return f"{value:016x}"
+
+
+class SQLiteFingerprintRepository:
+    """
+    Fingerprint index stored in a local SQLite file.
+
+    Implements the same operations as FingerprintRepository that the
+    recognition path relies on, for single-node deployments where running
+    MongoDB only for fingerprints is not worth it. Fingerprints live in a
+    WITHOUT ROWID table clustered on the integer hash, so a lookup is a
+    single B-tree range scan.
+    """
+
+    # SQLite's default SQLITE_MAX_VARIABLE_NUMBER is 999 on older builds
+    LOOKUP_BATCH_SIZE = 500
+    INSERT_BATCH_SIZE = 10000
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the SQLite database file (created if missing)
+        """
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._create_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection, opening it on first use.
+        Connections are never shared across a fork.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                hash INTEGER NOT NULL,
+                song_id INTEGER NOT NULL,
+                time_offset INTEGER NOT NULL,
+                PRIMARY KEY (hash, song_id, time_offset)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_fingerprints_song_id ON fingerprints (song_id)"
+        )
+        conn.commit()
+
+    def close(self) -> None:
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+            self._local.conn = None
+
+    def insert_many(self, rows: Iterable[Tuple[int, str, int]]) -> int:
+        """
+        Bulk-insert (song_id, hash, time_offset) rows in batched transactions.
+        Returns the number of rows submitted.
+        """
+        conn = self._connection()
+        total = 0
+        batch = []
+        for song_id, hash_value, time_offset in rows:
+            batch.append((hash_to_int(hash_value), song_id, time_offset))
+            if len(batch) >= self.INSERT_BATCH_SIZE:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO fingerprints (hash, song_id, time_offset) VALUES (?, ?, ?)",
+                    batch,
+                )
+                total += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(
+                "INSERT OR IGNORE INTO fingerprints (hash, song_id, time_offset) VALUES (?, ?, ?)",
+                batch,
+            )
+            total += len(batch)
+        conn.commit()
+        return total
+
+    def store_spectral_fingerprints(self, song_id: int, fingerprints: List[Tuple[str, int]]) -> int:
+        """
+        Store multiple SpectralMatch fingerprints for a song, replacing any
+        existing ones. Each fingerprint is a (hash, time_offset) tuple.
+        Returns the number of fingerprints stored.
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM fingerprints WHERE song_id = ?", (song_id,))
+        conn.commit()
+        return self.insert_many(
+            (song_id, hash_value, time_offset) for hash_value, time_offset in fingerprints
+        )
+
+    def store_many(self, fingerprints_by_song: Dict[int, List[Tuple[str, int]]]) -> int:
+        """
+        Replace the fingerprints of several songs at once.
+        Returns the number of fingerprints stored.
+        """
+        song_ids = list(fingerprints_by_song)
+        conn = self._connection()
+        conn.executemany("DELETE FROM fingerprints WHERE song_id = ?", [(song_id,) for song_id in song_ids])
+        conn.commit()
+        return self.insert_many(
+            (song_id, hash_value, time_offset)
+            for song_id in song_ids
+            for hash_value, time_offset in fingerprints_by_song[song_id]
+        )
+
+    def get_fingerprints_by_hashes(self, hashes: List[str]) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Get fingerprints for specific hashes.
+        Returns dict: {hash: [(song_id, time_offset), ...]}
+        """
+        keys: Dict[int, List[str]] = {}
+        for hash_value in hashes:
+            key = hash_to_int(hash_value)
+            names = keys.setdefault(key, [])
+            if hash_value not in names:
+                names.append(hash_value)
+
+        conn = self._connection()
+        result: Dict[str, List[Tuple[int, int]]] = {}
+        unique_keys = list(keys)
+        full_sql = self._lookup_sql(self.LOOKUP_BATCH_SIZE)
+
+        for start in range(0, len(unique_keys), self.LOOKUP_BATCH_SIZE):
+            chunk = unique_keys[start:start + self.LOOKUP_BATCH_SIZE]
+            # Reuse one statement text for full chunks so it stays in the cache
+            sql = full_sql if len(chunk) == self.LOOKUP_BATCH_SIZE else self._lookup_sql(len(chunk))
+            for key, song_id, time_offset in conn.execute(sql, chunk):
+                for hash_value in keys[key]:
+                    result.setdefault(hash_value, []).append((song_id, time_offset))
+
+        return result
+
+    @staticmethod
+    def _lookup_sql(size: int) -> str:
+        placeholders = ",".join("?" * size)
+        return f"SELECT hash, song_id, time_offset FROM fingerprints WHERE hash IN ({placeholders})"
+
+    def delete_by_song_id(self, song_id: int) -> int:
+        """Delete all fingerprints for a song. Returns number deleted."""
+        conn = self._connection()
+        cursor = conn.execute("DELETE FROM fingerprints WHERE song_id = ?", (song_id,))
+        conn.commit()
+        return cursor.rowcount
+
+    def count_by_song_id(self, song_id: int) -> int:
+        """Count fingerprints for a song."""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM fingerprints WHERE song_id = ?", (song_id,)
+        ).fetchone()
+        return row[0]
+
+    def count(self) -> int:
+        """Count all stored fingerprints."""
+        return self._connection().execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def song_count(self) -> int:
+        """Number of songs with fingerprints in the index."""
+        return self._connection().execute("SELECT COUNT(DISTINCT song_id) FROM fingerprints").fetchone()[0]
+
+    def import_from_mongo(self, batch_size: int = 50000, song_ids: Optional[List[int]] = None,
+                          version: Optional[int] = None) -> int:
+        """
+        Copy fingerprints from a MongoDB fingerprint collection into this index.
+        Requires an active mongoengine connection. Returns the number of rows copied.
+
+        :param batch_size: number of documents fetched per cursor batch
+        :param song_ids: optionally restrict the import to these songs
+        :param version: algorithm version whose collection to copy; `fingerprints` by default
+        """
+        from db.nosql.collections import LEGACY_FINGERPRINT_VERSION, fingerprint_document
+
+        query = {"song_id": {"$in": song_ids}} if song_ids is not None else {}
+        cursor = (
+            fingerprint_document(version or LEGACY_FINGERPRINT_VERSION)._get_collection()
+            .find(query, {"_id": 0, "song_id": 1, "hash": 1, "time_offset": 1})
+            .batch_size(batch_size)
+        )
+        return self.insert_many(
+            (doc["song_id"], doc["hash"], doc.get("time_offset", 0)) for doc in cursor
+        )
@@ -1,9 +1,16 @@
-﻿from mongoengine import Document, IntField, StringField, DateTimeField, ListField, FloatField
+﻿from mongoengine import Document, IntField, LongField, StringField, DateTimeField, ListField, FloatField, BinaryField
 from datetime import datetime
+from typing import Tuple
+import numpy as np
 
-class Fingerprint(Document):
+# Fingerprints from before algorithm versioning live in `fingerprints`;
+# every later algorithm version gets its own `fingerprints_v<version>` collection
+LEGACY_FINGERPRINT_VERSION = 1
+
+
+class FingerprintBase(Document):
     meta = {
-        "collection": "fingerprints",
+        "abstract": True,
         "indexes": [
             "hash",  # fast query by fingerprint hash
             "song_id",  # query by song identifier
@@ -21,20 +28,134 @@ class Fingerprint(Document):
     # Timestamp when this fingerprint document was created
     created_at = DateTimeField(default=datetime.utcnow)
 
+
+class Fingerprint(FingerprintBase):
+    meta = {"collection": "fingerprints"}
+
+
+_fingerprint_documents = {LEGACY_FINGERPRINT_VERSION: Fingerprint}
+
+
+def fingerprint_document(version: int):
+    """Document class of the fingerprint index built by an algorithm version."""
+    if version not in _fingerprint_documents:
+        _fingerprint_documents[version] = type(
+            f"FingerprintV{version}", (FingerprintBase,), {"meta": {"collection": f"fingerprints_v{version}"}}
+        )
+    return _fingerprint_documents[version]
+
+# Storage type of SongFeature.vector: little-endian float32
+FEATURE_VECTOR_DTYPE = "<f4"
+
+
+def encode_feature_vector(vector) -> Tuple[bytes, str, int]:
+    """Pack a feature vector for SongFeature: (raw bytes, dtype, dimension)."""
+    packed = np.ascontiguousarray(vector, dtype=FEATURE_VECTOR_DTYPE).ravel()
+    return packed.tobytes(), FEATURE_VECTOR_DTYPE, len(packed)
+
+
 class SongFeature(Document):
     meta = {
         "collection": "song_features",
         "indexes": [
             "song_id", # Query by song ID
+            "updated_at", # Incremental refresh of cached feature matrices
         ]
     }
     song_id = IntField(required=True, unique=True) # SQL Song ID
-    feature_vector = ListField(FloatField(), required=True) # Store feature vector as list of floats
+    vector = BinaryField() # Packed feature vector, see encode_feature_vector
+    vector_dtype = StringField(default=FEATURE_VECTOR_DTYPE) # NumPy dtype string of `vector`
+    vector_dim = IntField() # Number of values in `vector`
+    # Vectors written before binary storage, as a list of floats (scripts.migrate_song_features converts them)
+    legacy_vector = ListField(FloatField(), db_field="feature_vector")
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
 
+    @property
+    def feature_vector(self) -> np.ndarray:
+        """The feature vector, from the packed field or a not yet migrated list."""
+        if self.vector is not None:
+            return np.frombuffer(self.vector, dtype=self.vector_dtype or FEATURE_VECTOR_DTYPE)
+        return np.asarray(self.legacy_vector or [], dtype=FEATURE_VECTOR_DTYPE)
+
     def save(self, *args, **kwargs):
         if not self.created_at:
             self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
         return super(SongFeature, self).save(*args, **kwargs)
+
+
+class IngestManifest(Document):
+    meta = {
+        "collection": "ingest_manifest",
+        "indexes": [
+            "song_id",  # one record per song
+            "source_path",  # lookup while walking a library
+        ]
+    }
+
+    # SQL Song ID the source file was ingested as
+    song_id = IntField(required=True, unique=True)
+    # Absolute path of the source file
+    source_path = StringField(required=True)
+    # SHA-256 of the file contents
+    content_hash = StringField(required=True)
+    # Size and modification time at ingest, to skip hashing files that were not touched
+    file_size = LongField()
+    mtime_ns = LongField()
+    # Extractor that produced the stored fingerprints and features
+    algorithm_version = IntField()
+    params_signature = LongField()
+    feature_version = IntField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+
+class IndexState(Document):
+    meta = {"collection": "index_state"}
+
+    # Index the state belongs to ("fingerprints")
+    name = StringField(required=True, unique=True)
+    # Algorithm version queries are served from
+    active_version = IntField(required=True)
+    # Version being built next to it (written alongside the active one), if any
+    building_version = IntField()
+    # Version that was active before the last switch, for rollback
+    previous_version = IntField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+
+class ShadowComparison(Document):
+    meta = {
+        "collection": "shadow_comparisons",
+        "indexes": [("active_version", "candidate_version")],
+    }
+
+    active_version = IntField(required=True)
+    candidate_version = IntField(required=True)
+    # Top song of each version (None for no match) and time to extract + match, in ms
+    active_song_id = IntField()
+    candidate_song_id = IntField()
+    active_ms = FloatField()
+    candidate_ms = FloatField()
+    # Known answer, for labelled clips
+    expected_song_id = IntField()
+    created_at = DateTimeField(default=datetime.utcnow)
+
+
+class RebuildProgress(Document):
+    meta = {
+        "collection": "rebuild_progress",
+        "indexes": [
+            {"fields": ("version", "song_id"), "unique": True},
+            ("version", "status"),
+        ],
+    }
+
+    # Algorithm version whose index is being rebuilt
+    version = IntField(required=True)
+    song_id = IntField(required=True)
+    # "done" or "failed"
+    status = StringField(required=True)
+    fingerprints = IntField(default=0)
+    error = StringField()
+    updated_at = DateTimeField(default=datetime.utcnow)
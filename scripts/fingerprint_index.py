@@ -0,0 +1,153 @@
+"""
+Roll out a new fingerprint algorithm version next to the one serving queries.
+
+    status                 active / building / previous versions and index sizes
+    start-build VERSION    store new songs in VERSION's index too
+    build [VERSION]        re-fingerprint the catalog into VERSION's index; resumes where
+                           an interrupted build stopped
+    shadow CLIPS_CSV       compare both versions on labelled clips (columns path,song_id)
+    shadow-report          accuracy and latency of recorded comparisons
+    switch VERSION         serve queries from VERSION
+    rollback               serve queries from the previously active version again
+    cancel-build           stop dual writes; the partial index is kept
+
+Usage:
+    python -m scripts.fingerprint_index start-build 2
+    python -m scripts.fingerprint_index build --workers 4 --max-songs-per-minute 600
+    python -m scripts.fingerprint_index shadow clips.csv
+    python -m scripts.fingerprint_index switch 2
+    python -m scripts.fingerprint_index rollback
+"""
+import argparse
+import csv
+import os
+import sys
+
+from dotenv import load_dotenv
+from mongoengine import connect
+
+from core.fingerprint import versions
+from core.fingerprint.rebuild import RebuildJob
+from core.fingerprint.shadow import ShadowMatcher, record_comparison, shadow_report, summarize
+from core.repository.fingerprint_repository import get_fingerprint_repository
+from core.repository.rebuild_progress_repository import RebuildProgressRepository
+
+
+def _print_state(state):
+    print(f"active: v{state['active_version']}")
+    print(f"building: {'v%d' % state['building_version'] if state['building_version'] is not None else '-'}")
+    print(f"previous: {'v%d' % state['previous_version'] if state['previous_version'] is not None else '-'}")
+
+
+def _print_report(report):
+    print(f"{report['clips']} clips ({report['labelled']} labelled), agreement "
+          f"{report['agreement'] if report['agreement'] is None else format(report['agreement'], '.1%')}")
+    print(f"{'version':<10}{'accuracy':>10}{'matched':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for role in ("active", "candidate"):
+        row = report[role]
+        cells = [row["accuracy"], row["match_rate"]]
+        cells = ["-" if c is None else format(c, ".1%") for c in cells]
+        cells += ["-" if row[k] is None else format(row[k], ".1f") for k in ("mean_ms", "p50_ms", "p95_ms")]
+        print(f"{'v%s' % row['version']:<10}" + "".join(f"{c:>10}" for c in cells))
+
+
+def _candidate(args, state) -> int:
+    version = args.version if args.version is not None else state["building_version"]
+    if version is None:
+        sys.exit("No version is being built; pass VERSION")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    commands.add_parser("start-build").add_argument("version", type=int)
+    commands.add_parser("cancel-build")
+    build = commands.add_parser("build")
+    build.add_argument("version", type=int, nargs="?", help="default: the version being built")
+    build.add_argument("--workers", type=int, default=0, help="extraction processes (default: half the CPUs)")
+    build.add_argument("--batch-size", type=int, default=32, help="songs per batched index write")
+    build.add_argument("--pause", type=float, default=0.0, help="seconds to sleep after every batch")
+    build.add_argument("--max-songs-per-minute", type=float, default=0.0, help="rate limit (default: none)")
+    build.add_argument("--nice", type=int, default=None, help="CPU priority increment of workers (default: REBUILD_NICE)")
+    build.add_argument("--reset", action="store_true", help="forget earlier progress and rebuild every song")
+    shadow = commands.add_parser("shadow")
+    shadow.add_argument("clips", help="CSV of labelled clips with columns path,song_id")
+    shadow.add_argument("--version", type=int, help="candidate version (default: the version being built)")
+    report = commands.add_parser("shadow-report")
+    report.add_argument("--version", type=int, help="candidate version (default: the version being built)")
+    report.add_argument("--limit", type=int, default=0, help="most recent comparisons only")
+    switch = commands.add_parser("switch")
+    switch.add_argument("version", type=int)
+    switch.add_argument("--force", action="store_true", help="switch even if the index has fewer songs")
+    commands.add_parser("rollback")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    db_name = os.getenv("DB_NAME", "tuneleap_db")
+    connect(db=db_name, host=mongo_uri, alias="default")
+
+    state = versions.get_index_state(refresh=True)
+    try:
+        if args.command == "status":
+            _print_state(state)
+            for version in sorted({v for v in state.values() if v is not None}):
+                repo = get_fingerprint_repository(version)
+                print(f"v{version} index: {repo.song_count()} songs, {repo.count()} fingerprints")
+            if state["building_version"] is not None:
+                progress = RebuildProgressRepository(state["building_version"]).counts()
+                print(f"v{state['building_version']} build: {progress['done']} songs done, {progress['failed']} failed")
+        elif args.command == "start-build":
+            _print_state(versions.start_build(args.version))
+        elif args.command == "cancel-build":
+            _print_state(versions.cancel_build())
+        elif args.command == "build":
+            version = _candidate(args, state)
+            if args.reset:
+                RebuildProgressRepository(version).reset()
+            from db.sql.database import SessionLocal
+
+            session = SessionLocal()
+            try:
+                options = {} if args.nice is None else {"nice": args.nice}
+                job = RebuildJob(version, session=session, batch_size=args.batch_size,
+                                 max_workers=args.workers or None, pause_seconds=args.pause,
+                                 max_songs_per_minute=args.max_songs_per_minute, **options)
+                stats = job.run()
+            finally:
+                session.close()
+            print(f"Rebuilt {stats['songs']} songs ({stats['fingerprints']} fingerprints) into v{version} "
+                  f"in {stats['elapsed']:.1f}s, {stats['failed']} failed, {stats['skipped']} already done")
+            for failure in RebuildProgressRepository(version).failed(limit=20):
+                print(f"  song {failure['song_id']}: {failure.get('error')}")
+        elif args.command == "shadow":
+            matcher = ShadowMatcher(state["active_version"], _candidate(args, state))
+            comparisons = []
+            with open(args.clips, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    comparison = matcher.compare_file(row["path"], int(row["song_id"]))
+                    record_comparison(comparison)
+                    comparisons.append(comparison)
+            _print_report(summarize(comparisons))
+        elif args.command == "shadow-report":
+            _print_report(shadow_report(state["active_version"], _candidate(args, state), args.limit))
+        elif args.command == "switch":
+            if not args.force:
+                serving = get_fingerprint_repository(state["active_version"]).song_count()
+                candidate = get_fingerprint_repository(args.version).song_count()
+                if candidate < serving:
+                    sys.exit(f"v{args.version} index has {candidate} songs, v{state['active_version']} has "
+                             f"{serving}; finish the build or pass --force")
+            _print_state(versions.switch_active_version(args.version))
+        elif args.command == "rollback":
+            if state["previous_version"] is None:
+                sys.exit("No previous version to roll back to")
+            _print_state(versions.switch_active_version(state["previous_version"]))
+    except (ValueError, RuntimeError) as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
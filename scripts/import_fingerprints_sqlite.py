@@ -0,0 +1,40 @@
+"""
+Copy the MongoDB `fingerprints` collection into a local SQLite fingerprint index.
+
+Usage:
+    python -m scripts.import_fingerprints_sqlite --output data/fingerprints.sqlite3
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from mongoengine import connect
+
+from core.repository.sqlite_fingerprint_repository import SQLiteFingerprintRepository
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=os.getenv("FINGERPRINT_SQLITE_PATH", "data/fingerprints.sqlite3"),
+                        help="SQLite file to write (default: FINGERPRINT_SQLITE_PATH)")
+    parser.add_argument("--batch-size", type=int, default=50000,
+                        help="MongoDB cursor batch size")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    db_name = os.getenv("DB_NAME", "tuneleap_db")
+    connect(db=db_name, host=mongo_uri, alias="default")
+
+    repo = SQLiteFingerprintRepository(args.output)
+    start = time.perf_counter()
+    copied = repo.import_from_mongo(batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    print(f"Imported {copied} fingerprints into {args.output} in {elapsed:.1f}s "
+          f"({copied / max(elapsed, 1e-9):.0f} rows/s); index now holds {repo.count()} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Convert SongFeature documents from the old feature_vector list of doubles to
+the packed float32 `vector` field. Documents already converted are skipped,
+so the script can be stopped and re-run at any time; readers handle both
+formats meanwhile.
+
+Usage:
+    python -m scripts.migrate_song_features --batch-size 1000
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from mongoengine import connect
+
+from core.repository.song_feature_repository import SongFeatureRepository
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents read per batch")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    db_name = os.getenv("DB_NAME", "tuneleap_db")
+    connect(db=db_name, host=mongo_uri, alias="default")
+
+    start = time.perf_counter()
+    converted = SongFeatureRepository().migrate_to_binary(batch_size=args.batch_size)
+    print(f"Converted {converted} song feature documents in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
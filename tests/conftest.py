@@ -11,9 +11,11 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from api import main as main_module
 from api.main import app
 from db.sql.models import Base
 from db.sql.database import get_db
+from core.repository.metadata_cache import clear_metadata_caches
 
 # Import the module whose attributes we want to patch
 from core.security import security as core_security_module
@@ -44,6 +46,16 @@ def sqlite_session(engine):
         db.close()
         Base.metadata.drop_all(bind=engine) # Drop tables after test
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    Tests reuse primary keys across throwaway databases, so process-wide
+    metadata caches must not carry snapshots from one test to the next.
+    """
+    clear_metadata_caches()
+    yield
+    clear_metadata_caches()
+
 # --- App and Client Fixtures ---
 @pytest.fixture(scope="function")
 def client(sqlite_session, monkeypatch):
@@ -64,6 +76,9 @@ def client(sqlite_session, monkeypatch):
     # ALGORITHM is hardcoded in core.security.security.py as "HS256"
     # and TEST_DECODE_ALGORITHM in test_auth.py is "HS256", so they match.
 
+    # Startup would otherwise preload the fingerprint index for every client
+    monkeypatch.setattr(main_module, "RECOGNITION_SYNC_PRELOAD", False)
+
 
     with TestClient(app) as c:
         yield c
@@ -72,6 +87,22 @@ def client(sqlite_session, monkeypatch):
     del app.dependency_overrides[get_db]
     # monkeypatch automatically reverts its changes after the fixture scope ends.
 
+@pytest.fixture(scope="session", autouse=True)
+def mongomock_bulk_updates():
+    """
+    mongomock cannot build the UpdateOne requests of current pymongo (it
+    lacks their sort argument), so bulk writes of updates are applied one
+    request at a time.
+    """
+    def bulk_write(collection, requests, ordered=True, **kwargs):
+        for request in requests:
+            collection.update_one(request._filter, request._doc, upsert=request._upsert)
+
+    patcher = pytest.MonkeyPatch()
+    patcher.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    yield
+    patcher.undo()
+
 # --- MongoDB Mocking Fixture (if not already in test_api_endpoints.py or similar) ---
 @pytest.fixture(scope="session", autouse=True) # Changed to session scope
 def mongo_connection_session():
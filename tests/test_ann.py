@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+from core.reco import feature_store
+from core.reco.ann import IVFIndex, recall_at_k, unit_rows
+from core.reco.builder import PlaylistBuilder
+from core.reco.engine import RecommenderEngine, build_index
+from core.reco.feature_store import FeatureStore
+from core.reco.search import FEATURE_DIM, FeatureSearchEngine
+
+
+def _clustered(count, dim=FEATURE_DIM, seed=45):
+    rng = np.random.default_rng(seed)
+    styles = rng.normal(size=(50, dim))
+    vectors = styles[rng.integers(0, len(styles), count)] + 0.5 * rng.normal(size=(count, dim))
+    return np.arange(1, count + 1, dtype=np.int64), unit_rows(vectors).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def data():
+    ids, vectors = _clustered(20000)
+    index = IVFIndex.build(ids, vectors)
+    rng = np.random.default_rng(1)
+    queries = unit_rows(vectors[rng.integers(0, len(vectors), 100)] + 0.3 * rng.normal(size=(100, FEATURE_DIM)))
+    return ids, vectors, index, queries.astype(np.float32)
+
+
+def test_recall_grows_with_nprobe(data):
+    ids, vectors, index, queries = data
+    recalls = [recall_at_k(index, ids, vectors, queries, k=10, nprobe=nprobe) for nprobe in (1, 16, 64)]
+    assert recalls == sorted(recalls)
+    assert recalls[1] >= 0.9
+    assert recall_at_k(index, ids, vectors, queries, k=10, nprobe=index.n_lists) == 1.0
+
+
+def test_save_load_round_trip(data, tmp_path):
+    ids, vectors, index, queries = data
+    path = str(tmp_path / "features.ivf")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert len(loaded) == len(index) and loaded.nprobe == index.nprobe
+    for query in queries[:10]:
+        found, scores = index.search(query, 10)
+        loaded_found, loaded_scores = loaded.search(query, 10)
+        assert np.array_equal(found, loaded_found) and np.array_equal(scores, loaded_scores)
+
+
+def test_incremental_add_and_remove(data):
+    ids, vectors, index, _ = data
+    index = index.copy()
+    new_ids, new_vectors = _clustered(500, seed=46)
+    new_ids += 100000
+    index.add(new_ids, new_vectors)
+    assert len(index) == len(ids) + 500
+    found, scores = index.search(new_vectors[7], 1)
+    assert found[0] == new_ids[7] and scores[0] == pytest.approx(1.0, abs=1e-5)
+
+    assert index.remove(new_ids[:250]) == 250
+    assert new_ids[7] not in index.search(new_vectors[7], 10, nprobe=index.n_lists)[0]
+    # The original is untouched by its copy's changes
+    assert len(data[2]) == len(ids)
+
+
+def test_feature_search_with_index_matches_exact_at_full_probe():
+    ids, vectors = _clustered(3000)
+    features = dict(zip(ids.tolist(), vectors.astype(np.float64) * 3))
+    features[1] = np.random.default_rng(2).normal(size=30)  # legacy shorter vector
+    exact = FeatureSearchEngine(features, ann_min_songs=10 ** 9)
+    approx = FeatureSearchEngine(features, ann_min_songs=1000, nprobe=10 ** 6)
+    assert exact.index is None and approx.index is not None
+    for song_id in (5, 500, 2500):
+        assert approx.search(features[song_id], k=10) == exact.search(features[song_id], k=10)
+        assert approx.search(features[song_id], k=5, threshold=0.5) == exact.search(features[song_id], k=5,
+                                                                                    threshold=0.5)
+
+
+def test_feature_store_carries_the_index_over(monkeypatch):
+    ids, vectors = _clustered(3000)
+
+    class Repository:
+        features = dict(zip(ids.tolist(), vectors.astype(np.float64)))
+
+        def get_features_since(self, since=None):
+            return dict(self.features), None
+
+        def count(self):
+            return len(self.features)
+
+    repository = Repository()
+    store = FeatureStore(repository, refresh_seconds=0)
+    monkeypatch.setattr(feature_store, "FeatureSearchEngine",
+                        lambda *args, **kwargs: FeatureSearchEngine(*args, ann_min_songs=1000, **kwargs))
+    first = store.engine()
+    repository.features[3001] = -vectors[0].astype(np.float64)
+    assert store.refresh() is True
+    second = store.engine()
+    assert second.index is not first.index and len(second.index) == 3001
+    assert np.array_equal(second.index.centroids, first.index.centroids)
+    assert 3001 not in first.index.search(-vectors[0], 5, nprobe=10 ** 6)[0]
+    assert second.search(-vectors[0], k=1)[0][0] == 3001
+
+
+def test_recommender_with_index():
+    ids, vectors = _clustered(3000)
+    feature_map = dict(zip(ids.tolist(), vectors.astype(np.float64)))
+    exact = RecommenderEngine(feature_map)
+    approx = RecommenderEngine(feature_map, index=build_index(feature_map), nprobe=10 ** 6)
+    for song_id in (1, 1500, 3000):
+        assert [s for s, _ in approx.recommend(song_id, 5)] == [s for s, _ in exact.recommend(song_id, 5)]
+    assert len(PlaylistBuilder(feature_map, index=approx.index).build(42, top_n=5)) == 5
+
+
+def test_saved_index_is_only_reused_for_the_same_catalog(monkeypatch, tmp_path):
+    from api.v1 import song_recommendations
+
+    ids, vectors = _clustered(3000)
+    feature_map = dict(zip(ids.tolist(), vectors.astype(np.float64)))
+    monkeypatch.setattr(song_recommendations, "FEATURE_ANN_MIN_SONGS", 1000)
+    monkeypatch.setattr(song_recommendations, "FEATURE_ANN_INDEX_PATH", str(tmp_path / "features.ivf"))
+    monkeypatch.setattr(song_recommendations, "_feature_index", None)
+    saved = song_recommendations.get_feature_index(feature_map)
+
+    def no_rebuild(feature_map):
+        raise AssertionError("the saved index should have been loaded")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(song_recommendations, "build_index", no_rebuild)
+        patched.setattr(song_recommendations, "_feature_index", None)
+        assert song_recommendations.get_feature_index(dict(feature_map)).tag == saved.tag
+
+    # Same number of songs, one vector changed: the saved index is stale
+    changed = dict(feature_map)
+    changed[1] = -changed[1]
+    monkeypatch.setattr(song_recommendations, "_feature_index", None)
+    rebuilt = song_recommendations.get_feature_index(changed)
+    assert len(rebuilt) == len(saved) and rebuilt.tag != saved.tag
+    assert rebuilt.search(-vectors[0], 1, nprobe=10 ** 6)[0][0] == 1
+
+
+def test_feature_search_stays_exact_unless_ann_is_enabled(monkeypatch):
+    from core.reco import search
+
+    ids, vectors = _clustered(3000)
+    features = dict(zip(ids.tolist(), vectors.astype(np.float64)))
+    monkeypatch.setattr(search, "FEATURE_ANN_MIN_SONGS", 1000)
+    assert FeatureSearchEngine(features).index is None
+    monkeypatch.setattr(search, "FEATURE_SEARCH_ANN", True)
+    assert FeatureSearchEngine(features).index is not None
@@ -0,0 +1,117 @@
+import shutil
+
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+from scipy.io.wavfile import write as wav_write
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.nosql.collections import Fingerprint
+from db.sql.models import Base, Artist, Song
+from core.fingerprint.extractor import extract_fingerprint, extract_fingerprints_parallel
+from core.repository.fingerprint_repository import FingerprintRepository
+from worker import tasks
+
+SR = 22050
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(tasks, "get_db", lambda: iter([Session()]))
+    yield Session
+    Base.metadata.drop_all(engine)
+
+
+def _write_wav(path, y):
+    wav_write(str(path), SR, (y * 32767).astype(np.int16))
+    return str(path)
+
+
+def _noise(seed, seconds):
+    rng = np.random.default_rng(seed)
+    return 0.5 * rng.uniform(-1, 1, int(SR * seconds))
+
+
+@pytest.fixture
+def catalog(tmp_path, session_factory):
+    """Two fingerprinted songs plus one excerpt clip of each and an unknown clip."""
+    Fingerprint.drop_collection()
+    session = session_factory()
+    artist = Artist(name="Batch Artist")
+    session.add(artist)
+    session.commit()
+    songs = [Song(title="Batch Song 1", artist_id=artist.id), Song(title="Batch Song 2", artist_id=artist.id)]
+    session.add_all(songs)
+    session.commit()
+
+    repo = FingerprintRepository()
+    clips = []
+    for seed, song in zip((1, 2), songs):
+        full = _noise(seed, 8)
+        song_path = _write_wav(tmp_path / f"song{seed}.wav", full)
+        repo.store_spectral_fingerprints(song.id, extract_fingerprint(song_path))
+        start = 2048 * 40  # hop-aligned excerpt
+        clips.append(_write_wav(tmp_path / f"clip{seed}.wav", full[start:start + SR * 4]))
+    clips.append(_write_wav(tmp_path / "unknown.wav", _noise(99, 4)))
+    song_ids = [song.id for song in songs]
+    session.close()
+    return clips, song_ids
+
+
+def test_extract_fingerprints_parallel_matches_serial(catalog):
+    clips, _ = catalog
+    assert extract_fingerprints_parallel(clips, max_workers=2) == [extract_fingerprint(c) for c in clips]
+
+
+def test_recognize_batch_task_returns_one_result_per_clip(catalog, tmp_path, monkeypatch):
+    clips, song_ids = catalog
+    uploads = []
+    for i, clip in enumerate(clips):
+        upload = tmp_path / f"upload{i}.wav"
+        shutil.copy(clip, upload)
+        uploads.append(str(upload))
+
+    lookups = []
+    original = FingerprintRepository.get_fingerprints_by_hashes
+
+    def counting_lookup(self, hashes):
+        lookups.append(len(hashes))
+        return original(self, hashes)
+
+    monkeypatch.setattr(FingerprintRepository, "get_fingerprints_by_hashes", counting_lookup)
+
+    result = tasks.recognize_batch_task.run(uploads, ["a.wav", "b.wav", "c.wav"])
+
+    assert result["status"] == "SUCCESS"
+    assert [clip["filename"] for clip in result["results"]] == ["a.wav", "b.wav", "c.wav"]
+    first, second, unknown = result["results"]
+    assert first["results"][0]["song_id"] == song_ids[0]
+    assert first["results"][0]["title"] == "Batch Song 1"
+    assert second["results"][0]["song_id"] == song_ids[1]
+    assert second["results"][0]["artist_name"] == "Batch Artist"
+    assert unknown["status"] == "NO_MATCH"
+    assert len(lookups) == 1
+    assert all(not (tmp_path / f"upload{i}.wav").exists() for i in range(3))
@@ -0,0 +1,219 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+from scipy.io.wavfile import write as wav_write
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from core.ingest.catalog import CatalogIngester, IngestCheckpoint, read_manifest, scan_directory
+from core.repository.fingerprint_repository import FingerprintRepository
+from core.repository.ingest_manifest_repository import IngestManifestRepository
+from core.repository.song_feature_repository import SongFeatureRepository
+from db.nosql.collections import Fingerprint, IngestManifest, SongFeature
+from db.sql.models import Base, Album, Artist, Song
+
+SR = 22050
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    SongFeature.drop_collection()
+    IngestManifest.drop_collection()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def session():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    Fingerprint.drop_collection()
+    SongFeature.drop_collection()
+    IngestManifest.drop_collection()
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+
+
+def _write_wav(path, seed):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    y = 0.5 * np.random.default_rng(seed).uniform(-1, 1, SR * 3)
+    wav_write(str(path), SR, (y * 32767).astype(np.int16))
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = tmp_path / "library"
+    _write_wav(root / "Artist A" / "First Album" / "Song One.wav", 1)
+    _write_wav(root / "Artist A" / "First Album" / "Song Two.wav", 2)
+    _write_wav(root / "Artist B - Song Three.wav", 3)
+    (root / "notes.txt").write_text("not audio")
+    return root
+
+
+class FailingFeatureRepository(SongFeatureRepository):
+    """Dies on the second batch, like a run that is interrupted."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def bulk_upsert(self, features_by_song):
+        self.calls += 1
+        if self.calls > 1:
+            raise KeyboardInterrupt
+        return super().bulk_upsert(features_by_song)
+
+
+def _ingester(session, checkpoint, batch_size=2, feature_repository=None, manifest=False, force=False):
+    return CatalogIngester(session, FingerprintRepository(), feature_repository or SongFeatureRepository(),
+                           workers=2, batch_size=batch_size, checkpoint=checkpoint, pool_kind="thread",
+                           manifest_repository=IngestManifestRepository() if manifest else None, force=force)
+
+
+def test_scan_directory_infers_metadata_from_layout(library):
+    entries = {entry["title"]: entry for entry in scan_directory(str(library))}
+    assert set(entries) == {"Song One", "Song Two", "Song Three"}
+    assert entries["Song One"]["artist"] == "Artist A"
+    assert entries["Song One"]["album"] == "First Album"
+    assert entries["Song Three"]["artist"] == "Artist B"
+    assert entries["Song Three"]["album"] is None
+
+
+def test_read_manifest_resolves_relative_paths(library):
+    manifest = library / "catalog.csv"
+    manifest.write_text("path,title,artist,album,duration\n"
+                        "Artist A/First Album/Song One.wav,Opening,Artist A,,180\n")
+    [entry] = list(read_manifest(str(manifest)))
+    assert entry["path"] == str(library / "Artist A" / "First Album" / "Song One.wav")
+    assert entry["title"] == "Opening"
+    assert entry["album"] is None
+    assert entry["duration"] == 180
+
+
+def test_ingest_creates_catalog_fingerprints_and_features(session, library, tmp_path):
+    checkpoint_path = tmp_path / "ingest.json"
+    stats = _ingester(session, IngestCheckpoint(str(checkpoint_path))).run(scan_directory(str(library)))
+
+    assert stats["ingested"] == 3 and stats["failed"] == 0
+    assert stats["files_per_second"] > 0
+    assert stats["stages"]["fingerprint"] > 0 and stats["stages"]["store_fingerprints"] > 0
+
+    assert sorted(a.name for a in session.query(Artist)) == ["Artist A", "Artist B"]
+    assert [a.title for a in session.query(Album)] == ["First Album"]
+    songs = {song.title: song for song in session.query(Song)}
+    assert set(songs) == {"Song One", "Song Two", "Song Three"}
+    assert songs["Song One"].album_id == songs["Song Two"].album_id
+    assert songs["Song One"].duration == 3
+
+    for song in songs.values():
+        assert Fingerprint.objects(song_id=song.id).count() > 0
+        assert len(SongFeatureRepository().get_by_song_id(song.id).feature_vector) == 55
+    assert Fingerprint.objects.count() == stats["fingerprints"]
+    # A completed run leaves nothing to resume
+    assert not checkpoint_path.exists()
+
+
+def test_ingest_resumes_from_checkpoint(session, library, tmp_path):
+    checkpoint_path = str(tmp_path / "ingest.json")
+    entries = list(scan_directory(str(library)))
+    with pytest.raises(KeyboardInterrupt):
+        _ingester(session, IngestCheckpoint(checkpoint_path),
+                  feature_repository=FailingFeatureRepository()).run(entries)
+    with open(checkpoint_path) as f:
+        assert len(json.load(f)["done"]) == 2
+    fingerprints = Fingerprint.objects.count()
+
+    stats = _ingester(session, IngestCheckpoint(checkpoint_path)).run(entries)
+
+    assert stats["skipped"] == 2 and stats["ingested"] == 1
+    assert session.query(Song).count() == 3
+    # The interrupted batch's fingerprints were replaced, not duplicated
+    assert Fingerprint.objects.count() == fingerprints
+    assert SongFeature.objects.count() == 3
+
+
+def test_reingesting_reuses_songs(session, library):
+    entries = list(scan_directory(str(library)))
+    _ingester(session, IngestCheckpoint()).run(entries)
+    fingerprints = Fingerprint.objects.count()
+
+    _ingester(session, IngestCheckpoint(), batch_size=10).run(entries)
+
+    assert session.query(Song).count() == 3
+    assert Fingerprint.objects.count() == fingerprints
+    assert SongFeature.objects.count() == 3
+
+
+def test_unreadable_file_is_recorded_as_failed(session, tmp_path):
+    broken = tmp_path / "Artist C - Broken.wav"
+    broken.write_bytes(b"not a wav file")
+    checkpoint = IngestCheckpoint(str(tmp_path / "ingest.json"))
+
+    stats = _ingester(session, checkpoint).run(scan_directory(str(tmp_path)))
+
+    assert stats["failed"] == 1 and stats["ingested"] == 0
+    assert str(broken) in stats["failed_paths"]
+    assert session.query(Song).count() == 0
+
+
+def test_manifest_skips_unchanged_files(session, library, monkeypatch):
+    entries = list(scan_directory(str(library)))
+    first = _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+    assert first["ingested"] == 3
+    records = IngestManifestRepository().get_by_paths(entry["path"] for entry in entries)
+    assert {record["song_id"] for record in records.values()} == {song.id for song in session.query(Song)}
+
+    # Rewriting a file with the same audio only costs a hash; new audio is reprocessed
+    touched = entries[0]["path"]
+    with open(touched, "rb") as f:
+        data = f.read()
+    with open(touched, "wb") as f:
+        f.write(data)
+    os.utime(touched, ns=(0, 0))
+    _write_wav(library / "Artist A" / "First Album" / "Song Two.wav", 20)
+
+    second = _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+
+    assert second["ingested"] == 1 and second["unchanged"] == 2
+    assert IngestManifestRepository().get_by_paths([touched])[touched]["mtime_ns"] == 0
+    assert session.query(Song).count() == 3
+
+    # Nothing is read at all once the manifest has the new stat data
+    monkeypatch.setattr("core.ingest.catalog.analyze_file", None)
+    third = _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+    assert third["unchanged"] == 3 and third["ingested"] == 0
+
+
+def test_manifest_reprocesses_files_from_an_older_extractor(session, library, monkeypatch):
+    entries = list(scan_directory(str(library)))
+    _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+
+    monkeypatch.setattr("core.reco.features.FEATURE_VERSION", 2)
+    stats = _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+
+    assert stats["ingested"] == 3 and stats["unchanged"] == 0
+    assert {r["feature_version"] for r in IngestManifestRepository().get_by_paths(e["path"] for e in entries).values()} == {2}
+
+
+def test_force_reprocesses_unchanged_files(session, library):
+    entries = list(scan_directory(str(library)))
+    _ingester(session, IngestCheckpoint(), manifest=True).run(entries)
+    stats = _ingester(session, IngestCheckpoint(), manifest=True, force=True).run(entries)
+    assert stats["ingested"] == 3 and stats["unchanged"] == 0
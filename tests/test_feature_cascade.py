@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from core.reco.cascade import COARSE_FEATURE_DIM, CascadeSearchEngine
+from core.reco.engine import RecommenderEngine, build_cascade
+from core.reco.features import extract_features, extract_lightweight_features
+from core.reco.feature_store import FeatureStore
+from core.reco.search import FEATURE_DIM, STRATEGY_FEATURE_WEIGHTS, FeatureSearchEngine
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(46)
+    styles = rng.normal(size=(40, FEATURE_DIM))
+    features = {song_id: styles[song_id % 40] + 0.4 * rng.normal(size=FEATURE_DIM) for song_id in range(1, 5001)}
+    features[5001] = rng.normal(size=30)  # legacy shorter vector
+    features[5002] = np.array([])
+    return features
+
+
+def test_full_shortlist_equals_single_stage(catalog):
+    exact = FeatureSearchEngine(catalog)
+    cascade = CascadeSearchEngine(catalog, shortlist=len(catalog))
+    for song_id in (1, 77, 4999):
+        query = catalog[song_id] * 1.2
+        assert cascade.search(query, k=10, threshold=0.3) == exact.search(query, k=10, threshold=0.3)
+    short_query = catalog[5001] * 0.9
+    assert cascade.search(short_query, k=5) == exact.search(short_query, k=5)
+
+
+def test_shortlist_keeps_the_true_neighbours(catalog):
+    exact = FeatureSearchEngine(catalog, STRATEGY_FEATURE_WEIGHTS)
+    cascade = CascadeSearchEngine(catalog, STRATEGY_FEATURE_WEIGHTS, shortlist=300)
+    rng = np.random.default_rng(1)
+    hits = 0
+    for song_id in rng.integers(1, 5001, 30):
+        query = catalog[int(song_id)] + 0.3 * rng.normal(size=FEATURE_DIM)
+        expected = {sid for sid, _ in exact.search(query, k=10)}
+        found = cascade.search(query, k=10)
+        hits += len(expected & {sid for sid, _ in found})
+    assert hits / 300 >= 0.9
+    # The legacy vector skips the coarse stage and is always fine-scored
+    legacy_query = np.concatenate([catalog[5001], np.zeros(FEATURE_DIM - 30)])
+    assert cascade.search(legacy_query, k=1)[0] == (5001, pytest.approx(1.0))
+    assert cascade._coarse.dtype == np.float32 and cascade._coarse.shape == (5000, COARSE_FEATURE_DIM)
+    assert cascade._fine.shape == (5000, FEATURE_DIM)
+    compact = CascadeSearchEngine(catalog, STRATEGY_FEATURE_WEIGHTS, shortlist=300, dtype="float16")
+    assert compact._coarse.nbytes * 2 == cascade._coarse.nbytes
+    assert compact.search(query, k=10) == cascade.search(query, k=10)
+
+
+def test_recommender_and_store_use_the_cascade(catalog):
+    feature_map = {sid: vec for sid, vec in catalog.items() if len(vec) == FEATURE_DIM}
+    exact = RecommenderEngine(feature_map)
+    approx = RecommenderEngine(feature_map, cascade=build_cascade(feature_map, shortlist=len(feature_map)))
+    recs = approx.recommend(12, top_n=5)
+    assert [sid for sid, _ in recs] == [sid for sid, _ in exact.recommend(12, top_n=5)]
+    assert 12 not in [sid for sid, _ in recs]
+
+    class Repository:
+        def get_features_since(self, since=None):
+            return dict(catalog), None
+
+        def count(self):
+            return len(catalog)
+
+    store = FeatureStore(Repository(), refresh_seconds=3600)
+    assert isinstance(store.engine(cascade=True), CascadeSearchEngine)
+    assert isinstance(store.engine(cascade=False), FeatureSearchEngine)
+    assert store.engine(cascade=True) is store.engine(cascade=True)
+
+
+def test_coarse_features_are_the_lightweight_features(tmp_path):
+    sr = 22050
+    t = np.arange(sr * 4) / sr
+    rng = np.random.default_rng(3)
+    y = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 587 * t) + 0.1 * rng.standard_normal(t.size)
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, y.astype(np.float32), sr)
+    # The coarse stage reads this prefix of the stored vectors
+    assert np.array_equal(extract_features(path)[:COARSE_FEATURE_DIM], extract_lightweight_features(path))
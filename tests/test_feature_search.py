@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from core.fingerprint.threshold import SimilarityMatchStrategy
+from core.reco.search import (
+    FEATURE_DIM,
+    STRATEGY_FEATURE_WEIGHTS,
+    FeatureSearchEngine,
+    weighted_cosine_similarity,
+)
+from worker.tasks import _compute_weighted_cosine_similarity
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(43)
+    base = rng.normal(size=(40, FEATURE_DIM))
+    features = {}
+    for song_id in range(1, 3001):
+        # Songs cluster around a few "styles", so many scores are close
+        features[song_id * 7] = base[song_id % 40] + 0.3 * rng.normal(size=FEATURE_DIM)
+    features[5] = np.zeros(FEATURE_DIM)  # silent track
+    features[6] = features[7].copy()  # exact duplicate: a tie
+    features[8] = rng.normal(size=30)  # legacy shorter vector
+    features[9] = np.array([])
+    return features
+
+
+def _loop(query, features, threshold, k, similarity=_compute_weighted_cosine_similarity):
+    """The worker's original per-song loop."""
+    similarities = [(song_id, similarity(query, stored)) for song_id, stored in features.items()]
+    filtered = [(sid, sim) for sid, sim in similarities if sim >= threshold]
+    filtered.sort(key=lambda x: x[1], reverse=True)
+    return filtered[:k]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_search_equals_the_per_song_loop(catalog, seed):
+    rng = np.random.default_rng(seed)
+    query = catalog[7 * (seed + 1)] + 0.5 * rng.normal(size=FEATURE_DIM)
+    engine = FeatureSearchEngine(catalog)
+    for threshold, k in ((0.3, 10), (-1.0, 25), (0.99, 10)):
+        assert engine.search(query, k=k, threshold=threshold) == _loop(query, catalog, threshold, k)
+
+
+def test_ties_keep_catalog_order(catalog):
+    engine = FeatureSearchEngine(catalog)
+    results = engine.search(catalog[7], k=2, threshold=0.3)
+    assert [song_id for song_id, _ in results] == [7, 6]
+
+
+def test_short_query_and_empty_inputs(catalog):
+    engine = FeatureSearchEngine(catalog)
+    short_query = np.random.default_rng(1).normal(size=20)
+    assert engine.search(short_query, k=10, threshold=0.0) == _loop(short_query, catalog, 0.0, 10)
+    assert engine.search(np.array([]), k=5, threshold=0.3) == []
+    assert FeatureSearchEngine({}).search(catalog[7]) == []
+
+
+def test_strategy_weight_profile(catalog):
+    query = catalog[14] * 1.1
+    strategy = SimilarityMatchStrategy()
+    assert weighted_cosine_similarity(query, catalog[21], STRATEGY_FEATURE_WEIGHTS) == \
+        strategy._compute_weighted_cosine_similarity(query, catalog[21])
+    engine = FeatureSearchEngine(catalog, STRATEGY_FEATURE_WEIGHTS)
+    assert engine.search(query, k=10, threshold=0.5) == _loop(
+        query, catalog, 0.5, 10, similarity=strategy._compute_weighted_cosine_similarity)
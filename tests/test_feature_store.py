@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+
+from core.reco import feature_store
+from core.reco.feature_store import FeatureStore
+from core.repository.song_feature_repository import SongFeatureRepository
+from db.nosql.collections import SongFeature, encode_feature_vector
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    SongFeature.drop_collection()
+    mongoengine.disconnect()
+
+
+class CountingRepository(SongFeatureRepository):
+    def __init__(self):
+        self.calls = []
+
+    def get_features_since(self, since=None):
+        features, latest = super().get_features_since(since)
+        self.calls.append((since, len(features)))
+        return features, latest
+
+
+@pytest.fixture
+def repo():
+    SongFeature.drop_collection()
+    repo = CountingRepository()
+    rng = np.random.default_rng(44)
+    repo.bulk_upsert({song_id: rng.normal(size=55) for song_id in range(1, 51)})
+    # A catalog written over the last few hours, one song every two minutes
+    now = datetime.utcnow()
+    for song_id in range(1, 51):
+        SongFeature._get_collection().update_one(
+            {"song_id": song_id}, {"$set": {"updated_at": now - timedelta(hours=1, minutes=2 * song_id)}}
+        )
+    return repo
+
+
+def test_loads_once_until_refresh_is_due(repo):
+    store = FeatureStore(repo, refresh_seconds=3600)
+    features = store.features()
+    assert len(features) == 50 and store.version == 1
+    store.features()
+    store.engine()
+    assert len(repo.calls) == 1
+    for song_id, vector in SongFeatureRepository().get_all_features().items():
+        assert np.array_equal(features[song_id], vector)
+
+
+def test_refresh_pulls_only_changed_vectors(repo):
+    store = FeatureStore(repo, refresh_seconds=0)
+    old = store.features()
+    old_engine = store.engine()
+    repo.calls.clear()
+
+    assert store.refresh() is False
+    assert store.version == 1
+
+    repo.bulk_upsert({7: np.ones(55), 51: np.full(55, 2.0)})
+    assert store.refresh() is True
+    assert store.version == 2
+    since, pulled = repo.calls[-1]
+    # The two writes, plus the latest catalog song inside the clock-skew window
+    assert since is not None and pulled == 3
+    assert np.array_equal(store.features()[7], np.ones(55))
+    assert 51 in store.features()
+    # Earlier snapshots are left alone
+    assert 51 not in old and not np.array_equal(old[7], np.ones(55))
+    assert store.engine() is not old_engine
+    assert store.engine().search(np.ones(55), k=1) == [(7, pytest.approx(1.0))]
+
+
+def test_deletions_trigger_a_full_reload(repo):
+    store = FeatureStore(repo, refresh_seconds=0)
+    store.features()
+    SongFeature.objects(song_id=3).delete()
+    assert store.refresh() is True
+    assert 3 not in store.features()
+    assert store.stats()["full_loads"] == 2
+
+
+def test_clock_skewed_writes_are_not_missed(repo):
+    store = FeatureStore(repo, refresh_seconds=0)
+    store.features()
+    # A writer whose clock is behind the watermark
+    raw, _, _ = encode_feature_vector(np.full(55, 0.5))
+    SongFeature._get_collection().update_one(
+        {"song_id": 9}, {"$set": {"vector": raw, "updated_at": store.watermark - timedelta(seconds=10)}}
+    )
+    assert store.refresh() is True
+    assert np.array_equal(store.features()[9], np.full(55, 0.5))
+
+
+def test_process_store_is_shared(monkeypatch, repo):
+    monkeypatch.setattr(feature_store, "_store", None)
+    assert feature_store.get_feature_store() is feature_store.get_feature_store()
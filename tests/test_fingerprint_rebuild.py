@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+from scipy.io.wavfile import write as wav_write
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from core.fingerprint import extractor, rebuild, versions
+from core.fingerprint.extractor import FingerPrinter, extract_fingerprint
+from core.fingerprint.rebuild import RebuildJob
+from core.repository import fingerprint_repository
+from core.repository.fingerprint_repository import get_fingerprint_repository
+from core.repository.ingest_manifest_repository import IngestManifestRepository
+from core.repository.rebuild_progress_repository import RebuildProgressRepository
+from db.nosql.collections import IndexState, IngestManifest, RebuildProgress, fingerprint_document
+from db.sql.models import Base, Artist, Song
+
+SR = FingerPrinter.SAMPLE_RATE
+
+
+class V2(FingerPrinter):
+    MAX_PAIRS_PER_PEAK = 5
+    ALGORITHM_VERSION = 2
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    for document in (IndexState, IngestManifest, RebuildProgress, fingerprint_document(2)):
+        document.drop_collection()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """Five songs in SQL; songs 1-4 have source files in the ingest manifest, song 5 has none."""
+    monkeypatch.setitem(extractor.ALGORITHMS, 2, V2)
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "mongo")
+    monkeypatch.setattr(versions, "_state", None)
+    for document in (IndexState, IngestManifest, RebuildProgress, fingerprint_document(2)):
+        document.drop_collection()
+    versions.start_build(2)
+
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    artist = Artist(name="Rebuild Artist")
+    session.add(artist)
+    session.commit()
+    records = []
+    for song_id in range(1, 6):
+        session.add(Song(id=song_id, title=f"Song {song_id}", artist_id=artist.id))
+        if song_id < 5:
+            path = tmp_path / f"song{song_id}.wav"
+            y = 0.5 * np.random.default_rng(song_id).uniform(-1, 1, SR * 3)
+            wav_write(str(path), SR, (y * 32767).astype(np.int16))
+            records.append({"song_id": song_id, "source_path": str(path), "content_hash": str(song_id)})
+    session.commit()
+    IngestManifestRepository().record_many(records)
+    yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+
+
+def _job(session, **kwargs):
+    options = dict(session=session, batch_size=2, max_workers=2, nice=0, pool_kind="thread")
+    options.update(kwargs)
+    return RebuildJob(2, **options)
+
+
+def test_rebuild_enumerates_the_catalog(catalog):
+    assert [song_id for song_id, _ in _job(catalog).songs()] == [1, 2, 3, 4, 5]
+
+    stats = _job(catalog).run()
+
+    assert (stats["songs"], stats["failed"], stats["skipped"]) == (4, 1, 0)
+    repo = get_fingerprint_repository(2)
+    assert repo.song_count() == 4
+    path = IngestManifest.objects.get(song_id=3).source_path
+    assert repo.count_by_song_id(3) == len(extract_fingerprint(path, 2))
+    progress = RebuildProgressRepository(2)
+    assert progress.counts() == {"done": 4, "failed": 1}
+    assert progress.failed()[0]["song_id"] == 5
+
+
+class CrashingRepository:
+    """Index that dies on its second batch, like a killed job."""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.calls = 0
+
+    def store_many(self, fingerprints_by_song):
+        self.calls += 1
+        if self.calls == 2:
+            raise KeyboardInterrupt
+        return self.repository.store_many(fingerprints_by_song)
+
+
+def test_rebuild_resumes_after_a_crash(catalog):
+    with pytest.raises(KeyboardInterrupt):
+        _job(catalog, repository=CrashingRepository(get_fingerprint_repository(2))).run()
+    assert RebuildProgressRepository(2).counts()["done"] == 2
+
+    stats = _job(catalog).run()
+
+    assert (stats["songs"], stats["skipped"]) == (2, 2)
+    assert get_fingerprint_repository(2).song_count() == 4
+
+
+def test_rebuild_is_throttled(catalog, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rebuild.time, "sleep", sleeps.append)
+
+    _job(catalog, pause_seconds=0.5).run()
+    assert sleeps == [0.5, 0.5, 0.5]
+
+    sleeps.clear()
+    RebuildProgressRepository(2).reset()
+    _job(catalog, max_songs_per_minute=60).run()
+    # Two songs per batch at one song per second
+    assert len(sleeps) == 3 and all(s > 1 for s in sleeps)
+
+
+def test_rebuild_refuses_the_serving_index(catalog):
+    with pytest.raises(ValueError):
+        RebuildJob(1, session=catalog)
@@ -0,0 +1,240 @@
+﻿import os
+
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+from scipy.io.wavfile import write as wav_write
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from core.cache import recognition as recognition_cache
+from core.cache.recognition import NullRecognitionCache
+from core.fingerprint import extractor, shadow, versions
+from core.fingerprint.extractor import FingerPrinter, extract_fingerprint, get_algorithm
+from core.fingerprint.wire import IncompatibleFingerprints, decode_fingerprints, encode_fingerprints
+from core.repository import fingerprint_repository
+from core.repository.fingerprint_repository import FingerprintRepository, get_fingerprint_repository
+from db.nosql.collections import IndexState, ShadowComparison, fingerprint_document
+from db.sql.models import Base, Artist, Song
+from worker import tasks
+
+SR = FingerPrinter.SAMPLE_RATE
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    for version in (1, 2):
+        fingerprint_document(version).drop_collection()
+    mongoengine.disconnect()
+
+
+class V2(FingerPrinter):
+    MAX_PAIRS_PER_PEAK = 5
+    ALGORITHM_VERSION = 2
+
+
+@pytest.fixture(autouse=True)
+def v2(monkeypatch):
+    monkeypatch.setitem(extractor.ALGORITHMS, 2, V2)
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "mongo")
+    monkeypatch.setattr(versions, "_state", None)
+    monkeypatch.setattr(recognition_cache, "_cache", NullRecognitionCache())
+    for document in (IndexState, ShadowComparison, fingerprint_document(1), fingerprint_document(2)):
+        document.drop_collection()
+    yield V2
+
+
+def _write_song(path, seed, seconds=12):
+    rng = np.random.default_rng(seed)
+    t = np.arange(SR * seconds) / SR
+    freqs = rng.uniform(200, 3000, size=4)
+    tones = sum(np.sin(2 * np.pi * f * t * (1 + 0.05 * np.sin(t * (i + 1)))) for i, f in enumerate(freqs))
+    samples = 0.15 * tones + 0.1 * rng.standard_normal(t.size)
+    wav_write(str(path), SR, (samples * 32767 / np.abs(samples).max()).astype(np.int16))
+    return str(path)
+
+
+@pytest.fixture
+def songs(tmp_path):
+    return {song_id: _write_song(tmp_path / f"song{song_id}.wav", song_id) for song_id in (1, 2)}
+
+
+def test_unknown_version_is_rejected():
+    assert get_algorithm() is FingerPrinter
+    assert get_algorithm(2) is V2
+    with pytest.raises(ValueError):
+        get_algorithm(3)
+    with pytest.raises(ValueError):
+        versions.start_build(3)
+    with pytest.raises(ValueError):
+        versions.switch_active_version(3)
+
+
+def test_versions_have_separate_indexes(songs):
+    v1 = get_fingerprint_repository(1)
+    v2 = get_fingerprint_repository(2)
+    v1.store_spectral_fingerprints(1, extract_fingerprint(songs[1], 1))
+    assert v1.song_count() == 1
+    assert v2.count() == 0
+    # Version 1 keeps the collection it always had
+    assert FingerprintRepository().documents._get_collection_name() == "fingerprints"
+    assert v2.documents._get_collection_name() == "fingerprints_v2"
+
+
+def test_build_dual_writes_and_backfills(songs):
+    tasks.store_fingerprint(songs[1], 1)
+    assert get_fingerprint_repository(2).count() == 0
+
+    state = versions.start_build(2)
+    assert state == {"active_version": 1, "building_version": 2, "previous_version": None}
+    assert versions.serving_versions() == [1, 2]
+
+    # Stored from now on: both indexes
+    tasks.store_fingerprint(songs[2], 2)
+    assert get_fingerprint_repository(1).count_by_song_id(2) > 0
+    assert get_fingerprint_repository(2).count_by_song_id(2) == len(extract_fingerprint(songs[2], 2))
+
+    # Stored before: the backfill
+    stats = versions.backfill_index(2, [(1, songs[1]), (3, "missing.wav")], batch_size=1)
+    assert stats == {"songs": 1, "fingerprints": len(extract_fingerprint(songs[1], 2)), "failed": 1}
+    assert get_fingerprint_repository(2).song_count() == 2
+
+
+def test_switch_and_rollback():
+    versions.start_build(2)
+    state = versions.switch_active_version(2)
+    assert state == {"active_version": 2, "building_version": None, "previous_version": 1}
+    assert versions.get_active_version() == 2
+    assert versions.serving_versions() == [2]
+
+    state = versions.switch_active_version(state["previous_version"])
+    assert state == {"active_version": 1, "building_version": None, "previous_version": 2}
+
+
+def test_state_survives_a_read_failure(monkeypatch):
+    versions.switch_active_version(2)
+
+    def broken():
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(IndexState, "_get_collection", broken)
+    assert versions.get_active_version(refresh=True) == 2
+
+
+@pytest.fixture
+def catalog(monkeypatch, songs):
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(tasks, "get_db", lambda: iter([Session()]))
+    session = Session()
+    artist = Artist(name="Version Artist")
+    session.add(artist)
+    session.commit()
+    for song_id in songs:
+        session.add(Song(id=song_id, title=f"Song {song_id}", artist_id=artist.id))
+    session.commit()
+    session.close()
+    yield songs
+    Base.metadata.drop_all(engine)
+
+
+def _clip(tmp_path, path, start, seconds=5):
+    from scipy.io.wavfile import read as wav_read
+
+    _, samples = wav_read(path)
+    out = tmp_path / f"clip-{start}.wav"
+    wav_write(str(out), SR, samples[start * SR:(start + seconds) * SR])
+    return str(out)
+
+
+def test_queries_follow_the_active_version(catalog, tmp_path):
+    versions.start_build(2)
+    for song_id, path in catalog.items():
+        tasks.store_fingerprint(path, song_id)
+    versions.switch_active_version(2)
+
+    # Only the v2 index can answer now
+    fingerprint_document(1).drop_collection()
+    result = tasks.recognize_audio_task(_clip(tmp_path, catalog[2], 3))
+    assert result["status"] == "SUCCESS"
+    assert result["results"][0]["song_id"] == 2
+
+    # Client-side hashes must come from the active algorithm
+    v1_message = encode_fingerprints([("00000000000000aa", 1)])
+    with pytest.raises(IncompatibleFingerprints):
+        decode_fingerprints(v1_message, version=versions.get_active_version())
+    v2_message = encode_fingerprints([("00000000000000aa", 1)], algorithm_version=2,
+                                     params_signature=V2.params_signature())
+    assert decode_fingerprints(v2_message, version=2) == [("00000000000000aa", 1)]
+    # Without an explicit signature, the declared version's own parameters are used
+    assert encode_fingerprints([("00000000000000aa", 1)], algorithm_version=2) == v2_message
+
+
+def test_shadow_comparison_report(catalog, tmp_path):
+    versions.start_build(2)
+    for song_id, path in catalog.items():
+        tasks.store_fingerprint(path, song_id)
+
+    matcher = shadow.ShadowMatcher(1, 2)
+    for song_id, path in catalog.items():
+        shadow.record_comparison(matcher.compare_file(_clip(tmp_path, path, 4), expected_song_id=song_id))
+
+    report = shadow.shadow_report(1, 2)
+    assert report["clips"] == report["labelled"] == 2
+    assert report["agreement"] == 1.0
+    assert report["active"]["accuracy"] == report["candidate"]["accuracy"] == 1.0
+    assert report["candidate"]["version"] == 2
+    assert report["candidate"]["p95_ms"] >= report["candidate"]["p50_ms"] > 0
+
+
+def test_live_traffic_is_shadowed_while_building(catalog, tmp_path, monkeypatch):
+    versions.start_build(2)
+    for song_id, path in catalog.items():
+        tasks.store_fingerprint(path, song_id)
+    monkeypatch.setattr(shadow, "FINGERPRINT_SHADOW_SAMPLE_RATE", 1.0)
+    queued = []
+    monkeypatch.setattr(tasks.shadow_compare_task, "apply_async",
+                        lambda args, **options: queued.append((args, options)))
+
+    clip = _clip(tmp_path, catalog[1], 2)
+    result = tasks.recognize_audio_task(clip)
+    assert result["results"][0]["song_id"] == 1
+    # The live result does not wait for the candidate version
+    assert ShadowComparison.objects.count() == 0
+    (args, options), = queued
+    assert options["priority"] == tasks.SHADOW_TASK_PRIORITY
+    assert args[1:] == (1, 2) and args[0] != clip
+
+    tasks.shadow_compare_task(*args)
+    assert not os.path.exists(args[0])
+    comparison = ShadowComparison.objects.get()
+    assert (comparison.active_version, comparison.candidate_version) == (1, 2)
+    assert comparison.active_song_id == comparison.candidate_song_id == 1
+
+
+def test_store_fingerprint_reports_every_version(songs, monkeypatch):
+    versions.start_build(2)
+    original = tasks.extract_fingerprint_segmented
+
+    def v1_finds_nothing(path, version=None):
+        return [] if version == 1 else original(path, version=version)
+
+    monkeypatch.setattr(tasks, "extract_fingerprint_segmented", v1_finds_nothing)
+
+    message = tasks.store_fingerprint(songs[1], 1)
+    assert "0 (v1, none extracted)" in message
+    assert get_fingerprint_repository(2).count_by_song_id(1) == len(extract_fingerprint(songs[1], 2))
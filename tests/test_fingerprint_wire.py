@@ -0,0 +1,134 @@
+import random
+
+import pytest
+import mongoengine
+import mongomock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api.v1 import recognition as recognition_api
+from core.cache import recognition as recognition_cache
+from core.cache.recognition import NullRecognitionCache
+from core.fingerprint.extractor import FingerPrinter
+from core.fingerprint.wire import (
+    HEADER_SIZE,
+    IncompatibleFingerprints,
+    WireFormatError,
+    decode_fingerprints,
+    encode_fingerprints,
+)
+from core.repository.fingerprint_repository import FingerprintRepository
+from db.nosql.collections import Fingerprint
+from db.sql.models import Base, Artist, Song
+from worker import tasks
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+def _landmarks(seed, count=300):
+    rng = random.Random(seed)
+    return [(f"{rng.getrandbits(64):016x}", offset) for offset in range(count)]
+
+
+def test_round_trip_preserves_fingerprints():
+    fingerprints = _landmarks(1) + [("0000000000000000", 0), ("ffffffffffffffff", 2 ** 32 - 1)]
+    message = encode_fingerprints(fingerprints)
+    assert len(message) == HEADER_SIZE + 12 * len(fingerprints)
+    assert decode_fingerprints(message) == fingerprints
+
+
+def test_incompatible_extractor_is_rejected():
+    with pytest.raises(IncompatibleFingerprints):
+        decode_fingerprints(encode_fingerprints(_landmarks(1), algorithm_version=FingerPrinter.ALGORITHM_VERSION + 1,
+                                                params_signature=FingerPrinter.params_signature()))
+    with pytest.raises(IncompatibleFingerprints):
+        decode_fingerprints(encode_fingerprints(_landmarks(1), params_signature=FingerPrinter.params_signature() ^ 1))
+
+
+@pytest.mark.parametrize("message", [
+    b"",
+    b"RIFF" + bytes(12),
+    encode_fingerprints(_landmarks(1))[:-1],
+])
+def test_malformed_messages_are_rejected(message):
+    with pytest.raises(WireFormatError):
+        decode_fingerprints(message)
+
+
+def test_record_limit():
+    with pytest.raises(WireFormatError):
+        decode_fingerprints(encode_fingerprints(_landmarks(1, 10)), max_count=5)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(tasks, "get_db", lambda: iter([Session()]))
+    monkeypatch.setattr(recognition_cache, "_cache", NullRecognitionCache())
+
+    session = Session()
+    artist = Artist(name="Wire Artist")
+    session.add(artist)
+    session.commit()
+    song = Song(title="Wire Song", artist_id=artist.id)
+    session.add(song)
+    session.commit()
+
+    Fingerprint.drop_collection()
+    FingerprintRepository().store_spectral_fingerprints(song.id, _landmarks(7))
+    session.close()
+
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    yield TestClient(app), song.id
+    Base.metadata.drop_all(engine)
+
+
+def _post(client, message):
+    return client.post("/recognize/hashes", content=message,
+                       headers={"Content-Type": "application/x-tuneleap-fingerprints"})
+
+
+def test_hashes_endpoint_matches_without_extraction(client, monkeypatch):
+    client, song_id = client
+    monkeypatch.setattr(tasks, "extract_fingerprint", lambda path: pytest.fail("no extraction expected"))
+    # The clip starts 100 frames into the song
+    query = [(h, t - 100) for h, t in _landmarks(7)[100:160]]
+
+    resp = _post(client, encode_fingerprints(query))
+
+    assert resp.status_code == 200
+    assert resp.json()["results"][0]["song_id"] == song_id
+    assert resp.json()["results"][0]["title"] == "Wire Song"
+
+
+def test_hashes_endpoint_status_codes(client):
+    client, _ = client
+    assert _post(client, encode_fingerprints(_landmarks(99, 50))).status_code == 404
+    assert _post(client, b"not a fingerprint message").status_code == 400
+    stale = encode_fingerprints(_landmarks(7), algorithm_version=FingerPrinter.ALGORITHM_VERSION + 1,
+                                params_signature=FingerPrinter.params_signature())
+    assert _post(client, stale).status_code == 409
+
+    version = client.get("/recognize/hashes/version").json()
+    assert version["algorithm_version"] == FingerPrinter.ALGORITHM_VERSION
@@ -0,0 +1,227 @@
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+
+from core.fingerprint import threshold
+from core.fingerprint.matcher import FingerprintMatcher
+from core.fingerprint.threshold import (
+    ExactMatchStrategy,
+    FeatureBasedMatchStrategy,
+    HybridMatchStrategy,
+    SimilarityMatchStrategy,
+)
+from core.reco import feature_store
+from core.reco.feature_store import FeatureStore
+from core.repository import fingerprint_repository
+from core.repository.fingerprint_repository import FingerprintRepository
+from db.nosql.collections import Fingerprint
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    Fingerprint.drop_collection()
+    for song_id, hashes in ((1, ["a", "b", "a"]), (2, ["a", "c"]), (3, ["d"] * 400)):
+        for offset, fp_hash in enumerate(hashes):
+            Fingerprint(song_id=song_id, hash=fp_hash, time_offset=offset).save()
+
+    rng = np.random.default_rng(47)
+    features = {song_id: rng.normal(size=55) for song_id in range(1, 21)}
+
+    class Repository:
+        def get_features_since(self, since=None):
+            return dict(features), None
+
+        def count(self):
+            return len(features)
+
+    monkeypatch.setattr(feature_store, "_store", FeatureStore(Repository(), refresh_seconds=3600))
+    # Clip features close to song 3's
+    query = features[3] + 0.05 * rng.normal(size=55)
+    for strategy in (SimilarityMatchStrategy, FeatureBasedMatchStrategy):
+        monkeypatch.setattr(strategy, "_extract_query_features", lambda self, path: query)
+    return features
+
+
+def test_exact_scores_count_fingerprints_per_song(catalog):
+    assert ExactMatchStrategy().get_scores("a") == {1: 2, 2: 1}
+    assert ExactMatchStrategy().get_scores("zzz") == {}
+    assert FingerprintMatcher().match("a") == {1: 2, 2: 1}
+
+
+def test_feature_scores_do_not_load_fingerprints(catalog, monkeypatch):
+    class NoFingerprints:
+        objects = None
+
+    with monkeypatch.context() as m:
+        m.setattr(threshold, "Fingerprint", NoFingerprints)
+        scores = FeatureBasedMatchStrategy(similarity_threshold=0.9, max_results=3).get_scores("zzz", "clip.wav")
+    assert list(scores) == [3] and scores[3] == pytest.approx(1.0, abs=0.01)
+
+    # Song 3 has 400 fingerprints, but scores no longer depend on that
+    hybrid = FingerprintMatcher(HybridMatchStrategy(similarity_threshold=0.9))
+    assert hybrid.match("zzz", "clip.wav") == scores
+    assert FeatureBasedMatchStrategy().get_scores("zzz") == {}
+
+
+def test_hybrid_prefers_exact_scores(catalog):
+    assert FingerprintMatcher(HybridMatchStrategy()).match("c", "clip.wav") == {2: 1}
+
+
+def test_similarity_strategy_scores_and_matches(catalog):
+    strategy = SimilarityMatchStrategy(similarity_threshold=0.9)
+    assert list(strategy.get_scores("zzz", "clip.wav")) == [3]
+    matches = strategy.get_matches("zzz", "clip.wav")
+    assert len(matches) == 400 and {fp.song_id for fp in matches} == {3}
+
+
+def test_matcher_accepts_hash_only_strategies(catalog):
+    class LegacyStrategy(threshold.ThresholdStrategy):
+        def get_matches(self, fp_hash):
+            return list(Fingerprint.objects(hash=fp_hash))
+
+    matcher = FingerprintMatcher(LegacyStrategy())
+    assert matcher.match("a") == {1: 2, 2: 1}
+    assert matcher.match_batch(["a", "c"]) == {1: 2, 2: 2}
+
+
+def test_batch_is_one_lookup_and_sums_single_hashes(catalog, monkeypatch):
+    hashes = ["a", "b", "a", "c", "missing"]
+    expected = {}
+    for fp_hash in hashes:
+        for song_id, score in FingerprintMatcher().match(fp_hash).items():
+            expected[song_id] = expected.get(song_id, 0) + score
+
+    queries = []
+    original = FingerprintRepository.get_fingerprints_by_hashes
+
+    def counting(self, hashes):
+        queries.append(hashes)
+        return original(self, hashes)
+
+    monkeypatch.setattr(FingerprintRepository, "get_fingerprints_by_hashes", counting)
+    assert FingerprintMatcher().match_batch(hashes) == expected
+    assert len(queries) == 1
+    assert FingerprintMatcher().match_batch([]) == {}
+
+
+def test_exact_lookup_uses_the_active_fingerprint_index(catalog, monkeypatch, tmp_path):
+    from core.fingerprint import versions
+
+    # SQLite backend: the Mongo collection is never read
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "sqlite")
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_SQLITE_PATH", str(tmp_path / "fingerprints.sqlite3"))
+    monkeypatch.setattr(fingerprint_repository, "_sqlite_repositories", {})
+    monkeypatch.setattr(versions, "get_active_version", lambda refresh=False: 2)
+    monkeypatch.setattr(threshold, "get_active_version", lambda refresh=False: 2)
+    fingerprint_repository.get_fingerprint_repository(2).store_spectral_fingerprints(7, [("c", 0), ("c", 5)])
+    assert FingerprintMatcher().match_batch(["a", "c"]) == {7: 2}
+
+    # Mongo backend: the versioned collection of the active algorithm
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "mongo")
+    fingerprint_repository.get_fingerprint_repository(2).store_spectral_fingerprints(8, [("a", 0)])
+    try:
+        assert FingerprintMatcher().match_batch(["a", "c"]) == {8: 1}
+        assert ExactMatchStrategy(version=1).get_batch_scores(["a", "c"]) == {1: 2, 2: 2}
+    finally:
+        fingerprint_repository.fingerprint_document(2).drop_collection()
+
+
+def test_batch_with_offsets_votes_on_time_alignment(catalog):
+    # Song 1 stores a@0, b@1, a@2; a clip starting one frame in sees b@0, a@1
+    scores = FingerprintMatcher().match_batch(["b", "a"], offsets=[0, 1])
+    assert scores == {1: 2, 2: 1}
+    scores = FingerprintMatcher(HybridMatchStrategy()).match_batch(["d", "d"], offsets=[0, 1], query_file_path="clip.wav")
+    assert scores == {3: 2}
+
+
+def _counting_lookups(monkeypatch, strategy):
+    lookups = []
+    original = strategy.exact_strategy.lookup
+
+    def lookup(hashes):
+        lookups.append(len(hashes))
+        return original(hashes)
+
+    monkeypatch.setattr(strategy.exact_strategy, "lookup", lookup)
+    return lookups
+
+
+def test_hybrid_exits_early_on_a_decisive_lead(catalog, monkeypatch):
+    strategy = HybridMatchStrategy(decisive_votes=10, decisive_margin=0.5, chunk_size=8)
+    lookups = _counting_lookups(monkeypatch, strategy)
+    # 40 hashes of song 3 in time order: its votes pile up on one time difference
+    report = strategy.run(["d"] * 40, offsets=list(range(40)))
+    assert report["early_exit"] is True and report["stage"] == "landmark"
+    assert len(lookups) == 2 and report["scores"] == {3: 16}
+    assert set(report["timings_ms"]) == {"landmark"}
+
+    # No decisive lead: every chunk is looked up, with the same result as one batch
+    lookups.clear()
+    hashes, offsets = ["a", "b", "c", "a"] * 5, list(range(20))
+    report = strategy.run(hashes, offsets)
+    assert report["early_exit"] is False and len(lookups) == 3
+    assert report["scores"] == ExactMatchStrategy().get_batch_scores(hashes, offsets)
+
+
+def test_hybrid_feature_stage_needs_budget(catalog, monkeypatch):
+    extracted = []
+    monkeypatch.setattr(FeatureBasedMatchStrategy, "_extract_query_features",
+                        lambda self, path: extracted.append(path) or catalog[3])
+
+    report = HybridMatchStrategy(total_budget_ms=100, feature_budget_ms=500).run(["zzz"], None, "clip.wav")
+    assert report["skipped"] == ["features"] and report["scores"] == {} and not extracted
+
+    report = HybridMatchStrategy(similarity_threshold=0.9).run(["zzz"], None, "clip.wav")
+    assert report["stage"] == "features" and list(report["scores"]) == [3]
+    assert set(report["timings_ms"]) == {"landmark", "features"} and extracted == ["clip.wav"]
+
+
+def test_hybrid_feature_stage_stops_at_the_total_budget(catalog, monkeypatch):
+    import threading
+
+    release = threading.Event()
+    monkeypatch.setattr(FeatureBasedMatchStrategy, "_extract_query_features",
+                        lambda self, path: release.wait(5) and catalog[3])
+
+    strategy = HybridMatchStrategy(similarity_threshold=0.9, total_budget_ms=200, feature_budget_ms=0)
+    report = FingerprintMatcher(strategy).match_report(["zzz"], None, "clip.wav")
+    release.set()
+    assert report["timed_out"] == ["features"] and report["scores"] == {} and report["stage"] is None
+    assert sum(report["timings_ms"].values()) < 1000
+
+
+def test_match_report_returns_the_hybrid_report(catalog):
+    report = FingerprintMatcher(HybridMatchStrategy(similarity_threshold=0.9)).match_report(["zzz"], None, "clip.wav")
+    assert report["stage"] == "features" and list(report["scores"]) == [3]
+    assert set(report["timings_ms"]) == {"landmark", "features"}
+
+    report = FingerprintMatcher().match_report(["a", "c"])
+    assert report["scores"] == {1: 2, 2: 2} and report["timings_ms"] == {}
+
+
+def test_similarity_strategy_searches_the_catalog_once(catalog, monkeypatch):
+    searches = []
+    engine = feature_store.get_feature_store().engine(threshold.STRATEGY_FEATURE_WEIGHTS)
+    original = type(engine).search
+
+    def counting(self, *args, **kwargs):
+        searches.append(kwargs.get("k"))
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(engine), "search", counting)
+    assert list(SimilarityMatchStrategy(similarity_threshold=0.9).get_scores("zzz", "clip.wav")) == [3]
+    assert len(searches) == 1
@@ -0,0 +1,126 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from core.cache.lru import LRUTTLCache
+from core.repository import metadata_cache
+from core.repository.song_repository import SongRepository
+from core.repository.artist_repository import ArtistRepository
+from core.repository.album_repository import AlbumRepository
+from db.sql.models import Base, Artist, Album, Song
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sqlite_session():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def catalog(sqlite_session):
+    artist = Artist(name="Cached Artist")
+    sqlite_session.add(artist)
+    sqlite_session.commit()
+    album = Album(title="Cached Album", artist_id=artist.id, album_image="cover.jpg")
+    sqlite_session.add(album)
+    sqlite_session.commit()
+    song = Song(title="Cached Song", artist_id=artist.id, album_id=album.id)
+    sqlite_session.add(song)
+    sqlite_session.commit()
+    return artist, album, song
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUTTLCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_ttl_expires_entries():
+    clock = FakeClock()
+    cache = LRUTTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_zero_size_disables_cache():
+    cache = LRUTTLCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_details_served_from_cache_without_queries(sqlite_session, catalog):
+    _, _, song = catalog
+    repo = SongRepository(sqlite_session)
+    first = repo.get_details_by_ids([song.id])
+
+    statements = []
+    engine = sqlite_session.get_bind()
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        second = repo.get_details_by_ids([song.id])
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert second == first
+    assert statements == []
+    assert metadata_cache.song_cache.stats()["hits"] >= 1
+
+
+def test_update_invalidates_cached_snapshots(sqlite_session, catalog):
+    artist, album, song = catalog
+    song_repo = SongRepository(sqlite_session)
+    song_repo.get_details_by_ids([song.id])
+
+    ArtistRepository(sqlite_session).update(artist, name="Renamed Artist")
+    AlbumRepository(sqlite_session).update(album, album_image="new-cover.jpg")
+    song_repo.update(song, title="Renamed Song")
+
+    details = song_repo.get_details_by_ids([song.id])[song.id]
+    assert details["artist_name"] == "Renamed Artist"
+    assert details["album_image"] == "new-cover.jpg"
+    assert details["title"] == "Renamed Song"
+    assert song_repo.get_cached(song.id)["title"] == "Renamed Song"
+
+
+def test_delete_invalidates_cached_snapshot(sqlite_session, catalog):
+    _, _, song = catalog
+    repo = SongRepository(sqlite_session)
+    song_id = song.id
+    assert repo.get_cached(song_id) is not None
+
+    repo.delete(song)
+
+    assert repo.get_cached(song_id) is None
+    assert repo.get_details_by_ids([song_id]) == {}
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from core.fingerprint.batcher import MicroBatchRecognizer
+from core.fingerprint.extractor import FingerPrinter
+
+
+class RecordingRepository:
+    """In-memory index that records every lookup it serves."""
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.lookups = []
+        self.lock = threading.Lock()
+
+    def get_fingerprints_by_hashes(self, hashes):
+        with self.lock:
+            self.lookups.append(sorted(hashes))
+        return {h: self.postings[h] for h in hashes if h in self.postings}
+
+
+POSTINGS = {
+    "aa": [(1, 10), (2, 50)],
+    "bb": [(1, 11)],
+    "cc": [(2, 52)],
+    "dd": [(3, 7)],
+}
+
+QUERIES = [
+    [("aa", 0), ("bb", 1)],
+    [("aa", 0), ("cc", 2)],
+    [("dd", 3), ("zz", 4)],
+]
+
+
+def test_concurrent_queries_share_one_lookup_and_match_individually():
+    repo = RecordingRepository(POSTINGS)
+    batcher = MicroBatchRecognizer(repository=repo, max_wait_ms=500, max_batch_size=len(QUERIES))
+    try:
+        futures = [batcher.submit(query) for query in QUERIES]
+        results = [future.result(timeout=5) for future in futures]
+    finally:
+        batcher.close()
+
+    expected = [FingerPrinter().match_fingerprints(query, POSTINGS) for query in QUERIES]
+    assert results == expected
+    assert results[0] == {1: 2, 2: 1}
+    assert results[2] == {3: 1}
+    assert repo.lookups == [["aa", "bb", "cc", "dd", "zz"]]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_batch_size_limit_splits_lookups():
+    repo = RecordingRepository(POSTINGS)
+    batcher = MicroBatchRecognizer(repository=repo, max_wait_ms=500, max_batch_size=2)
+    try:
+        futures = [batcher.submit(query) for query in QUERIES]
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        batcher.close()
+
+    assert len(repo.lookups) == 2
+
+
+def test_lookup_failure_is_raised_to_every_caller():
+    class FailingRepository:
+        def get_fingerprints_by_hashes(self, hashes):
+            raise ConnectionError("index unavailable")
+
+    batcher = MicroBatchRecognizer(repository=FailingRepository(), max_wait_ms=50)
+    try:
+        futures = [batcher.submit(query) for query in QUERIES]
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(QUERIES[0])
@@ -0,0 +1,68 @@
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from api.v1 import recognition as recognition_api
+from core.cache import recognition as recognition_cache
+from core.cache.recognition import NullRecognitionCache
+from core.compute.pool import BoundedExecutor
+from core.fingerprint.extractor import extract_fingerprint, extract_fingerprint_from_pcm
+
+
+def _pcm(seconds, sr, seed=5):
+    rng = np.random.default_rng(seed)
+    return (0.5 * rng.uniform(-1, 1, int(sr * seconds)) * 32767).astype("<i2")
+
+
+@pytest.mark.parametrize("sr", [22050, 44100])
+def test_pcm_fingerprints_match_wav_decode(tmp_path, sr):
+    samples = _pcm(3, sr)
+    path = tmp_path / "clip.wav"
+    sf.write(str(path), samples, sr, subtype="PCM_16")
+    assert extract_fingerprint_from_pcm(samples.tobytes(), sr) == extract_fingerprint(str(path))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(recognition_cache, "_cache", NullRecognitionCache())
+    pool = BoundedExecutor(max_workers=1, kind="thread")
+    monkeypatch.setattr(recognition_api, "_sync_pool", pool)
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    yield TestClient(app)
+    pool.shutdown()
+
+
+def test_pcm_upload_sends_fingerprints_to_worker(client):
+    samples = _pcm(3, 22050)
+    with patch.object(recognition_api.recognize_fingerprints_task, "delay") as delay, \
+            patch.object(recognition_api.recognize_audio_task, "delay") as audio_delay:
+        delay.return_value.id = "task-pcm"
+        resp = client.post(
+            "/recognize/",
+            files={"file": ("clip.pcm", io.BytesIO(samples.tobytes()), "application/octet-stream")},
+            data={"format": "pcm_s16le", "sample_rate": "22050"},
+        )
+
+    assert resp.status_code == 202
+    assert resp.json() == {"task_id": "task-pcm"}
+    audio_delay.assert_not_called()
+    fingerprints = delay.call_args.args[0]
+    assert fingerprints == extract_fingerprint_from_pcm(samples.tobytes(), 22050)
+
+
+@pytest.mark.parametrize("data,body", [
+    ({"format": "pcm_f32le"}, b"\0\0"),
+    ({"format": "pcm_s16le", "sample_rate": "12345"}, b"\0\0"),
+    ({"format": "pcm_s16le"}, b"\0\0\0"),
+])
+def test_pcm_upload_rejects_bad_declarations(client, data, body):
+    with patch.object(recognition_api.recognize_fingerprints_task, "delay") as delay:
+        resp = client.post("/recognize/", files={"file": ("clip.pcm", io.BytesIO(body))}, data=data)
+    assert resp.status_code == 400
+    delay.assert_not_called()
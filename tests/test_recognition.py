@@ -126,7 +126,7 @@ def test_recognize_audio_not_found(client, mock_audio_file):
             mock_matcher_class.return_value = mock_matcher
             
             # Save temp file mock
-            with patch("api.v1.recognition.save_temp") as mock_save:
+            with patch("api.v1.recognition.save_temp_async") as mock_save:
                 mock_save.return_value = "temp_path"
                 
                 # Mock os path exists and remove
@@ -168,7 +168,7 @@ def test_recognize_audio_with_match(client, mock_audio_file):
                 mock_repo_class.return_value = mock_repo
                 
                 # Save temp file mock
-                with patch("api.v1.recognition.save_temp") as mock_save:
+                with patch("api.v1.recognition.save_temp_async") as mock_save:
                     mock_save.return_value = "temp_path"
                     
                     # Mock os path exists and remove
@@ -0,0 +1,249 @@
+import io
+import random
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from core.cache import recognition as recognition_cache
+from core.cache.recognition import (
+    InMemoryRecognitionCache,
+    content_key,
+    fingerprint_sketch,
+    sketch_similarity,
+)
+from api.v1 import recognition as recognition_api
+
+
+def _fake_save(path):
+    async def save(upload, **kwargs):
+        return str(path)
+    return save
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _hashes(seed, count=500):
+    rng = random.Random(seed)
+    return [f"{rng.getrandbits(64):016x}" for _ in range(count)]
+
+
+RESULT = {"status": "SUCCESS", "results": [{"song_id": 1, "probability": 1.0}]}
+
+
+def test_sketch_similarity_tracks_set_overlap():
+    base = _hashes(1)
+    near = base[:470] + _hashes(2, 30)
+    other = _hashes(3)
+
+    sketch = fingerprint_sketch(base)
+    assert sketch_similarity(sketch, fingerprint_sketch(list(reversed(base)))) == 1.0
+    assert sketch_similarity(sketch, fingerprint_sketch(near)) > 0.7
+    assert sketch_similarity(sketch, fingerprint_sketch(other)) < 0.2
+    assert fingerprint_sketch([]) is None
+
+
+def test_content_hit_and_miss():
+    cache = InMemoryRecognitionCache()
+    key = content_key(b"audio bytes")
+    assert cache.get_by_content(key) is None
+    cache.put_by_content(key, RESULT)
+    assert cache.get_by_content(key) == RESULT
+    assert cache.get_by_content(content_key(b"other bytes")) is None
+
+
+def test_sketch_hit_for_near_identical_clip_only():
+    cache = InMemoryRecognitionCache(min_similarity=0.6)
+    base = _hashes(1)
+    cache.put_by_sketch(fingerprint_sketch(base), RESULT)
+
+    assert cache.get_by_sketch(fingerprint_sketch(base[:480] + _hashes(4, 20))) == RESULT
+    assert cache.get_by_sketch(fingerprint_sketch(_hashes(5))) is None
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = InMemoryRecognitionCache(ttl=10, clock=clock)
+    cache.put_by_content("k", RESULT)
+    cache.put_by_sketch(fingerprint_sketch(_hashes(1)), RESULT)
+    clock.now = 11
+
+    assert cache.get_by_content("k") is None
+    assert cache.get_by_sketch(fingerprint_sketch(_hashes(1))) is None
+
+
+def test_size_limit_evicts_oldest():
+    cache = InMemoryRecognitionCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put_by_content(key, RESULT)
+    assert cache.get_by_content("a") is None
+    assert cache.get_by_content("c") == RESULT
+
+
+@pytest.fixture
+def cache_client(monkeypatch):
+    cache = InMemoryRecognitionCache()
+    monkeypatch.setattr(recognition_cache, "_cache", cache)
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    return TestClient(app), cache
+
+
+def test_recognize_answers_cache_hit_without_enqueueing(cache_client):
+    client, cache = cache_client
+    audio = b"RIFF-cached-upload"
+    cache.put_by_content(content_key(audio), RESULT)
+
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        resp = client.post("/recognize/", files={"file": ("clip.wav", io.BytesIO(audio), "audio/wav")})
+
+    assert resp.status_code == 202
+    body = resp.json()
+    assert body["status"] == "SUCCESS"
+    assert body["results"] == RESULT["results"]
+    delay.assert_not_called()
+
+    polled = client.get(f"/recognize/result/{body['task_id']}")
+    assert polled.status_code == 200
+    assert polled.json() == RESULT
+
+
+def test_recognize_cache_miss_enqueues_with_content_key(cache_client, tmp_path, monkeypatch):
+    client, _ = cache_client
+    audio = b"RIFF-new-upload"
+    monkeypatch.setattr(recognition_api, "save_temp_async", _fake_save(tmp_path / "clip.wav"))
+
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        delay.return_value.id = "task-1"
+        resp = client.post("/recognize/", files={"file": ("clip.wav", io.BytesIO(audio), "audio/wav")})
+
+    assert resp.status_code == 202
+    assert resp.json() == {"task_id": "task-1"}
+    delay.assert_called_once_with(str(tmp_path / "clip.wav"), content_key=content_key(audio))
+
+
+class SharedRedis:
+    """The few Redis commands RedisRecognitionCache uses, kept in one dict."""
+
+    def __init__(self):
+        self.values = {}
+        self.index = {}
+        self.round_trips = 0
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def zadd(self, name, mapping):
+        self.index.update(mapping)
+
+    def zcard(self, name):
+        return len(self.index)
+
+    def zpopmin(self, name, count):
+        oldest = sorted(self.index.items(), key=lambda item: item[1])[:count]
+        for key, _ in oldest:
+            del self.index[key]
+        return oldest
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def eval(self, script, numkeys, index_key, max_entries):
+        # RedisRecognitionCache.TRIM_SCRIPT
+        overflow = len(self.index) - int(max_entries)
+        if overflow > 0:
+            self.delete(*[key for key, _ in self.zpopmin(index_key, overflow)])
+        return max(overflow, 0)
+
+    def pipeline(self):
+        return SharedRedisPipeline(self)
+
+
+class SharedRedisPipeline:
+    """Queues commands and runs them on execute(), in one round trip."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((getattr(self.redis, name), args))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [command(*args) for command, args in self.commands]
+
+
+def test_default_backend_is_shared_when_redis_is_configured(monkeypatch):
+    monkeypatch.delenv("RECOGNITION_CACHE_REDIS_URL", raising=False)
+    monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    assert recognition_cache._default_backend() == "memory"
+    monkeypatch.setenv("CELERY_BROKER_URL", "redis://broker:6379/0")
+    assert recognition_cache._default_backend() == "redis"
+
+
+def test_result_cached_by_worker_answers_the_api(monkeypatch):
+    from worker import tasks
+
+    audio = b"RIFF-recognized-by-a-worker"
+    redis = SharedRedis()
+    # Worker process: a finished task caches its result under the upload's content key
+    monkeypatch.setattr(recognition_cache, "_cache", recognition_cache.RedisRecognitionCache(client=redis))
+    tasks._cache_result(RESULT, content_key=content_key(audio))
+
+    # API process: its own cache instance, same Redis
+    monkeypatch.setattr(recognition_cache, "_cache", recognition_cache.RedisRecognitionCache(client=redis))
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        resp = TestClient(app).post("/recognize/", files={"file": ("clip.wav", io.BytesIO(audio), "audio/wav")})
+
+    assert resp.json()["results"] == RESULT["results"]
+    delay.assert_not_called()
+
+
+def test_redis_writes_and_trims_in_one_round_trip(monkeypatch):
+    monkeypatch.setattr(recognition_cache, "_active_version", lambda: 1)
+    redis = SharedRedis()
+    cache = recognition_cache.RedisRecognitionCache(client=redis, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put_by_content(key, RESULT)
+    cache.put_by_sketch(fingerprint_sketch(_hashes(1)), RESULT)
+
+    assert redis.round_trips == 4
+    assert len(redis.index) == 2
+    assert cache.get_by_content("a") is cache.get_by_content("b") is None
+    assert cache.get_by_content("c") == RESULT
+
+
+@pytest.mark.parametrize("make_cache", [
+    InMemoryRecognitionCache,
+    lambda: recognition_cache.RedisRecognitionCache(client=SharedRedis()),
+])
+def test_cached_results_follow_the_active_version(monkeypatch, make_cache):
+    version = [1]
+    monkeypatch.setattr(recognition_cache, "_active_version", lambda: version[0])
+    cache = make_cache()
+    sketch = fingerprint_sketch(_hashes(1))
+    cache.put_by_content("a", RESULT)
+    cache.put_by_sketch(sketch, RESULT)
+
+    # Matched against the v1 index: not served once v2 is active
+    version[0] = 2
+    assert cache.get_by_content("a") is None and cache.get_by_sketch(sketch) is None
+    version[0] = 1
+    assert cache.get_by_content("a") == RESULT and cache.get_by_sketch(sketch) == RESULT
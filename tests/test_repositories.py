@@ -94,6 +94,35 @@ def test_song_repository_crud_and_bulk(sqlite_session):
     assert repo.get_by_id(song.id) is None
 
 
+def test_song_repository_get_details_by_ids(sqlite_session):
+    repo = SongRepository(sqlite_session)
+
+    artist = Artist(name="Details Artist")
+    sqlite_session.add(artist)
+    sqlite_session.commit()
+    album = Album(title="Details Album", artist_id=artist.id, album_image="http://img/details.jpg")
+    sqlite_session.add(album)
+    sqlite_session.commit()
+    with_album = repo.create(title="With Album", artist_id=artist.id, album_id=album.id)
+    without_album = repo.create(title="No Album", artist_id=artist.id)
+
+    details = repo.get_details_by_ids([with_album.id, without_album.id, 999999])
+
+    assert set(details) == {with_album.id, without_album.id}
+    assert details[with_album.id] == {
+        "song_id": with_album.id,
+        "title": "With Album",
+        "artist_id": artist.id,
+        "artist_name": "Details Artist",
+        "album_id": album.id,
+        "album_name": "Details Album",
+        "album_image": "http://img/details.jpg",
+    }
+    assert details[without_album.id]["album_id"] is None
+    assert details[without_album.id]["album_name"] is None
+    assert repo.get_details_by_ids([]) == {}
+
+
 def test_fingerprint_repository_crud_and_bulk():
     repo = FingerprintRepository()
 
@@ -167,7 +196,8 @@ def test_song_feature_repository_crud(mongo_connection):
     repo = SongFeatureRepository()
 
     song_id_1 = 1
-    feature_vector_1 = np.array([0.1, 0.2, 0.3])
+    # Vectors are stored as float32
+    feature_vector_1 = np.array([0.1, 0.2, 0.3], dtype=np.float32)
     
     # Test create_or_update (create)
     sf1 = repo.create_or_update(song_id_1, feature_vector_1)
@@ -183,7 +213,7 @@ def test_song_feature_repository_crud(mongo_connection):
     assert np.array_equal(np.array(fetched_sf1.feature_vector), feature_vector_1)
 
     # Test create_or_update (update)
-    feature_vector_updated = np.array([0.4, 0.5, 0.6])
+    feature_vector_updated = np.array([0.4, 0.5, 0.6], dtype=np.float32)
     sf1_updated = repo.create_or_update(song_id_1, feature_vector_updated)
     assert sf1_updated.song_id == song_id_1
     assert np.array_equal(np.array(sf1_updated.feature_vector), feature_vector_updated)
@@ -193,7 +223,7 @@ def test_song_feature_repository_crud(mongo_connection):
 
     # Test get_all_features
     song_id_2 = 2
-    feature_vector_2 = np.array([0.7, 0.8, 0.9])
+    feature_vector_2 = np.array([0.7, 0.8, 0.9], dtype=np.float32)
     repo.create_or_update(song_id_2, feature_vector_2)
     
     all_features = repo.get_all_features()
@@ -208,6 +238,64 @@ def test_song_feature_repository_crud(mongo_connection):
     assert repo.get_by_song_id(999) is None
 
 
+def test_song_feature_binary_storage_and_migration(mongo_connection, monkeypatch):
+    bulk_writes = []
+    apply_requests = mongomock.collection.Collection.bulk_write  # see conftest.mongomock_bulk_updates
+
+    def bulk_write(collection, requests, ordered=True):
+        bulk_writes.append(len(requests))
+        return apply_requests(collection, requests, ordered=ordered)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    SongFeature.drop_collection()
+    repo = SongFeatureRepository()
+    rng = np.random.default_rng(50)
+    legacy = {song_id: rng.normal(size=55) for song_id in (11, 12, 13)}
+    SongFeature._get_collection().insert_many(
+        [{"song_id": song_id, "feature_vector": vector.tolist()} for song_id, vector in legacy.items()]
+    )
+    repo.bulk_upsert({14: rng.normal(size=55)})
+    assert bulk_writes == [1]
+    bulk_writes.clear()
+    doc = SongFeature._get_collection().find_one({"song_id": 14})
+    assert "feature_vector" not in doc and doc["vector_dtype"] == "<f4" and doc["vector_dim"] == 55
+    assert len(doc["vector"]) == 55 * 4
+
+    # Old and new documents load alike, as rows of one float32 matrix
+    features = repo.get_all_features()
+    assert all(vector.dtype == np.float32 for vector in features.values())
+    assert features[11].base is features[14].base
+    for song_id, vector in legacy.items():
+        assert np.array_equal(features[song_id], vector.astype(np.float32))
+
+    assert repo.migrate_to_binary(batch_size=2) == 3
+    assert bulk_writes == [2, 1]
+    assert repo.migrate_to_binary() == 0
+    assert SongFeature._get_collection().count_documents({"feature_vector": {"$exists": True}}) == 0
+    migrated = repo.get_all_features()
+    for song_id in features:
+        assert np.array_equal(migrated[song_id], features[song_id])
+    assert np.array_equal(repo.get_by_song_id(12).feature_vector, legacy[12].astype(np.float32))
+
+
+def test_song_feature_bulk_upsert_updates_in_place(mongo_connection):
+    from datetime import datetime
+
+    SongFeature.drop_collection()
+    collection = SongFeature._get_collection()
+    created = datetime(2024, 1, 1)
+    collection.insert_one({"song_id": 21, "feature_vector": [1.0] * 55, "created_at": created, "updated_at": created})
+    repo = SongFeatureRepository()
+
+    assert repo.bulk_upsert({21: np.full(55, 2.0), 22: np.full(55, 3.0)}) == 2
+    existing, new = collection.find_one({"song_id": 21}), collection.find_one({"song_id": 22})
+    assert existing["created_at"] == created and existing["updated_at"] > created
+    assert "feature_vector" not in existing and existing["vector_dim"] == 55
+    assert new["created_at"] == new["updated_at"]
+    assert collection.count_documents({}) == 2
+    assert np.array_equal(repo.get_by_song_id(21).feature_vector, np.full(55, 2.0, dtype=np.float32))
+
+
 def test_recognition_history_repository_crud(sqlite_session):
     repo = RecognitionHistoryRepository(sqlite_session)
 
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.v1 import recognition as recognition_api
+from worker import result_channel
+from worker.result_channel import ResultSubscriber, channel_for, publish_result
+
+
+class FakePubSub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.messages = queue.Queue()
+        self.patterns = []
+
+    def psubscribe(self, pattern):
+        self.patterns.append(pattern)
+        self.broker.subscribers.append(self)
+
+    def listen(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    def close(self):
+        self.messages.put(None)
+
+
+class FakeRedis:
+    """Just enough of redis-py's pub/sub for one pattern subscription."""
+
+    def __init__(self):
+        self.subscribers = []
+        self.published = []
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def publish(self, channel, data):
+        self.published.append((channel, data))
+        for subscriber in self.subscribers:
+            subscriber.messages.put({"type": "pmessage", "channel": channel.encode(), "data": data.encode()})
+        return len(self.subscribers)
+
+
+RESULT = {"status": "SUCCESS", "results": [{"song_id": 7, "probability": 1.0}]}
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    redis = FakeRedis()
+    subscriber = ResultSubscriber(client=redis)
+    monkeypatch.setattr(result_channel, "_subscriber", subscriber)
+    yield redis, subscriber
+    subscriber.close()
+
+
+@pytest.fixture
+def client(broker):
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    return TestClient(app)
+
+
+def _publish_when_waiting(redis, subscriber, task_id, result, waiters=1):
+    def publish():
+        deadline = time.monotonic() + 5
+        while (subscriber.waiting() < waiters or not redis.subscribers) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        publish_result(task_id, result, client=redis)
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    return thread
+
+
+def test_long_poll_returns_published_result(client, broker, monkeypatch):
+    redis, subscriber = broker
+    fetches = []
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: fetches.append(task_id))
+
+    publisher = _publish_when_waiting(redis, subscriber, "task-1", RESULT)
+    resp = client.get("/recognize/result/task-1/wait", params={"timeout": 5})
+    publisher.join()
+
+    assert resp.status_code == 200
+    assert resp.json() == RESULT
+    assert redis.published == [(channel_for("task-1"), json.dumps(RESULT))]
+    assert subscriber.waiting() == 0
+    # One backend check after subscribing; no polling while the result was pushed
+    assert fetches[0] == "task-1"
+
+
+def test_long_poll_returns_result_finished_before_subscribing(client, monkeypatch):
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: RESULT)
+    resp = client.get("/recognize/result/task-2/wait", params={"timeout": 5})
+    assert resp.json() == RESULT
+
+
+def test_long_poll_times_out_as_pending(client, monkeypatch):
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: None)
+    resp = client.get("/recognize/result/task-3/wait", params={"timeout": 0.3})
+    assert resp.status_code == 200
+    assert resp.json() == {"status": "PENDING"}
+
+
+def test_long_poll_no_match_is_404(client, broker, monkeypatch):
+    redis, subscriber = broker
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: None)
+    publisher = _publish_when_waiting(redis, subscriber, "task-4", {"status": "NO_MATCH"})
+    resp = client.get("/recognize/result/task-4/wait", params={"timeout": 5})
+    publisher.join()
+    assert resp.status_code == 404
+
+
+def test_one_subscription_fans_out_to_all_waiters(client, broker, monkeypatch):
+    redis, subscriber = broker
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: None)
+    responses = []
+
+    def wait():
+        responses.append(client.get("/recognize/result/task-5/wait", params={"timeout": 5}).json())
+
+    waiters = [threading.Thread(target=wait) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    publisher = _publish_when_waiting(redis, subscriber, "task-5", RESULT, waiters=3)
+    for thread in waiters:
+        thread.join()
+    publisher.join()
+
+    assert responses == [RESULT] * 3
+    assert len(redis.subscribers) == 1
+
+
+def test_waiting_does_not_poll_the_backend(broker):
+    redis, subscriber = broker
+    fetches = []
+
+    async def wait():
+        return await subscriber.wait("task-8", 0.6, fetch=lambda task_id: fetches.append(task_id))
+
+    assert asyncio.run(wait()) is None
+    assert fetches == ["task-8"]
+
+
+def test_results_missed_while_disconnected_are_caught_up(broker):
+    redis, subscriber = broker
+    finished = {}
+    fetches = []
+
+    def fetch(task_id):
+        fetches.append(task_id)
+        return finished.get(task_id)
+
+    def drop_connection_then_finish():
+        deadline = time.monotonic() + 5
+        while (subscriber.waiting() < 1 or not redis.subscribers) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # The task finishes while the subscription is down, so its message is lost
+        finished["task-9"] = RESULT
+        redis.subscribers.pop().messages.put(ConnectionError("connection reset"))
+
+    async def wait():
+        return await subscriber.wait("task-9", 5, fetch=fetch)
+
+    thread = threading.Thread(target=drop_connection_then_finish)
+    thread.start()
+    assert asyncio.run(wait()) == RESULT
+    thread.join()
+    # Once at subscribe time and once after reconnecting
+    assert fetches == ["task-9", "task-9"]
+
+
+def test_stream_sends_result_event(client, broker, monkeypatch):
+    redis, subscriber = broker
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: None)
+    monkeypatch.setattr(recognition_api, "RESULT_STREAM_KEEPALIVE", 0.1)
+
+    publisher = _publish_when_waiting(redis, subscriber, "task-6", RESULT)
+    with client.stream("GET", "/recognize/result/task-6/stream") as resp:
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        body = "".join(resp.iter_text())
+    publisher.join()
+
+    assert f"event: result\ndata: {json.dumps(RESULT)}\n\n" in body
+
+
+def test_stream_reads_the_backend_once(client, broker, monkeypatch):
+    redis, subscriber = broker
+    fetches = []
+    monkeypatch.setattr(recognition_api, "_read_task_result", lambda task_id: fetches.append(task_id))
+    monkeypatch.setattr(recognition_api, "RESULT_STREAM_KEEPALIVE", 0.05)
+    monkeypatch.setattr(recognition_api, "RESULT_STREAM_TIMEOUT", 0.4)
+
+    with client.stream("GET", "/recognize/result/task-10/stream") as resp:
+        body = "".join(resp.iter_text())
+
+    assert body.count(": keep-alive") >= 3 and body.endswith("event: timeout\ndata: {\"status\": \"PENDING\"}\n\n")
+    assert fetches == ["task-10"]
+
+
+def test_worker_publishes_recognition_results_on_success(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(result_channel, "_publisher", redis)
+    monkeypatch.setattr(result_channel, "_publisher_pid", result_channel.os.getpid())
+
+    class Sender:
+        def __init__(self, name):
+            self.name = name
+            self.request = type("Request", (), {"id": "task-7"})()
+
+    result_channel._publish_on_success(sender=Sender("recognize_audio_task"), result=RESULT)
+    result_channel._publish_on_success(sender=Sender("extract_and_store_features"), result={})
+
+    assert redis.published == [(channel_for("task-7"), json.dumps(RESULT))]
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from scipy.io.wavfile import write as wav_write
+
+from core.fingerprint import extractor
+from core.fingerprint.extractor import (
+    FingerPrinter,
+    extract_fingerprint,
+    extract_fingerprint_segmented,
+    fingerprint_signal_segmented,
+)
+
+SR = FingerPrinter.SAMPLE_RATE
+
+
+@pytest.fixture(scope="module")
+def recording():
+    rng = np.random.default_rng(21)
+    t = np.arange(SR * 40 + 123) / SR
+    tones = np.sin(2 * np.pi * 440 * t * (1 + 0.1 * np.sin(t))) + np.sin(2 * np.pi * 1320 * t)
+    return (0.2 * tones + 0.3 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+@pytest.mark.parametrize("segment_seconds", [0.5, 3.7, 10, 60])
+def test_segmented_output_equals_serial(recording, segment_seconds):
+    serial = FingerPrinter().fingerprint_signal(recording)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        segmented = fingerprint_signal_segmented(recording, segment_seconds, executor=executor)
+    assert len(serial) > 100
+    assert segmented == serial
+
+
+def test_segmented_offsets_cover_the_whole_track(recording):
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        segmented = fingerprint_signal_segmented(recording, 5, executor=executor)
+    offsets = [offset for _, offset in segmented]
+    hop = FingerPrinter().hop_length
+    # Rebased to the track, not to each segment
+    assert max(offsets) > 30 * SR / hop
+    assert all(isinstance(offset, int) for offset in offsets)
+
+
+def test_extract_fingerprint_segmented_only_splits_long_files(tmp_path, recording, monkeypatch):
+    path = tmp_path / "long.wav"
+    wav_write(str(path), SR, (recording * 32767).astype(np.int16))
+    calls = []
+    segmented = extractor.fingerprint_signal_segmented
+    monkeypatch.setattr(extractor, "fingerprint_signal_segmented",
+                        lambda y, *args, **kwargs: calls.append(len(y)) or segmented(y, 8, 1))
+
+    assert extract_fingerprint_segmented(str(path), min_seconds=60) == extract_fingerprint(str(path))
+    assert calls == []
+    assert extract_fingerprint_segmented(str(path), min_seconds=30) == extract_fingerprint(str(path))
+    assert len(calls) == 1
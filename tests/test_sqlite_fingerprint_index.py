@@ -0,0 +1,94 @@
+import pytest
+import mongoengine
+import mongomock
+
+from db.nosql.collections import Fingerprint
+from core.repository import fingerprint_repository
+from core.repository.sqlite_fingerprint_repository import (
+    SQLiteFingerprintRepository,
+    hash_to_int,
+    int_to_hash,
+)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def sqlite_repo(tmp_path):
+    repo = SQLiteFingerprintRepository(str(tmp_path / "fingerprints.sqlite3"))
+    yield repo
+    repo.close()
+
+
+def test_hash_int_round_trip():
+    for hash_value in ("0000000000000000", "7fffffffffffffff", "8000000000000000", "ffffffffffffffff", "a3f9c01d22b74e10"):
+        key = hash_to_int(hash_value)
+        assert -(1 << 63) <= key < (1 << 63)
+        assert int_to_hash(key) == hash_value
+
+
+def test_store_and_lookup(sqlite_repo):
+    stored = sqlite_repo.store_spectral_fingerprints(1, [("aaaaaaaaaaaaaaaa", 3), ("bbbbbbbbbbbbbbbb", 5)])
+    sqlite_repo.store_spectral_fingerprints(2, [("aaaaaaaaaaaaaaaa", 9)])
+    assert stored == 2
+
+    result = sqlite_repo.get_fingerprints_by_hashes(["aaaaaaaaaaaaaaaa", "cccccccccccccccc"])
+    assert sorted(result["aaaaaaaaaaaaaaaa"]) == [(1, 3), (2, 9)]
+    assert "cccccccccccccccc" not in result
+
+
+def test_store_replaces_existing_song(sqlite_repo):
+    sqlite_repo.store_spectral_fingerprints(1, [("aaaaaaaaaaaaaaaa", 3)])
+    sqlite_repo.store_spectral_fingerprints(1, [("bbbbbbbbbbbbbbbb", 4)])
+    assert sqlite_repo.count_by_song_id(1) == 1
+    assert sqlite_repo.get_fingerprints_by_hashes(["aaaaaaaaaaaaaaaa"]) == {}
+
+
+def test_lookup_spans_multiple_batches(sqlite_repo):
+    fingerprints = [(f"{i:016x}", i) for i in range(1, 1200)]
+    sqlite_repo.store_spectral_fingerprints(5, fingerprints)
+    result = sqlite_repo.get_fingerprints_by_hashes([h for h, _ in fingerprints])
+    assert len(result) == len(fingerprints)
+    assert result[f"{700:016x}"] == [(5, 700)]
+
+
+def test_delete_by_song_id(sqlite_repo):
+    sqlite_repo.store_spectral_fingerprints(1, [("aaaaaaaaaaaaaaaa", 3), ("bbbbbbbbbbbbbbbb", 5)])
+    assert sqlite_repo.delete_by_song_id(1) == 2
+    assert sqlite_repo.count_by_song_id(1) == 0
+
+
+def test_import_from_mongo_matches_mongo_lookup(sqlite_repo):
+    Fingerprint.drop_collection()
+    mongo_repo = fingerprint_repository.FingerprintRepository()
+    mongo_repo.store_spectral_fingerprints(10, [("1111111111111111", 0), ("2222222222222222", 7)])
+    mongo_repo.store_spectral_fingerprints(11, [("1111111111111111", 4)])
+
+    assert sqlite_repo.import_from_mongo(batch_size=2) == 3
+
+    hashes = ["1111111111111111", "2222222222222222"]
+    expected = mongo_repo.get_fingerprints_by_hashes(hashes)
+    actual = sqlite_repo.get_fingerprints_by_hashes(hashes)
+    assert {h: sorted(v) for h, v in actual.items()} == {h: sorted(v) for h, v in expected.items()}
+
+
+def test_get_fingerprint_repository_selects_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "mongo")
+    assert isinstance(fingerprint_repository.get_fingerprint_repository(), fingerprint_repository.FingerprintRepository)
+
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_BACKEND", "sqlite")
+    monkeypatch.setattr(fingerprint_repository, "FINGERPRINT_SQLITE_PATH", str(tmp_path / "index.sqlite3"))
+    repo = fingerprint_repository.get_fingerprint_repository()
+    assert isinstance(repo, SQLiteFingerprintRepository)
+    assert fingerprint_repository.get_fingerprint_repository() is repo
@@ -0,0 +1,269 @@
+import asyncio
+import io
+import threading
+
+import numpy as np
+import pytest
+import mongoengine
+import mongomock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from scipy.io.wavfile import read as wav_read, write as wav_write
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from unittest.mock import patch
+
+from api.v1 import recognition as recognition_api
+from core.cache import recognition as recognition_cache
+from core.cache.recognition import NullRecognitionCache
+from core.compute.pool import BoundedExecutor
+from core.fingerprint.extractor import extract_fingerprint, extract_fingerprint_from_bytes
+from core.repository.fingerprint_repository import FingerprintRepository
+from db.nosql.collections import Fingerprint
+from db.sql.models import Base, Artist, Song
+from worker import tasks
+
+SR = 22050
+
+
+def _fake_save(path):
+    async def save(upload, **kwargs):
+        return str(path)
+    return save
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    Fingerprint.drop_collection()
+    mongoengine.disconnect()
+
+
+def _wav_bytes(y):
+    buffer = io.BytesIO()
+    wav_write(buffer, SR, (y * 32767).astype(np.int16))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def song_clip(tmp_path, monkeypatch):
+    """A fingerprinted song and the WAV bytes of a hop-aligned excerpt of it."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(tasks, "get_db", lambda: iter([Session()]))
+
+    session = Session()
+    artist = Artist(name="Sync Artist")
+    session.add(artist)
+    session.commit()
+    song = Song(title="Sync Song", artist_id=artist.id)
+    session.add(song)
+    session.commit()
+    song_id = song.id
+    session.close()
+
+    Fingerprint.drop_collection()
+    full = 0.5 * np.random.default_rng(11).uniform(-1, 1, SR * 8)
+    song_path = tmp_path / "song.wav"
+    song_path.write_bytes(_wav_bytes(full))
+    FingerprintRepository().store_spectral_fingerprints(song_id, extract_fingerprint(str(song_path)))
+
+    start = 2048 * 40
+    yield song_id, _wav_bytes(full[start:start + SR * 4])
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def sync_client(monkeypatch):
+    monkeypatch.setattr(recognition_cache, "_cache", NullRecognitionCache())
+    pool = BoundedExecutor(max_workers=1, max_pending=1, kind="thread")
+    monkeypatch.setattr(recognition_api, "_sync_pool", pool)
+    app = FastAPI()
+    app.include_router(recognition_api.router)
+    yield TestClient(app), pool
+    pool.shutdown()
+
+
+def test_extract_fingerprint_from_bytes_matches_file(tmp_path):
+    data = _wav_bytes(0.5 * np.random.default_rng(3).uniform(-1, 1, SR * 2))
+    path = tmp_path / "clip.wav"
+    path.write_bytes(data)
+    assert extract_fingerprint_from_bytes(data, ".wav") == extract_fingerprint(str(path))
+
+
+def test_bounded_executor_rejects_when_saturated():
+    pool = BoundedExecutor(max_workers=1, max_pending=1, kind="thread")
+    release = threading.Event()
+    try:
+        blocked = pool.try_submit(release.wait)
+        assert blocked is not None
+        assert pool.try_submit(lambda: None) is None
+        release.set()
+        blocked.result(timeout=5)
+        assert pool.try_submit(lambda: 42).result(timeout=5) == 42
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_sync_recognition_returns_result_inline(sync_client, song_clip):
+    client, _ = sync_client
+    song_id, clip = song_clip
+
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        resp = client.post("/recognize/sync", files={"file": ("clip.wav", io.BytesIO(clip), "audio/wav")})
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == "SUCCESS"
+    assert body["results"][0]["song_id"] == song_id
+    assert body["results"][0]["title"] == "Sync Song"
+    delay.assert_not_called()
+
+
+def test_sync_recognition_accepts_raw_pcm(sync_client, song_clip):
+    client, _ = sync_client
+    song_id, clip = song_clip
+    pcm = wav_read(io.BytesIO(clip))[1].astype("<i2").tobytes()
+
+    resp = client.post(
+        "/recognize/sync",
+        files={"file": ("clip.pcm", io.BytesIO(pcm), "application/octet-stream")},
+        data={"format": "pcm_s16le", "sample_rate": str(SR)},
+    )
+
+    assert resp.status_code == 200
+    assert resp.json()["results"][0]["song_id"] == song_id
+
+
+def test_sync_recognition_falls_back_to_celery_for_large_upload(sync_client, monkeypatch, tmp_path):
+    client, _ = sync_client
+    monkeypatch.setattr(recognition_api, "SYNC_MAX_BYTES", 10)
+    monkeypatch.setattr(recognition_api, "save_temp_async", _fake_save(tmp_path / "clip.wav"))
+
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        delay.return_value.id = "task-1"
+        resp = client.post("/recognize/sync", files={"file": ("clip.wav", io.BytesIO(b"RIFF" * 10), "audio/wav")})
+
+    assert resp.status_code == 202
+    assert resp.json() == {"task_id": "task-1"}
+    delay.assert_called_once()
+
+
+def test_sync_recognition_falls_back_to_celery_when_pool_is_busy(sync_client, monkeypatch, tmp_path):
+    client, pool = sync_client
+    monkeypatch.setattr(recognition_api, "save_temp_async", _fake_save(tmp_path / "clip.wav"))
+    release = threading.Event()
+    pool.try_submit(release.wait)
+
+    try:
+        with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+            delay.return_value.id = "task-2"
+            resp = client.post("/recognize/sync", files={"file": ("clip.wav", io.BytesIO(b"RIFF"), "audio/wav")})
+    finally:
+        release.set()
+
+    assert resp.status_code == 202
+    assert resp.json() == {"task_id": "task-2"}
+
+
+def test_busy_pool_sends_raw_pcm_to_worker(sync_client, song_clip, monkeypatch, tmp_path):
+    client, pool = sync_client
+    song_id, clip = song_clip
+    pcm = wav_read(io.BytesIO(clip))[1].astype("<i2").tobytes()
+    spooled = tmp_path / "clip.pcm"
+    spooled.write_bytes(pcm)
+    monkeypatch.setattr(recognition_api, "save_temp_async", _fake_save(spooled))
+    release = threading.Event()
+    pool.try_submit(release.wait)
+
+    try:
+        with patch.object(recognition_api.recognize_audio_task, "delay") as delay, \
+                patch.object(recognition_api.recognize_fingerprints_task, "delay") as fingerprints_delay:
+            delay.return_value.id = "task-3"
+            resp = client.post(
+                "/recognize/sync",
+                files={"file": ("clip.pcm", io.BytesIO(pcm), "application/octet-stream")},
+                data={"format": "pcm_s16le", "sample_rate": str(SR)},
+            )
+    finally:
+        release.set()
+
+    assert resp.status_code == 202
+    assert resp.json() == {"task_id": "task-3"}
+    fingerprints_delay.assert_not_called()
+    path, = delay.call_args.args
+    assert delay.call_args.kwargs["sample_rate"] == SR
+
+    # The worker fingerprints the spooled samples instead of decoding them
+    result = tasks.recognize_audio_task(path, content_key=delay.call_args.kwargs["content_key"], sample_rate=SR)
+    assert result["results"][0]["song_id"] == song_id
+    assert not spooled.exists()
+
+
+def test_sync_preload_loads_only_the_fingerprint_index(monkeypatch):
+    calls = []
+    monkeypatch.setattr(recognition_api, "preload_indexes", lambda names: calls.append(names))
+    recognition_api.preload_sync_index()
+    assert calls == [["fingerprint index"]]
+
+
+def test_async_pcm_upload_is_size_gated_and_extraction_errors_are_400(sync_client, monkeypatch, tmp_path):
+    client, _ = sync_client
+    pcm = np.zeros(SR, dtype="<i2").tobytes()
+    monkeypatch.setattr(recognition_api, "save_temp_async", _fake_save(tmp_path / "clip.pcm"))
+    extracted = []
+
+    def broken(data, sample_rate, version):
+        extracted.append(len(data))
+        raise ValueError("bad samples")
+
+    monkeypatch.setattr(recognition_api, "extract_fingerprint_from_pcm", broken)
+    form = {"format": "pcm_s16le", "sample_rate": str(SR)}
+
+    resp = client.post("/recognize/", files={"file": ("clip.pcm", io.BytesIO(pcm), "application/octet-stream")},
+                       data=form)
+    assert resp.status_code == 400 and extracted == [len(pcm)]
+
+    # Above RECOGNITION_SYNC_MAX_BYTES the worker fingerprints the samples
+    monkeypatch.setattr(recognition_api, "SYNC_MAX_BYTES", len(pcm) - 2)
+    with patch.object(recognition_api.recognize_audio_task, "delay") as delay:
+        delay.return_value.id = "task-4"
+        resp = client.post("/recognize/", files={"file": ("clip.pcm", io.BytesIO(pcm), "application/octet-stream")},
+                           data=form)
+    assert resp.status_code == 202 and resp.json() == {"task_id": "task-4"}
+    assert delay.call_args.kwargs["sample_rate"] == SR and extracted == [len(pcm)]
+
+
+def test_handlers_read_the_index_state_off_the_event_loop(sync_client, monkeypatch):
+    client, _ = sync_client
+    loop_threads = []
+
+    def active_version(refresh=False):
+        try:
+            asyncio.get_running_loop()
+            loop_threads.append(threading.current_thread().name)
+        except RuntimeError:
+            pass
+        return 1
+
+    monkeypatch.setattr(recognition_api, "get_active_version", active_version)
+    with patch.object(recognition_api, "recognize_fingerprints") as recognize:
+        recognize.return_value = {"status": "NO_MATCH"}
+        pcm = np.zeros(SR, dtype="<i2").tobytes()
+        client.post("/recognize/sync", files={"file": ("clip.pcm", io.BytesIO(pcm), "application/octet-stream")},
+                    data={"format": "pcm_s16le", "sample_rate": str(SR)})
+        client.post("/recognize/hashes", content=b"")
+    assert loop_threads == []
@@ -0,0 +1,72 @@
+import pytest
+import mongoengine
+import mongomock
+
+from worker import lifecycle
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mongo_connection():
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "testdb",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    yield
+    mongoengine.disconnect()
+
+
+def test_ensure_connections_keeps_existing_connection(monkeypatch):
+    monkeypatch.setattr(lifecycle, "_connected_pid", None)
+    before = mongoengine.connection.get_connection()
+    lifecycle.ensure_connections()
+    assert mongoengine.connection.get_connection() is before
+
+
+def test_initialize_process_sets_ready_and_runs_preloaders(monkeypatch):
+    calls = []
+    monkeypatch.setattr(lifecycle, "open_connections", lambda: calls.append("connections"))
+    monkeypatch.setattr(lifecycle, "WORKER_WARMUP", True)
+    monkeypatch.setattr(lifecycle, "warm_up", lambda: calls.append("warm_up"))
+    monkeypatch.setattr(lifecycle, "WORKER_PRELOAD_INDEXES", True)
+    monkeypatch.setattr(lifecycle, "_preloaders", [("test index", lambda: calls.append("preload"))])
+
+    lifecycle.initialize_process()
+
+    assert calls == ["connections", "warm_up", "preload"]
+    assert lifecycle.is_ready()
+
+
+def test_failed_steps_do_not_skip_the_others_and_are_reported(monkeypatch):
+    from worker import tasks
+
+    def broken(what):
+        def step():
+            raise RuntimeError(what)
+        return step
+
+    calls = []
+    monkeypatch.setattr(lifecycle, "open_connections", lambda: None)
+    monkeypatch.setattr(lifecycle, "WORKER_WARMUP", True)
+    monkeypatch.setattr(lifecycle, "warm_up", broken("no audio backend"))
+    monkeypatch.setattr(lifecycle, "WORKER_PRELOAD_INDEXES", True)
+    monkeypatch.setattr(lifecycle, "_preloaders", [("broken index", broken("no index")),
+                                                   ("test index", lambda: calls.append("preload"))])
+
+    lifecycle.initialize_process()
+
+    assert calls == ["preload"]
+    assert lifecycle.is_initialized() and not lifecycle.is_ready()
+    status = tasks.worker_status()
+    assert status["ready"] is False and status["initialized"] is True
+    assert status["failed_steps"] == ["warm_up", "preload:broken index"]
+
+    monkeypatch.setattr(lifecycle, "warm_up", lambda: None)
+    monkeypatch.setattr(lifecycle, "_preloaders", [])
+    lifecycle.initialize_process()
+    assert lifecycle.is_ready() and lifecycle.failed_steps() == []
+
+
+def test_warm_up_runs_extraction():
+    lifecycle.warm_up()
@@ -0,0 +1,208 @@
+"""
+Worker process lifecycle: one-time setup for each Celery child process.
+
+Wired to Celery's `worker_process_init` signal so that database connections,
+heavy imports (librosa, numba, scipy) and optional recognition indexes are
+prepared before the first task arrives, instead of on the first task's clock.
+"""
+import os
+import tempfile
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+from celery.signals import worker_process_init
+from dotenv import load_dotenv
+
+# Run a dummy extraction at process start to pay import/JIT costs up front
+WORKER_WARMUP = os.getenv("WORKER_WARMUP", "true").lower() in ("1", "true", "yes")
+# Load recognition indexes (fingerprint index, feature store, ...) at process start
+WORKER_PRELOAD_INDEXES = os.getenv("WORKER_PRELOAD_INDEXES", "false").lower() in ("1", "true", "yes")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "10"))
+
+_ready = threading.Event()
+_failed_steps: List[str] = []
+_connections_lock = threading.Lock()
+_connected_pid = None
+_preloaders: List[Tuple[str, Callable[[], None]]] = []
+
+
+def is_ready() -> bool:
+    """
+    Return True once this process finished warm-up (and index preload, if
+    enabled) and none of its steps failed.
+    """
+    return _ready.is_set() and not _failed_steps
+
+
+def is_initialized() -> bool:
+    """Return True once process initialisation has run, whether or not a step failed."""
+    return _ready.is_set()
+
+
+def failed_steps() -> List[str]:
+    """Initialisation steps that failed in this process, e.g. ["warm_up", "preload:feature store"]."""
+    return list(_failed_steps)
+
+
+def register_preloader(name: str, loader: Callable[[], None]) -> None:
+    """
+    Register a callable that loads a recognition index into this process.
+    Preloaders run at process start when WORKER_PRELOAD_INDEXES is enabled.
+    """
+    if all(existing != name for existing, _ in _preloaders):
+        _preloaders.append((name, loader))
+
+
+def ensure_connections() -> None:
+    """
+    Make sure this process has its MongoDB connection registered.
+
+    Cheap after the first call, so tasks can call it unconditionally; a
+    connection that is already registered (e.g. by tests) is left alone.
+    """
+    global _connected_pid
+    if _connected_pid == os.getpid():
+        return
+
+    from mongoengine import connect
+    from mongoengine.connection import ConnectionFailure, get_connection
+
+    with _connections_lock:
+        if _connected_pid == os.getpid():
+            return
+        try:
+            get_connection(alias="default")
+        except ConnectionFailure:
+            load_dotenv()
+            mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+            db_name = os.getenv("DB_NAME", "tuneleap_db")
+            connect(db=db_name, host=mongo_uri, alias="default", maxPoolSize=MONGO_MAX_POOL_SIZE)
+        _connected_pid = os.getpid()
+
+
+def open_connections() -> None:
+    """
+    Open pooled MongoDB and SQL connections for a freshly forked process.
+    Clients inherited from the parent are dropped, since neither pymongo
+    nor the SQLAlchemy pool is fork-safe.
+    """
+    global _connected_pid
+    from mongoengine import disconnect
+
+    disconnect(alias="default")
+    _connected_pid = None
+    ensure_connections()
+
+    try:
+        from sqlalchemy import text
+        from db.sql.database import engine
+
+        engine.dispose(close=False)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        print(f"Worker: SQL connection warm-up failed: {e}")
+
+
+def warm_up() -> None:
+    """
+    Import and JIT-compile the audio stack by fingerprinting and extracting
+    features from a short synthetic clip.
+    """
+    import numpy as np
+    import soundfile as sf
+    from core.fingerprint.extractor import extract_fingerprint
+    from core.reco.features import extract_features
+
+    sr = 22050
+    t = np.linspace(0, 3.0, int(sr * 3.0), endpoint=False)
+    rng = np.random.default_rng(0)
+    y = 0.4 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 660 * t) + 0.05 * rng.standard_normal(t.size)
+
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        sf.write(path, y.astype(np.float32), sr)
+        extract_fingerprint(path)
+        extract_features(path)
+    finally:
+        os.remove(path)
+
+
+def preload_indexes(names: Optional[List[str]] = None) -> List[str]:
+    """
+    Run the registered preloaders, logging (not raising) failures.
+
+    :param names: preloaders to run; all of them by default
+    :return: names of the preloaders that failed
+    """
+    failed = []
+    for name, loader in _preloaders:
+        if names is not None and name not in names:
+            continue
+        start = time.perf_counter()
+        try:
+            loader()
+            print(f"Worker: Preloaded {name} in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"Worker: Failed to preload {name}: {e}")
+            failed.append(name)
+    return failed
+
+
+def _preload_fingerprint_index() -> None:
+    from core.repository.fingerprint_repository import get_fingerprint_repository
+
+    repo = get_fingerprint_repository()
+    # Touch the index so its connection and first pages are ready
+    repo.get_fingerprints_by_hashes(["0000000000000000"])
+
+
+register_preloader("fingerprint index", _preload_fingerprint_index)
+
+
+def _preload_feature_store() -> None:
+    from core.reco.feature_store import get_feature_store
+
+    # Load the vectors and build the fallback search matrix
+    get_feature_store().engine()
+
+
+register_preloader("feature store", _preload_feature_store)
+
+
+def _run_step(name: str, step: Callable[[], None]) -> None:
+    try:
+        step()
+    except Exception:
+        traceback.print_exc()
+        _failed_steps.append(name)
+
+
+def initialize_process() -> None:
+    """
+    Full process initialisation: connections, warm-up and optional preload.
+    Each step runs even if an earlier one failed; failed steps are recorded
+    (see failed_steps()) and keep is_ready() False.
+    """
+    _ready.clear()
+    _failed_steps.clear()
+    start = time.perf_counter()
+    _run_step("connections", open_connections)
+    if WORKER_WARMUP:
+        _run_step("warm_up", warm_up)
+    if WORKER_PRELOAD_INDEXES:
+        _failed_steps.extend(f"preload:{name}" for name in preload_indexes())
+    _ready.set()
+    elapsed = time.perf_counter() - start
+    if _failed_steps:
+        print(f"Worker: Process {os.getpid()} initialised in {elapsed:.2f}s, failed: {', '.join(_failed_steps)}")
+    else:
+        print(f"Worker: Process {os.getpid()} ready in {elapsed:.2f}s")
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    initialize_process()
@@ -0,0 +1,216 @@
+"""
+Push delivery of recognition results over Redis pub/sub.
+
+Workers publish each recognition task's result to `recognition:result:<task_id>`
+as soon as the task finishes. Every API process runs a single pattern
+subscriber thread that hands incoming results to the requests waiting on
+them, so a waiting client costs no Redis commands until its result arrives.
+The result backend is read only to catch up: once when a request starts
+waiting, and for every waiting request after the subscription reconnects.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from celery.signals import task_failure, task_success
+
+RESULT_CHANNEL_ENABLED = os.getenv("RESULT_CHANNEL_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CHANNEL_REDIS_URL = os.getenv("RESULT_CHANNEL_REDIS_URL") or os.getenv(
+    "CELERY_BROKER_URL", "redis://localhost:6379/0"
+)
+RESULT_CHANNEL_PREFIX = "recognition:result:"
+
+PUBLISHED_TASKS = {"recognize_audio_task", "recognize_batch_task", "recognize_fingerprints_task"}
+
+Fetch = Callable[[str], Optional[Dict[str, Any]]]
+
+_publisher = None
+_publisher_pid = None
+
+
+def channel_for(task_id: str) -> str:
+    return f"{RESULT_CHANNEL_PREFIX}{task_id}"
+
+
+def _redis_client(url: str = RESULT_CHANNEL_REDIS_URL):
+    import redis
+    if "upstash.io" in url:
+        url = url.replace("redis://", "rediss://")
+    return redis.Redis.from_url(url)
+
+
+def publish_result(task_id: str, result: Dict[str, Any], client=None) -> None:
+    """Publish a finished task's result to its channel; failures are logged, not raised."""
+    global _publisher, _publisher_pid
+    try:
+        if client is None:
+            if _publisher is None or _publisher_pid != os.getpid():
+                _publisher, _publisher_pid = _redis_client(), os.getpid()
+            client = _publisher
+        client.publish(channel_for(task_id), json.dumps(result, default=float))
+    except Exception as e:
+        print(f"Worker: Could not publish result of {task_id}: {e}")
+
+
+@task_success.connect
+def _publish_on_success(sender=None, result=None, **kwargs):
+    if RESULT_CHANNEL_ENABLED and sender is not None and sender.name in PUBLISHED_TASKS:
+        publish_result(sender.request.id, result)
+
+
+@task_failure.connect
+def _publish_on_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if RESULT_CHANNEL_ENABLED and sender is not None and sender.name in PUBLISHED_TASKS:
+        publish_result(task_id, {"status": "FAILURE", "error": str(exception)})
+
+
+class ResultSubscriber:
+    """
+    One pattern subscription per process, fanned out to asyncio waiters.
+
+    Results published while the subscription is down are recovered by reading
+    the result backend for every waiter once it is back up.
+
+    :param client: Redis client; created from RESULT_CHANNEL_REDIS_URL by default
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future, Optional[Fetch]]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pubsub = None
+        self._subscribed = False
+        self._closed = False
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="result-subscriber", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            try:
+                if self.client is None:
+                    self.client = _redis_client()
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.psubscribe(f"{RESULT_CHANNEL_PREFIX}*")
+                self._catch_up()
+                for message in self._pubsub.listen():
+                    if self._closed:
+                        return
+                    if message and message.get("type") == "pmessage":
+                        self._dispatch(message["channel"], message["data"])
+                return
+            except Exception as e:
+                # Results published until we are back are read by _catch_up()
+                with self._lock:
+                    self._subscribed = False
+                print(f"API: Result subscriber disconnected: {e}")
+                time.sleep(1.0)
+
+    def _catch_up(self) -> None:
+        """
+        Mark the subscription live and read the backend for the waiters that
+        registered before it was: their results may have been published
+        while nobody was listening. Later waiters check for themselves.
+        """
+        with self._lock:
+            self._subscribed = True
+            waiters = [(task_id, waiter) for task_id, entries in self._waiters.items() for waiter in entries]
+        fetched: Dict[str, Optional[Dict[str, Any]]] = {}
+        for task_id, (loop, future, fetch) in waiters:
+            if fetch is None or future.done():
+                continue
+            if task_id not in fetched:
+                try:
+                    fetched[task_id] = fetch(task_id)
+                except Exception as e:
+                    print(f"API: Could not read result of {task_id}: {e}")
+                    fetched[task_id] = None
+            if fetched[task_id] is not None:
+                loop.call_soon_threadsafe(_resolve, future, fetched[task_id])
+
+    def _dispatch(self, channel, data) -> None:
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        task_id = channel[len(RESULT_CHANNEL_PREFIX):]
+        with self._lock:
+            waiters = list(self._waiters.get(task_id, ()))
+        if not waiters:
+            return
+        try:
+            result = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        for loop, future, _ in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    async def wait(self, task_id: str, timeout: float, fetch: Optional[Fetch] = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait up to `timeout` seconds for a task's result; None if it did not arrive.
+
+        :param fetch: reads the result backend (None while pending). Called
+            once after subscribing, so a result published just before is not
+            missed, and again only if the subscription reconnects meanwhile.
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.setdefault(task_id, []).append((loop, future, fetch))
+            # Not subscribed yet: _catch_up() reads the backend once we are
+            subscribed = self._subscribed
+        try:
+            if fetch is not None and subscribed:
+                result = await loop.run_in_executor(None, fetch, task_id)
+                if result is not None:
+                    return result
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), remaining)
+            except asyncio.TimeoutError:
+                return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(task_id, [])
+                waiters[:] = [w for w in waiters if w[1] is not future]
+                if not waiters:
+                    self._waiters.pop(task_id, None)
+            if not future.done():
+                future.cancel()
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    def close(self) -> None:
+        self._closed = True
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+
+
+def _resolve(future: asyncio.Future, result: Dict[str, Any]) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+_subscriber: Optional[ResultSubscriber] = None
+
+
+def get_result_subscriber() -> ResultSubscriber:
+    """Return this process's result subscriber."""
+    global _subscriber
+    if _subscriber is None:
+        _subscriber = ResultSubscriber()
+    return _subscriber
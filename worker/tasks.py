@@ -1,13 +1,21 @@
 ﻿from celery import Celery
 import os
+import shutil
 from typing import List, Tuple, Dict
 
 # Fingerprint task imports
-from core.fingerprint.extractor import extract_fingerprint
-from core.repository.fingerprint_repository import FingerprintRepository
+from core.fingerprint.extractor import (
+    extract_fingerprint,
+    extract_fingerprint_from_pcm,
+    extract_fingerprint_segmented,
+    extract_fingerprints_parallel,
+)
+from core.repository.fingerprint_repository import FingerprintRepository, get_fingerprint_repository
 from core.fingerprint.matcher import FingerprintMatcher
 from core.fingerprint.threshold import HybridMatchStrategy
 from core.reco.features import extract_features
+from core.reco.feature_store import get_feature_store
+from core.reco.search import FALLBACK_FEATURE_WEIGHTS, weighted_cosine_similarity
 from core.repository.song_feature_repository import SongFeatureRepository
 import numpy as np
 
@@ -20,8 +28,16 @@ from core.noise.reducer import reduce_noise_array
 # This task needs its own database connection.
 from db.sql.database import get_db
 from core.repository.song_repository import SongRepository
-from core.repository.album_repository import AlbumRepository
-from core.repository.artist_repository import ArtistRepository
+from core.repository.metadata_cache import metadata_cache_stats
+from core.cache.recognition import get_recognition_cache, fingerprint_sketch
+from core.fingerprint.batcher import get_micro_batcher
+from core.fingerprint.versions import get_active_version, get_index_state, serving_versions
+from core.fingerprint.shadow import ShadowMatcher, record_comparison, should_shadow
+
+# Per-process setup (connections, warm-up, index preload) runs on worker_process_init
+from worker.lifecycle import ensure_connections, failed_steps, is_initialized, is_ready
+# Finished recognition tasks publish their result for push delivery (task_success signal)
+import worker.result_channel  # noqa: F401
 
 # --- Celery App Configuration ---
 # Get Redis URL from environment variable
@@ -71,25 +87,31 @@ celery_app.conf.worker_disable_rate_limits = True
 celery_app.conf.task_ignore_result = False  # Changed to False for specific tasks
 celery_app.conf.result_expires = 3600  # Results expire after 1 hour
 
+# Pool size for fingerprinting clips of a batch (0 = one per CPU)
+BATCH_EXTRACT_WORKERS = int(os.getenv("BATCH_EXTRACT_WORKERS", "0")) or None
+# Merge index lookups of concurrently running tasks (only useful with a threaded pool, -P threads)
+RECOGNITION_MICROBATCH = os.getenv("RECOGNITION_MICROBATCH", "false").lower() in ("1", "true", "yes")
+# Shadow matching runs as its own task: broker priority (Redis: 0 = highest, 9 = lowest) and optional queue
+SHADOW_TASK_PRIORITY = int(os.getenv("FINGERPRINT_SHADOW_PRIORITY", "9"))
+SHADOW_TASK_QUEUE = os.getenv("FINGERPRINT_SHADOW_QUEUE") or None
+
 # --- Task Definitions ---
 
 @celery_app.task(name="recognize_audio_task", ignore_result=False)
-def recognize_audio_task(path: str):
+def recognize_audio_task(path: str, content_key: str = None, sample_rate: int = None):
     """
     Extract fingerprints from an audio file and return matching songs.
     Uses SpectralMatch spectral peak fingerprinting for robust recognition.
+
+    :param content_key: hash of the uploaded bytes; successful results are
+        cached under it so a repeated upload can be answered without a task
+    :param sample_rate: set when the file holds raw pcm_s16le samples at this
+        rate (spooled by the API while its extraction pool was full)
     """
     import traceback
-    from core.fingerprint.extractor import extract_fingerprint
-    from core.repository.fingerprint_repository import FingerprintRepository
-    from mongoengine import connect
-    from dotenv import load_dotenv
 
-    # Ensure MongoDB connection in worker process
-    load_dotenv()
-    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-    db_name = os.getenv("DB_NAME", "tuneleap_db")
-    connect(db=db_name, host=mongo_uri, alias="default")
+    # Connections are opened once per process; this is a no-op after that
+    ensure_connections()
 
     try:
         print(f"Worker: Processing file {path}")
@@ -99,23 +121,99 @@ def recognize_audio_task(path: str):
             print(f"Worker: File not found: {path}")
             return {"status": "NO_MATCH", "error": "File not found"}
 
+        # The query is extracted and matched with one algorithm version, even if it is switched meanwhile
+        version = get_active_version()
+
         # Extract SpectralMatch fingerprints
         print("Worker: Extracting SpectralMatch fingerprints...")
-        query_fingerprints = extract_fingerprint(path)
+        if sample_rate is None:
+            query_fingerprints = extract_fingerprint(path, version)
+        else:
+            with open(path, "rb") as f:
+                query_fingerprints = extract_fingerprint_from_pcm(f.read(), sample_rate, version)
         print(f"Worker: Extracted {len(query_fingerprints)} fingerprints from query")
 
         if not query_fingerprints:
             print("Worker: No fingerprints extracted from query audio")
             return {"status": "NO_MATCH"}
 
+        result = recognize_fingerprints(query_fingerprints, content_key=content_key, version=version)
+        if sample_rate is None:
+            _shadow_compare(path, version)
+        return result
+
+    except Exception as e:
+        print(f"Worker: Error during recognition: {e}")
+        traceback.print_exc()
+        return {"status": "ERROR", "error": str(e)}
+    finally:
+        # Clean up file after processing
+        if os.path.exists(path):
+            print(f"Worker: Cleaning up file {path}")
+            os.remove(path)
+
+
+@celery_app.task(name="recognize_fingerprints_task", ignore_result=False)
+def recognize_fingerprints_task(query_fingerprints: List[Tuple[str, int]], content_key: str = None,
+                                version: int = None):
+    """
+    Match fingerprints computed by the API (raw PCM or client-side uploads)
+    and return matching songs, in the same format as recognize_audio_task.
+
+    :param version: algorithm version the fingerprints were computed with;
+        the active version if not given
+    """
+    import traceback
+
+    ensure_connections()
+
+    try:
+        query_fingerprints = [(h, int(offset)) for h, offset in query_fingerprints]
+        print(f"Worker: Matching {len(query_fingerprints)} precomputed fingerprints")
+        if not query_fingerprints:
+            return {"status": "NO_MATCH"}
+        return recognize_fingerprints(query_fingerprints, content_key=content_key, version=version)
+    except Exception as e:
+        print(f"Worker: Error during recognition: {e}")
+        traceback.print_exc()
+        return {"status": "ERROR", "error": str(e)}
+
+
+def recognize_fingerprints(query_fingerprints: List[Tuple[str, int]], content_key: str = None,
+                           version: int = None) -> dict:
+    """
+    Match query fingerprints against the index and return the task result
+    ({"status": "SUCCESS", "results": [...]} or {"status": "NO_MATCH"}).
+    Shared by the recognition task and the API's synchronous path.
+
+    :param content_key: hash of the uploaded bytes to cache the result under
+    :param version: algorithm version the fingerprints were computed with;
+        they are matched against that version's index (the active one if not given)
+    """
+    if version is None:
+        version = get_active_version()
+
+    # Near-identical clips (same broadcast, re-encoded upload) reuse an earlier result
+    sketch = fingerprint_sketch(fp[0] for fp in query_fingerprints)
+    cached = _get_cached_result(sketch)
+    if cached is not None:
+        print("Worker: Returning cached result for a near-identical clip")
+        _cache_result(cached, content_key=content_key)
+        return cached
+
+    if RECOGNITION_MICROBATCH:
+        # Lookup is shared with the other tasks in flight in this process
+        print("Worker: Matching fingerprints in a micro-batch...")
+        song_scores = get_micro_batcher(version).match(query_fingerprints)
+    else:
         # Get stored fingerprints
         print("Worker: Loading stored fingerprints...")
-        repo = FingerprintRepository()
-        
+        repo = get_fingerprint_repository(version)
+
         # Extract just the hashes from query fingerprints for efficient lookup
         query_hashes = [fp[0] for fp in query_fingerprints]
         stored_fingerprints = repo.get_fingerprints_by_hashes(query_hashes)
-        
+
         if not stored_fingerprints:
             print("Worker: No matching fingerprints found in database")
             return {"status": "NO_MATCH"}
@@ -123,76 +221,188 @@ def recognize_audio_task(path: str):
         # Match fingerprints using time-offset algorithm
         print("Worker: Matching fingerprints...")
         song_scores = match_spectral_fingerprints(query_fingerprints, stored_fingerprints)
-        
-        if not song_scores:
-            print("Worker: No matches found")
-            return {"status": "NO_MATCH"}
+    
+    if not song_scores:
+        print("Worker: No matches found")
+        return {"status": "NO_MATCH"}
 
-        # Sort by score and get top matches
-        sorted_matches = sorted(song_scores.items(), key=lambda x: x[1], reverse=True)
-        print(f"Worker: Top matches: {sorted_matches[:5]}")
+    # Sort by score and get top matches
+    results = _rank_song_scores(song_scores)
+    print(f"Worker: Top matches: {[(r['song_id'], r['match_score']) for r in results]}")
 
-        # Convert to probabilities
-        total_score = sum(score for _, score in sorted_matches[:10])  # Top 10 for probability calculation
-        
-        results = []
-        db = next(get_db())
-        try:
-            song_repo = SongRepository(db)
-            album_repo = AlbumRepository(db)
-            artist_repo = ArtistRepository(db)
-            
-            for song_id, score in sorted_matches[:5]:  # Return top 5 matches
-                probability = score / total_score if total_score > 0 else 0
-                item = {
-                    "song_id": song_id,
-                    "probability": probability,
-                    "match_score": score
-                }
-                
-                # Get song details
-                song = song_repo.get_by_id(song_id)
-                if song:
-                    item["title"] = song.title
-                    item["artist_id"] = song.artist_id
-                    
-                    # Get artist name
-                    artist = artist_repo.get_by_id(song.artist_id)
-                    if artist:
-                        item["artist_name"] = artist.name
-                    
-                    # Get album details if available
-                    if song.album_id:
-                        album = album_repo.get_by_id(song.album_id)
-                        if album:
-                            item["album_id"] = song.album_id
-                            item["album_name"] = album.title
-                            if album.album_image:
-                                item["album_image"] = album.album_image
-                
-                results.append(item)
-            
-            print(f"Worker: Recognition complete with {len(results)} results")
-            
-        except Exception as e:
-            print(f"Worker: Error getting song details: {e}")
-            return {"status": "ERROR", "error": str(e)}
-        finally:
-            db.close()
+    try:
+        _enrich_results(results)
+        print(f"Worker: Recognition complete with {len(results)} results")
+    except Exception as e:
+        print(f"Worker: Error getting song details: {e}")
+        return {"status": "ERROR", "error": str(e)}
+
+    result = {"status": "SUCCESS", "results": results}
+    _cache_result(result, content_key=content_key, sketch=sketch)
+    return result
 
-        return {"status": "SUCCESS", "results": results}
 
+def _shadow_compare(path: str, active_version: int) -> None:
+    """
+    While a new algorithm version is being built, send a sample of live
+    queries to shadow_compare_task, which matches them with both versions.
+    The clip is copied, since the recognition task removes its upload.
+    """
+    building_version = get_index_state()["building_version"]
+    if building_version is None or building_version == active_version or not should_shadow():
+        return
+    shadow_path = f"{path}.shadow"
+    try:
+        shutil.copyfile(path, shadow_path)
+        shadow_compare_task.apply_async(
+            (shadow_path, active_version, building_version),
+            priority=SHADOW_TASK_PRIORITY,
+            queue=SHADOW_TASK_QUEUE,
+        )
     except Exception as e:
-        print(f"Worker: Error during recognition: {e}")
-        traceback.print_exc()
-        return {"status": "ERROR", "error": str(e)}
+        print(f"Worker: Could not queue shadow matching with v{building_version}: {e}")
+        if os.path.exists(shadow_path):
+            os.remove(shadow_path)
+
+
+@celery_app.task(name="shadow_compare_task", ignore_result=True)
+def shadow_compare_task(path: str, active_version: int, building_version: int) -> None:
+    """
+    Recognize a live query's clip with the active and the building version
+    and record how both did. Removes the clip when done.
+    """
+    ensure_connections()
+
+    try:
+        record_comparison(ShadowMatcher(active_version, building_version).compare_file(path))
+    except Exception as e:
+        print(f"Worker: Shadow matching with v{building_version} failed: {e}")
     finally:
-        # Clean up file after processing
         if os.path.exists(path):
-            print(f"Worker: Cleaning up file {path}")
             os.remove(path)
 
 
+@celery_app.task(name="recognize_batch_task", ignore_result=False)
+def recognize_batch_task(paths: List[str], filenames: List[str] = None):
+    """
+    Recognize many clips in one task.
+
+    Clips are fingerprinted in parallel on a worker pool, the union of their
+    query hashes is looked up in the index once, and the postings are then
+    matched per clip. Returns {"status": "SUCCESS", "results": [...]} with one
+    entry per clip, in input order.
+    """
+    import traceback
+
+    ensure_connections()
+    filenames = filenames or [os.path.basename(path) for path in paths]
+
+    try:
+        print(f"Worker: Processing batch of {len(paths)} clips")
+        version = get_active_version()
+        all_fingerprints = extract_fingerprints_parallel(paths, max_workers=BATCH_EXTRACT_WORKERS, version=version)
+
+        # One index lookup for every distinct hash in the batch
+        union_hashes = list({fp[0] for fingerprints in all_fingerprints for fp in fingerprints})
+        stored_fingerprints = get_fingerprint_repository(version).get_fingerprints_by_hashes(union_hashes) if union_hashes else {}
+        print(f"Worker: Looked up {len(union_hashes)} distinct hashes for the batch")
+
+        clip_results = []
+        for filename, query_fingerprints in zip(filenames, all_fingerprints):
+            song_scores = match_spectral_fingerprints(query_fingerprints, stored_fingerprints)
+            if song_scores:
+                clip_results.append({"filename": filename, "status": "SUCCESS", "results": _rank_song_scores(song_scores)})
+            else:
+                clip_results.append({"filename": filename, "status": "NO_MATCH", "results": []})
+
+        # Details for every clip's matches in one query
+        _enrich_results([item for clip in clip_results for item in clip["results"]])
+        return {"status": "SUCCESS", "results": clip_results}
+
+    except Exception as e:
+        print(f"Worker: Error during batch recognition: {e}")
+        traceback.print_exc()
+        return {"status": "ERROR", "error": str(e)}
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _rank_song_scores(song_scores: Dict[int, int], limit: int = 5) -> List[dict]:
+    """
+    Turn song_id -> match score into the top result items.
+    Probabilities are relative to the summed score of the top 10 songs.
+    """
+    sorted_matches = sorted(song_scores.items(), key=lambda x: x[1], reverse=True)
+    total_score = sum(score for _, score in sorted_matches[:10])
+    return [
+        {
+            "song_id": song_id,
+            "probability": score / total_score if total_score > 0 else 0,
+            "match_score": score
+        }
+        for song_id, score in sorted_matches[:limit]
+    ]
+
+
+def _enrich_results(items: List[dict]) -> List[dict]:
+    """Attach song, artist and album details to result items using one query."""
+    if not items:
+        return items
+    db = next(get_db())
+    try:
+        details = SongRepository(db).get_details_by_ids([item["song_id"] for item in items])
+    finally:
+        db.close()
+    for item in items:
+        _attach_song_details(item, details.get(item["song_id"]))
+    return items
+
+
+def _get_cached_result(sketch):
+    """Look up a result by fingerprint sketch; cache failures never fail recognition."""
+    if sketch is None:
+        return None
+    try:
+        return get_recognition_cache().get_by_sketch(sketch)
+    except Exception as e:
+        print(f"Worker: Recognition cache lookup failed: {e}")
+        return None
+
+
+def _cache_result(result: dict, content_key: str = None, sketch=None) -> None:
+    """Store a successful result under the upload's content key and/or its fingerprint sketch."""
+    try:
+        cache = get_recognition_cache()
+        if content_key:
+            cache.put_by_content(content_key, result)
+        if sketch is not None:
+            cache.put_by_sketch(sketch, result)
+    except Exception as e:
+        print(f"Worker: Recognition cache store failed: {e}")
+
+
+def _attach_song_details(item: dict, details: dict) -> dict:
+    """
+    Copy display fields from a SongRepository.get_details_by_ids row into a result item.
+    Album fields are only set when the song belongs to an album.
+    """
+    if not details:
+        return item
+
+    item["title"] = details["title"]
+    item["artist_id"] = details["artist_id"]
+    if details["artist_name"] is not None:
+        item["artist_name"] = details["artist_name"]
+    if details["album_id"] is not None:
+        item["album_id"] = details["album_id"]
+        item["album_name"] = details["album_name"]
+        if details["album_image"]:
+            item["album_image"] = details["album_image"]
+    return item
+
+
 def match_spectral_fingerprints(query_fingerprints: List[Tuple[str, int]], 
                               stored_fingerprints: Dict[str, List[Tuple[int, int]]]) -> Dict[int, int]:
     """
@@ -234,23 +444,11 @@ def _process_fingerprint_matches(match_counts: dict, path: str):
 
     db = next(get_db())
     try:
-        song_repo = SongRepository(db)
-        album_repo = AlbumRepository(db)
+        details = SongRepository(db).get_details_by_ids(list(match_counts))
         for song_id, count in match_counts.items():
             prob = count / total
             item = {"song_id": song_id, "probability": prob}
-            song = song_repo.get_by_id(song_id)
-            if song:
-                item["title"] = song.title
-                item["artist_id"] = song.artist_id
-                item["album_id"] = song.album_id
-                
-                # Get album image if available
-                if song.album_id:
-                    album = album_repo.get_by_id(song.album_id)
-                    if album and album.album_image:
-                        item["album_image"] = album.album_image
-                        
+            _attach_song_details(item, details.get(song_id))
             results.append(item)
         print(f"Worker: Exact match results: {results}")
     except Exception as e:
@@ -266,7 +464,6 @@ def _process_similarity_matches(path: str):
     """Process feature-based similarity matches with enhanced tolerance for degraded audio."""
     try:
         from core.reco.features import extract_features
-        from core.repository.song_feature_repository import SongFeatureRepository
         import numpy as np
 
         print("Worker: Extracting features from query audio...")
@@ -276,34 +473,25 @@ def _process_similarity_matches(path: str):
             print("Worker: Could not extract features from query")
             return {"status": "NO_MATCH"}
 
-        # Get all stored song features
-        feature_repo = SongFeatureRepository()
-        all_features = feature_repo.get_all_features()
+        # Stored song features, cached in this process and refreshed incrementally
+        engine = get_feature_store().engine()
 
-        if not all_features:
+        if not len(engine):
             print("Worker: No stored song features found")
             return {"status": "NO_MATCH"}
 
-        print(f"Worker: Comparing against {len(all_features)} stored songs")
-
-        # Calculate similarities directly
-        similarities = []
-        for song_id, stored_features in all_features.items():
-            similarity = _compute_weighted_cosine_similarity(query_features, stored_features)
-            similarities.append((song_id, similarity))
+        print(f"Worker: Comparing against {len(engine)} stored songs")
 
         # Lower threshold for phone-to-PC recognition (was 0.5)
         threshold = 0.3  # More tolerant of degraded audio
-        filtered_similarities = [(sid, sim) for sid, sim in similarities if sim >= threshold]
 
-        if not filtered_similarities:
+        # Top 10 by similarity for better results (increased from 5), scored as one matrix product
+        top_similarities = engine.search(query_features, k=10, threshold=threshold)
+
+        if not top_similarities:
             print(f"Worker: No similarities above threshold {threshold}")
             return {"status": "NO_MATCH"}
 
-        # Sort by similarity descending and take top 10 for better results
-        filtered_similarities.sort(key=lambda x: x[1], reverse=True)
-        top_similarities = filtered_similarities[:10]  # Increased from 5 to 10
-
         print(f"Worker: Top similarities: {[(sid, f'{sim:.3f}') for sid, sim in top_similarities]}")
 
         # Apply softmax to similarity scores for better probability distribution
@@ -320,24 +508,12 @@ def _process_similarity_matches(path: str):
 
         db = next(get_db())
         try:
-            song_repo = SongRepository(db)
-            album_repo = AlbumRepository(db)
-            
+            details = SongRepository(db).get_details_by_ids([song_id for song_id, _ in top_similarities])
+
             for i, (song_id, similarity) in enumerate(top_similarities):
                 prob = probabilities[i]
                 item = {"song_id": song_id, "probability": prob, "similarity": similarity}
-                song = song_repo.get_by_id(song_id)
-                if song:
-                    item["title"] = song.title
-                    item["artist_id"] = song.artist_id
-                    item["album_id"] = song.album_id
-                    
-                    # Get album image if available
-                    if song.album_id:
-                        album = album_repo.get_by_id(song.album_id)
-                        if album and album.album_image:
-                            item["album_image"] = album.album_image
-                            
+                _attach_song_details(item, details.get(song_id))
                 results.append(item)
 
             # Sort results by final probability
@@ -366,44 +542,10 @@ def _process_similarity_matches(path: str):
 def _compute_weighted_cosine_similarity(features1: np.ndarray, features2: np.ndarray) -> float:
     """
     Compute weighted cosine similarity optimized for phone-to-PC recognition.
-    Adjusted weights to prioritize features that are more robust to noise and degradation.
+    Weights prioritize features that are more robust to noise and degradation
+    (see core.reco.search.FALLBACK_FEATURE_WEIGHTS).
     """
-    if len(features1) == 0 or len(features2) == 0:
-        return 0.0
-
-    # Ensure same length
-    min_len = min(len(features1), len(features2))
-    f1 = features1[:min_len]
-    f2 = features2[:min_len]
-
-    # Create feature weights optimized for degraded audio (55 features expected)
-    if min_len >= 55:
-        weights = np.concatenate([
-            np.full(12, 3.0),  # Chroma - highest weight (very robust to noise)
-            np.full(13, 1.5),  # MFCC mean - medium weight (somewhat affected by noise)
-            np.full(13, 0.8),  # MFCC std - lower weight (highly affected by noise)
-            np.full(6, 1.0),   # Spectral features - medium weight
-            np.full(7, 2.0),   # Spectral contrast - high weight (robust to noise)
-            np.full(2, 0.3),   # Rhythm - very low weight (unreliable with noise)
-            np.full(2, 0.2)    # ZCR - lowest weight (very noise-sensitive)
-        ])
-    else:
-        # Fallback for different feature lengths
-        weights = np.ones(min_len)
-
-    weights = weights[:min_len]
-
-    # Apply weights and normalize
-    f1_weighted = f1 * weights
-    f2_weighted = f2 * weights
-
-    norm1 = np.linalg.norm(f1_weighted)
-    norm2 = np.linalg.norm(f2_weighted)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return float(np.dot(f1_weighted, f2_weighted) / (norm1 * norm2))
+    return weighted_cosine_similarity(features1, features2, FALLBACK_FEATURE_WEIGHTS)
 
 
 @celery_app.task(name="store_fingerprint")
@@ -411,33 +553,50 @@ def store_fingerprint(file_path: str, song_id: int) -> str:
     """
     Extract and store SpectralMatch fingerprints for a song.
     Now uses SpectralMatch algorithm for better partial song recognition.
+    Long recordings are fingerprinted in parallel segments.
+    While a new algorithm version is being built, the song is stored in its
+    index as well.
     """
-    from mongoengine import connect
-    from dotenv import load_dotenv
-
-    # Ensure MongoDB connection in worker process
-    load_dotenv()
-    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-    db_name = os.getenv("DB_NAME", "tuneleap_db")
-    connect(db=db_name, host=mongo_uri, alias="default")
+    ensure_connections()
 
     try:
-        # Extract SpectralMatch fingerprints
-        fingerprints = extract_fingerprint(file_path)
-        
-        if not fingerprints:
-            return f"No fingerprints extracted for song_id {song_id}"
-        
-        # Store fingerprints
-        repo = FingerprintRepository()
-        count = repo.store_spectral_fingerprints(song_id, fingerprints)
-        
-        return f"Stored {count} SpectralMatch fingerprints for song_id {song_id}"
+        versions = serving_versions()
+        counts = []
+        stored = False
+        for version in versions:
+            # Extract SpectralMatch fingerprints
+            fingerprints = extract_fingerprint_segmented(file_path, version=version)
+
+            if not fingerprints:
+                # The other versions' extractors may still find some
+                counts.append(f"0 (v{version}, none extracted)")
+                continue
+
+            # Store fingerprints
+            repo = get_fingerprint_repository(version)
+            counts.append(f"{repo.store_spectral_fingerprints(song_id, fingerprints)} (v{version})")
+            stored = True
+
+        if not stored:
+            return f"No fingerprints extracted for song_id {song_id} ({', '.join(f'v{v}' for v in versions)})"
+        return f"Stored {' + '.join(counts)} SpectralMatch fingerprints for song_id {song_id}"
         
     except Exception as e:
         return f"Error processing song_id {song_id}: {str(e)}"
 
 
+@celery_app.task(name="worker_status", ignore_result=False)
+def worker_status() -> dict:
+    """
+    Report whether the worker process that picked up this task has finished
+    warm-up. "ready" is False while it is still starting and after any failed
+    step, which "failed_steps" names.
+    """
+    return {"pid": os.getpid(), "ready": is_ready(), "initialized": is_initialized(),
+            "failed_steps": failed_steps(), "metadata_cache": metadata_cache_stats(),
+            "feature_store": get_feature_store().stats()}
+
+
 @celery_app.task(name="reduce_noise")
 def reduce_noise(file_path: str) -> str:
     """
@@ -455,14 +614,7 @@ def extract_and_store_features_task(file_path: str, song_id: int):
     """
     Extracts audio features for a song and stores them in MongoDB.
     """
-    from mongoengine import connect
-    from dotenv import load_dotenv
-
-    # Ensure MongoDB connection in worker process
-    load_dotenv()
-    mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-    db_name = os.getenv("DB_NAME", "tuneleap_db")
-    connect(db=db_name, host=mongo_uri, alias="default")
+    ensure_connections()
 
     try:
         feature_vector = extract_features(file_path)